@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+""" benchmark photosmeta against a synthetic library and a stub exiftool
+
+    Runs photosmeta's main() on a generated library of small JPEG files using the
+    fake osxphotos/osxmetadata modules in fakes.py and fake_exiftool.py in place
+    of exiftool, and reports throughput, exiftool process/command counts,
+    bytes written by exiftool and peak RSS for each scenario.
+
+    Each scenario runs in its own process so peak RSS and run statistics are per run.
+    The stub's latencies are configurable to model a real exiftool:
+    --startup is the cost of starting exiftool (Perl), --latency the cost per command
+    and --file-latency the cost per file.
+
+    examples:
+        python benchmarks/bench.py
+        python benchmarks/bench.py --photos 5000 --startup 0.2 --latency 0.01 --scenario inplace rerun
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# scenario name -> (photosmeta arguments, number of unmeasured runs before the measured run)
+# every run also gets: LIBRARY --all --force --noprogress
+# {tmp} is replaced with the scenario's temporary folder, {jobs} with --jobs
+SCENARIOS = {
+    "inplace": (["--inplace"], 0),
+    "inplace-jobs": (["--inplace", "--jobs", "{jobs}"], 0),
+    "rerun": (["--inplace"], 1),
+    "state": (["--inplace", "--state", "{tmp}/state.db"], 1),
+    "xattr": (["--inplace", "--xattrtag", "--xattrperson"], 0),
+    "backup": ([], 0),
+    "undo-log": (["--undo-log", "{tmp}/undo.jsonl"], 0),
+    "export": (["--export", "{tmp}/export", "--export-by-date", "--edited"], 0),
+    "export-update": (
+        ["--export", "{tmp}/export", "--export-by-date", "--edited", "--export-update"],
+        1,
+    ),
+    "list": (["--list", "keyword"], 1),
+    "import": (None, 0),
+}
+
+# modules that must not be imported just to start photosmeta
+HEAVY_MODULES = ["osxphotos", "osxmetadata", "tqdm"]
+
+
+def run_child(metrics_file, photosmeta_args):
+    """ run photosmeta's main() in this process with the fakes installed """
+    sys.path.insert(0, BENCH_DIR)
+    sys.path.insert(0, REPO_DIR)
+    import fakes
+
+    fakes.install()
+
+    from photosmeta import __main__ as photosmeta_main
+    from photosmeta._stats import peak_rss_mb, stats
+
+    sys.argv = ["photosmeta", *photosmeta_args]
+    start = time.perf_counter()
+    try:
+        photosmeta_main.main()
+    except SystemExit:
+        pass
+    elapsed = time.perf_counter() - start
+
+    with open(metrics_file, "w") as fd:
+        json.dump(
+            {
+                "elapsed": elapsed,
+                "peak_rss_mb": peak_rss_mb(),
+                "counters": dict(stats.counters),
+            },
+            fd,
+        )
+
+
+def import_time():
+    """ return (seconds to import photosmeta.__main__, heavy modules imported) """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import photosmeta.__main__"],
+        cwd=REPO_DIR,
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    total = 0
+    heavy = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if name == "photosmeta.__main__":
+            total = int(cumulative) / 1_000_000
+        if name.split(".")[0] in HEAVY_MODULES:
+            heavy.add(name.split(".")[0])
+    return total, sorted(heavy)
+
+
+def run_scenario(name, options):
+    """ run scenario name, return dict of results """
+    if name == "import":
+        seconds, heavy = import_time()
+        return {"scenario": name, "seconds": seconds, "heavy_imports": heavy}
+
+    args, warmups = SCENARIOS[name]
+    tmp = tempfile.mkdtemp(prefix=f"photosmeta_bench_{name}_")
+    try:
+        library = os.path.join(tmp, "library")
+        sys.path.insert(0, BENCH_DIR)
+        import fakes
+
+        fakes.make_library(library, options.photos)
+        os.makedirs(os.path.join(tmp, "export"))
+
+        bin_dir = os.path.join(tmp, "bin")
+        os.makedirs(bin_dir)
+        os.symlink(
+            os.path.join(BENCH_DIR, "fake_exiftool.py"),
+            os.path.join(bin_dir, "exiftool"),
+        )
+        stats_file = os.path.join(tmp, "exiftool_stats")
+        env = dict(
+            os.environ,
+            PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            XDG_CACHE_HOME=os.path.join(tmp, "cache"),
+            FAKE_EXIFTOOL_STARTUP=str(options.startup),
+            FAKE_EXIFTOOL_LATENCY=str(options.latency),
+            FAKE_EXIFTOOL_FILE_LATENCY=str(options.file_latency),
+            FAKE_EXIFTOOL_STATS=stats_file,
+        )
+        args = [
+            library,
+            "--all",
+            "--force",
+            "--noprogress",
+            *[a.format(tmp=tmp, jobs=options.jobs) for a in args],
+        ]
+        metrics_file = os.path.join(tmp, "metrics.json")
+        for _ in range(warmups + 1):
+            if os.path.exists(stats_file):
+                os.unlink(stats_file)
+            subprocess.run(
+                [sys.executable, __file__, "--child", metrics_file, "--", *args],
+                env=env,
+                stdout=None if options.verbose else subprocess.DEVNULL,
+                stderr=None if options.verbose else subprocess.DEVNULL,
+                check=True,
+            )
+
+        with open(metrics_file) as fd:
+            metrics = json.load(fd)
+        processes = commands = written = 0
+        if os.path.exists(stats_file):
+            with open(stats_file) as fd:
+                for line in fd:
+                    fields = line.split()
+                    if fields[0] == "start":
+                        processes += 1
+                    else:
+                        commands += 1
+                        written += int(fields[2])
+        return {
+            "scenario": name,
+            "photos": options.photos,
+            "seconds": metrics["elapsed"],
+            "photos_per_sec": options.photos / metrics["elapsed"],
+            "exiftool_processes": processes,
+            "exiftool_commands": commands,
+            "mb_written": written / (1024 * 1024),
+            "peak_rss_mb": metrics["peak_rss_mb"],
+            "counters": metrics["counters"],
+        }
+    finally:
+        if not options.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            print(f"kept {tmp}", file=sys.stderr)
+
+
+def print_table(results):
+    """ print results as a table """
+    print(
+        f"{'scenario':<14}{'photos':>8}{'seconds':>10}{'photos/s':>11}"
+        f"{'procs':>7}{'cmds':>8}{'MB written':>12}{'peak MB':>9}"
+    )
+    for r in results:
+        if r["scenario"] == "import":
+            heavy = ", ".join(r["heavy_imports"]) or "none"
+            print(
+                f"{'import':<14}{'':>8}{r['seconds']:>10.3f}"
+                f"   heavy modules imported at startup: {heavy}"
+            )
+            continue
+        print(
+            f"{r['scenario']:<14}{r['photos']:>8}{r['seconds']:>10.2f}"
+            f"{r['photos_per_sec']:>11.1f}{r['exiftool_processes']:>7}"
+            f"{r['exiftool_commands']:>8}{r['mb_written']:>12.2f}{r['peak_rss_mb']:>9.1f}"
+        )
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        run_child(sys.argv[2], sys.argv[4:])
+        return
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--photos", type=int, default=1000, help="photos in library")
+    parser.add_argument(
+        "--scenario",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+        help="scenarios to run (default: all)",
+    )
+    parser.add_argument(
+        "--startup", type=float, default=0.0, help="exiftool startup time, seconds"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="exiftool time per command, seconds"
+    )
+    parser.add_argument(
+        "--file-latency",
+        type=float,
+        default=0.0,
+        help="exiftool time per file, seconds",
+    )
+    parser.add_argument("--jobs", type=int, default=4, help="--jobs for inplace-jobs")
+    parser.add_argument("--json", help="also write results as JSON to this file")
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the temporary folders"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="show photosmeta's output"
+    )
+    options = parser.parse_args()
+
+    results = [run_scenario(name, options) for name in options.scenario]
+    print_table(results)
+    if options.json:
+        with open(options.json, "w") as fd:
+            json.dump(results, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+""" benchmark the copy modes used by photosmeta --export
+
+    Copies a set of generated files with the export path used before --copy-mode
+    (shutil.copy2) and with each --copy-mode backend, and reports throughput.
+    Run it with --dir on the filesystem to measure: tmpfs (e.g. /dev/shm) for the
+    cost of the copy itself, btrfs or XFS (or APFS on macOS) to see reflink,
+    a disk for real I/O. Modes the filesystem doesn't support are reported as such.
+
+    The page cache is not dropped between runs so, unless the files are larger
+    than memory, the source files are read from the cache.
+
+    examples:
+        python benchmarks/bench_copy.py --dir /dev/shm
+        python benchmarks/bench_copy.py --dir /mnt/btrfs --files 50 --size 64
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from photosmeta._copy import COPY_MODES, CopyModeError, copy_data  # noqa: E402
+
+
+def make_files(folder, count, size_mb):
+    """ create count files of size_mb MB of random data in folder, return their paths """
+    paths = []
+    block = os.urandom(1024 * 1024)
+    for i in range(count):
+        path = os.path.join(folder, f"IMG_{i:06d}.jpg")
+        with open(path, "wb") as fd:
+            for _ in range(size_mb):
+                fd.write(block)
+        paths.append(path)
+    return paths
+
+
+def _copy2(src, dest_path):
+    shutil.copy2(src, dest_path)
+    return "copy2"
+
+
+def run(name, copy, sources, dest, repeat):
+    """ copy sources to folder dest with copy(src, dest_path) repeat times,
+        return result dict for the fastest run """
+    methods = set()
+    seconds = None
+    for _ in range(repeat):
+        shutil.rmtree(dest, ignore_errors=True)
+        os.makedirs(dest)
+        start = time.perf_counter()
+        try:
+            for src in sources:
+                methods.add(copy(src, os.path.join(dest, os.path.basename(src))))
+        except CopyModeError as e:
+            return {"mode": name, "error": str(e)}
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    size = sum(os.path.getsize(src) for src in sources)
+    return {
+        "mode": name,
+        "methods": sorted(methods),
+        "files": len(sources),
+        "seconds": seconds,
+        "mb_per_sec": size / (1024 * 1024) / seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--dir", help="folder to run in (default: system temp folder)")
+    parser.add_argument("--files", type=int, default=100, help="number of files")
+    parser.add_argument("--size", type=int, default=8, help="size of each file, MB")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs of each mode, the fastest is shown"
+    )
+    parser.add_argument(
+        "--hash",
+        action="store_true",
+        help="also hash the data as it's copied, as --export-update does",
+    )
+    parser.add_argument("--json", help="also write results as JSON to this file")
+    options = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="photosmeta_bench_copy_", dir=options.dir)
+    try:
+        src = os.path.join(tmp, "src")
+        os.mkdir(src)
+        sources = make_files(src, options.files, options.size)
+
+        def _mode(mode):
+            def _copy(src, dest_path):
+                digest = hashlib.sha256() if options.hash else None
+                return copy_data(src, dest_path, mode, digest)
+
+            return _copy
+
+        runs = [("copy2 (before)", _copy2)] + [(m, _mode(m)) for m in COPY_MODES]
+        results = [
+            run(name, copy, sources, os.path.join(tmp, f"dest{i}"), options.repeat)
+            for i, (name, copy) in enumerate(runs)
+        ]
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(
+        f"{options.files} files of {options.size} MB in {options.dir or 'temp folder'}"
+    )
+    print(f"{'mode':<16}{'seconds':>10}{'MB/s':>12}  method")
+    for r in results:
+        if "error" in r:
+            print(f"{r['mode']:<16}{'':>22}  not supported: {r['error']}")
+            continue
+        print(
+            f"{r['mode']:<16}{r['seconds']:>10.3f}{r['mb_per_sec']:>12.1f}"
+            f"  {', '.join(r['methods'])}"
+        )
+    if options.json:
+        with open(options.json, "w") as fd:
+            json.dump(results, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
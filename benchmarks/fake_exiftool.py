@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# stub exiftool used by the benchmarks
+# supports what photosmeta uses: -stay_open True -@ - with -executeNNN/-echo4,
+# reads with -G -n -j and TAG=VALUE (or TAG#=VALUE) writes; tags are kept in a
+# path.exif.json file and each write rewrites the image file like exiftool does,
+# embedding the tags in
+# EXIF, XMP and IPTC segments so photosmeta's native JPEG reader finds them;
+# without an -overwrite_original option a path_original backup copy is kept;
+# files are replaced by a new file unless written with -overwrite_original_in_place
+# environment:
+#   FAKE_EXIFTOOL_STARTUP: seconds to sleep at process start (Perl startup)
+#   FAKE_EXIFTOOL_LATENCY: seconds to sleep per command
+#   FAKE_EXIFTOOL_FILE_LATENCY: seconds to sleep per file in a command
+#   FAKE_EXIFTOOL_STATS: file to append "start" and "cmd FILES BYTES_WRITTEN" lines to
+#   FAKE_EXIFTOOL_CRASH: exit without answering a command naming a file whose path
+#                        contains this string, like exiftool crashing on a bad file
+
+import json
+import os
+import re
+import struct
+import sys
+import time
+from xml.sax.saxutils import escape
+
+_LIST_TAGS = {"IPTC:Keywords", "XMP:TagsList", "XMP:Subject", "XMP:PersonInImage"}
+_DMS_RE = re.compile(r"(\d+) deg (\d+)' ([\d.]+)")
+_CSTR_RE = re.compile(r"\\(x[0-9a-fA-F]{2}|.)")
+_ESCAPES = {"n": "\n", "r": "\r", "t": "\t"}
+_OPTIONS = {
+    "-G",
+    "-j",
+    "-n",
+    "-P",
+    "-sort",
+    "-overwrite_original_in_place",
+    "-overwrite_original",
+}
+
+
+def _unescape(match):
+    """ decode one C escape sequence of an #[CSTR] argfile line """
+    code = match[1]
+    if code.startswith("x"):
+        return chr(int(code[1:], 16))
+    return _ESCAPES.get(code, code)
+
+
+def _stat(line):
+    stats = os.environ.get("FAKE_EXIFTOOL_STATS")
+    if stats:
+        with open(stats, "a") as fd:
+            fd.write(line + "\n")
+
+
+def _load(path):
+    try:
+        with open(f"{path}.exif.json") as fd:
+            return json.load(fd)
+    except FileNotFoundError:
+        return {}
+
+
+def _values(tags, tag):
+    value = tags.get(tag)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _exif_segment(tags):
+    """ return APP1 EXIF segment payload (big endian TIFF) for tags """
+
+    def ascii_entry(value):
+        data = str(value).encode("utf-8") + b"\0"
+        return (2, len(data), data)
+
+    def gps_entry(value):
+        match = _DMS_RE.match(str(value))
+        if match:
+            deg, mins, secs = int(match[1]), int(match[2]), float(match[3])
+        else:
+            value = abs(float(value))
+            deg = int(value)
+            mins = int((value - deg) * 60)
+            secs = (value - deg - mins / 60) * 3600
+        data = struct.pack(">6I", deg, 1, mins, 1, round(secs * 100), 100)
+        return (5, 3, data)
+
+    ifd0, exif, gps = {}, {}, {}
+    for tag, ifd, tag_id in [
+        ("EXIF:ImageDescription", ifd0, 0x010E),
+        ("EXIF:ModifyDate", ifd0, 0x0132),
+        ("EXIF:DateTimeOriginal", exif, 0x9003),
+        ("EXIF:OffsetTimeOriginal", exif, 0x9011),
+    ]:
+        if tag in tags:
+            ifd[tag_id] = ascii_entry(tags[tag])
+    for tag, tag_id in [("EXIF:GPSLatitude", 2), ("EXIF:GPSLongitude", 4)]:
+        if tag in tags and f"{tag}Ref" in tags:
+            gps[tag_id - 1] = ascii_entry(str(tags[f"{tag}Ref"])[:1])
+            gps[tag_id] = gps_entry(tags[tag])
+
+    ifds = [ifd0] + [ifd for ifd in (exif, gps) if ifd]
+    if exif:
+        ifd0[0x8769] = (4, 1, b"")
+    if gps:
+        ifd0[0x8825] = (4, 1, b"")
+    offsets, offset = [], 8
+    for ifd in ifds:
+        offsets.append(offset)
+        offset += 2 + 12 * len(ifd) + 4
+    if exif:
+        ifd0[0x8769] = (4, 1, struct.pack(">I", offsets[ifds.index(exif)]))
+    if gps:
+        ifd0[0x8825] = (4, 1, struct.pack(">I", offsets[ifds.index(gps)]))
+
+    out, data = [b"MM", struct.pack(">HI", 42, 8)], b""
+    for ifd in ifds:
+        out.append(struct.pack(">H", len(ifd)))
+        for tag_id in sorted(ifd):
+            type_, count, value = ifd[tag_id]
+            if len(value) <= 4:
+                field = value.ljust(4, b"\0")
+            else:
+                field = struct.pack(">I", offset + len(data))
+                data += value + b"\0" * (len(value) % 2)
+            out.append(struct.pack(">HHI", tag_id, type_, count) + field)
+        out.append(struct.pack(">I", 0))
+    return b"Exif\0\0" + b"".join(out) + data
+
+
+def _xmp_segment(tags):
+    """ return APP1 XMP segment payload for tags """
+
+    def items(tag):
+        return "".join(f"<rdf:li>{escape(str(v))}</rdf:li>" for v in _values(tags, tag))
+
+    props = []
+    for tag, prop, kind in [
+        ("XMP:Subject", "dc:subject", "Bag"),
+        ("XMP:TagsList", "digiKam:TagsList", "Seq"),
+        ("XMP:PersonInImage", "Iptc4xmpExt:PersonInImage", "Bag"),
+    ]:
+        if tag in tags:
+            props.append(f"<{prop}><rdf:{kind}>{items(tag)}</rdf:{kind}></{prop}>")
+    for tag, prop in [("XMP:Title", "dc:title"), ("XMP:Description", "dc:description")]:
+        if tag in tags:
+            value = escape(str(tags[tag]))
+            props.append(
+                f'<{prop}><rdf:Alt><rdf:li xml:lang="x-default">{value}</rdf:li>'
+                f"</rdf:Alt></{prop}>"
+            )
+    packet = (
+        '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+        '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/" '
+        'xmlns:digiKam="http://www.digikam.org/ns/1.0/" '
+        'xmlns:Iptc4xmpExt="http://iptc.org/std/Iptc4xmpExt/2008-02-29/">'
+        f'{"".join(props)}</rdf:Description></rdf:RDF></x:xmpmeta>'
+        '<?xpacket end="w"?>'
+    )
+    return b"http://ns.adobe.com/xap/1.0/\0" + packet.encode("utf-8")
+
+
+def _iptc_segment(tags):
+    """ return APP13 Photoshop segment payload with IPTC keywords """
+    iptc = struct.pack(">BBBH", 0x1C, 1, 90, 3) + b"\x1b%G"
+    for keyword in _values(tags, "IPTC:Keywords"):
+        value = str(keyword).encode("utf-8")
+        iptc += struct.pack(">BBBH", 0x1C, 2, 25, len(value)) + value
+    resource = b"8BIM" + struct.pack(">H", 0x0404) + b"\0\0"
+    resource += struct.pack(">I", len(iptc)) + iptc + b"\0" * (len(iptc) % 2)
+    return b"Photoshop 3.0\0" + resource
+
+
+def _embed(data, tags):
+    """ return JPEG data with its EXIF, XMP and IPTC segments replaced by tags """
+    if data[:2] != b"\xff\xd8":
+        return data
+    segments = []
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF and data[pos + 1] != 0xDA:
+        (length,) = struct.unpack_from(">H", data, pos + 2)
+        marker, payload = data[pos + 1], data[pos + 4 : pos + 2 + length]
+        metadata = (marker == 0xE1 and payload.startswith((b"Exif", b"http"))) or (
+            marker == 0xED
+        )
+        if not metadata:
+            segments.append(data[pos : pos + 2 + length])
+        pos += 2 + length
+    new = [(0xE1, _exif_segment(tags)), (0xE1, _xmp_segment(tags))]
+    if "IPTC:Keywords" in tags:
+        new.append((0xED, _iptc_segment(tags)))
+    head = b"".join(
+        bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+        for marker, payload in new
+    )
+    return data[:2] + head + b"".join(segments) + data[pos:]
+
+
+def _read_value(tag, value):
+    """ value as exiftool -n -j would return it """
+    if tag.endswith(("GPSLatitude", "GPSLongitude")):
+        match = _DMS_RE.match(str(value))
+        if match:
+            return int(match[1]) + int(match[2]) / 60 + float(match[3]) / 3600
+    if tag.endswith("Ref"):
+        return str(value)[:1]
+    if isinstance(value, list):
+        value = [_read_value(tag, v) for v in value]
+        return value[0] if len(value) == 1 else value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return value
+
+
+def run(args):
+    """ run one exiftool command, return (stdout, stderr) """
+    time.sleep(float(os.environ.get("FAKE_EXIFTOOL_LATENCY", "0")))
+    files, reads, writes = [], [], []
+    backup = True
+    in_place = False
+    args = iter(args)
+    for arg in args:
+        if arg in ("-echo4", "-@"):
+            next(args, None)
+        elif arg.startswith("-overwrite_original"):
+            backup = False
+            in_place = arg == "-overwrite_original_in_place"
+        elif arg in _OPTIONS or arg.startswith("-execute"):
+            continue
+        elif arg.startswith("-") and "=" in arg:
+            tag, value = arg[1:].split("=", 1)
+            # TAG#= writes the value without print conversion
+            writes.append((tag.rstrip("#"), value))
+        elif arg.startswith("-"):
+            reads.append(arg[1:])
+        else:
+            files.append(arg)
+
+    crash = os.environ.get("FAKE_EXIFTOOL_CRASH")
+    if crash and any(crash in path for path in files):
+        _stat("crash")
+        os._exit(1)
+
+    out, err, results, written = [], [], [], 0
+    for path in files:
+        time.sleep(float(os.environ.get("FAKE_EXIFTOOL_FILE_LATENCY", "0")))
+        if not os.path.isfile(path):
+            err.append(f"Error: File not found - {path}")
+            continue
+        tags = _load(path)
+        if writes:
+            assigned = set()
+            for tag, value in writes:
+                if value == "":
+                    tags.pop(tag, None)
+                elif tag in _LIST_TAGS:
+                    if tag not in assigned:
+                        tags[tag] = []
+                        assigned.add(tag)
+                    tags[tag].append(value)
+                else:
+                    tags[tag] = value
+            with open(f"{path}.exif.json", "w") as fd:
+                json.dump(tags, fd)
+            # exiftool rewrites the whole file
+            with open(path, "rb") as fd:
+                data = fd.read()
+            if backup and not os.path.exists(f"{path}_original"):
+                with open(f"{path}_original", "wb") as fd:
+                    fd.write(data)
+                written += len(data)
+            data = _embed(data, tags)
+            # exiftool writes a new file unless told to write in place,
+            # which breaks hard links to the file
+            tmp_path = path if in_place else f"{path}_exiftool_tmp"
+            with open(tmp_path, "wb") as fd:
+                fd.write(data)
+            if not in_place:
+                os.replace(tmp_path, path)
+            written += len(data)
+        else:
+            result = {"SourceFile": path}
+            for tag, value in tags.items():
+                if not reads or tag in reads:
+                    result[tag] = _read_value(tag, value)
+            results.append(result)
+
+    _stat(f"cmd {len(files)} {written}")
+    if writes:
+        updated = len(files) - len(err)
+        out.append(f"    {updated} image files updated")
+        if err:
+            out.append(f"    {len(err)} files weren't updated due to errors")
+    elif results:
+        out.append(json.dumps(results))
+    return "\n".join(out), "\n".join(err)
+
+
+def main():
+    _stat("start")
+    time.sleep(float(os.environ.get("FAKE_EXIFTOOL_STARTUP", "0")))
+    if sys.argv[1:3] != ["-stay_open", "True"]:
+        out, err = run(sys.argv[1:])
+        print(out)
+        if err:
+            print(err, file=sys.stderr)
+        sys.exit(1 if err else 0)
+
+    args = []
+    for line in sys.stdin:
+        line = line.rstrip("\n")
+        if line.startswith("#[CSTR]"):
+            line = _CSTR_RE.sub(_unescape, line[7:])
+        if args[-1:] == ["-stay_open"] and line == "False":
+            return
+        if not line.startswith("-execute"):
+            args.append(line)
+            continue
+        echo4 = args[args.index("-echo4") + 1] if "-echo4" in args else ""
+        out, err = run(args)
+        args = []
+        sys.stdout.write(
+            f"{out}\n{{ready{line[8:]}}}\n" if out else f"{{ready{line[8:]}}}\n"
+        )
+        sys.stdout.flush()
+        sys.stderr.write(f"{err}\n{echo4}\n" if err else f"{echo4}\n")
+        sys.stderr.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# stand-ins for osxphotos and osxmetadata used by the benchmarks
+# a synthetic "library" is a folder holding photos.json (the photo metadata),
+# originals/ and edited/ (small real JPEG files) and database/Photos.sqlite
+# (an empty file whose size/mtime identify the library, like the real database)
+
+import base64
+import datetime
+import json
+import os
+import random
+import sys
+import types
+
+# 8x8 pixel JPEG
+_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9PDkzODdASFxOQERXRTc4UG1RV19iZ2hnPk1xeXBkeFxlZ2P/2wBDARESEhgVGC8aGi9jQjhCY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2P/wAARCAAIAAgDASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwBtFFFeWeyf/9k="
+)
+
+_UNKNOWN_PERSON = "_UNKNOWN_"
+
+_KEYWORDS = [f"keyword{i}" for i in range(50)]
+_PERSONS = [f"Person {i}" for i in range(30)] + [_UNKNOWN_PERSON]
+_ALBUMS = [f"Album {i}" for i in range(20)]
+
+
+def make_library(path, count, edited_ratio=0.1, seed=0):
+    """ create a synthetic library of count photos at path """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(path, "database"), exist_ok=True)
+    os.makedirs(os.path.join(path, "originals"), exist_ok=True)
+    os.makedirs(os.path.join(path, "edited"), exist_ok=True)
+    with open(os.path.join(path, "database", "Photos.sqlite"), "wb"):
+        pass
+
+    start = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+    photos = []
+    for i in range(count):
+        filename = f"IMG_{i:06d}.jpg"
+        with open(os.path.join(path, "originals", filename), "wb") as fd:
+            fd.write(_JPEG)
+        hasadjustments = rng.random() < edited_ratio
+        if hasadjustments:
+            with open(os.path.join(path, "edited", filename), "wb") as fd:
+                fd.write(_JPEG)
+        tz = datetime.timezone(datetime.timedelta(hours=rng.randint(-8, 8)))
+        date = (
+            start + datetime.timedelta(minutes=rng.randint(0, 5_000_000))
+        ).astimezone(tz)
+        located = rng.random() < 0.7
+        photos.append(
+            {
+                "uuid": f"{i:08X}-0000-0000-0000-000000000000",
+                "filename": filename,
+                "original_filename": f"original_{i}.jpg",
+                "keywords": rng.sample(_KEYWORDS, rng.randint(0, 5)),
+                "persons": rng.sample(_PERSONS, rng.randint(0, 3)),
+                "albums": rng.sample(_ALBUMS, rng.randint(0, 2)),
+                "title": f"Title {i}" if rng.random() < 0.3 else None,
+                "description": f"Description of photo {i}"
+                if rng.random() < 0.2
+                else None,
+                "location": [rng.uniform(-80, 80), rng.uniform(-180, 180)]
+                if located
+                else [None, None],
+                "date": date.isoformat(),
+                "date_modified": date.isoformat() if hasadjustments else None,
+                "hasadjustments": hasadjustments,
+            }
+        )
+    with open(os.path.join(path, "photos.json"), "w") as fd:
+        json.dump(photos, fd)
+
+
+class PhotoInfo:
+    """ fake osxphotos.PhotoInfo """
+
+    def __init__(self, library, data):
+        self._data = data
+        self.uuid = data["uuid"]
+        self.filename = data["filename"]
+        self.original_filename = data["original_filename"]
+        self.keywords = data["keywords"]
+        self.persons = data["persons"]
+        self.albums = data["albums"]
+        self.title = data["title"]
+        self.description = data["description"]
+        self.location = tuple(data["location"])
+        self.date = datetime.datetime.fromisoformat(data["date"])
+        self.date_modified = (
+            datetime.datetime.fromisoformat(data["date_modified"])
+            if data["date_modified"]
+            else None
+        )
+        self.hasadjustments = data["hasadjustments"]
+        self.ismissing = False
+        self.path = os.path.join(library, "originals", self.filename)
+        self.path_edited = (
+            os.path.join(library, "edited", self.filename)
+            if self.hasadjustments
+            else None
+        )
+
+
+class PhotosDB:
+    """ fake osxphotos.PhotosDB """
+
+    def __init__(self, dbfile=None):
+        self.library_path = dbfile
+        with open(os.path.join(dbfile, "photos.json")) as fd:
+            self._photos = [PhotoInfo(dbfile, data) for data in json.load(fd)]
+        self._by_uuid = {photo.uuid: photo for photo in self._photos}
+        # osxphotos keeps the details of every photo by uuid in _dbphotos
+        self._dbphotos = {photo.uuid: photo._data for photo in self._photos}
+
+    def photos(self, keywords=None, uuid=None, persons=None, albums=None):
+        photos = (
+            [self._by_uuid[u] for u in uuid if u in self._by_uuid]
+            if uuid
+            else self._photos
+        )
+        for attr, values in [
+            ("keywords", keywords),
+            ("persons", persons),
+            ("albums", albums),
+        ]:
+            if values:
+                photos = [p for p in photos if set(values) & set(getattr(p, attr))]
+        return list(photos)
+
+    def _counts(self, attr):
+        counts = {}
+        for photo in self._photos:
+            for value in getattr(photo, attr):
+                counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    @property
+    def keywords_as_dict(self):
+        return self._counts("keywords")
+
+    @property
+    def persons_as_dict(self):
+        return self._counts("persons")
+
+    @property
+    def albums_as_dict(self):
+        return self._counts("albums")
+
+
+class Tag:
+    """ fake osxmetadata.Tag """
+
+    def __init__(self, name, color=0):
+        self.name = name
+        self.color = color
+
+
+class OSXMetaData:
+    """ fake osxmetadata.OSXMetaData; tags are kept in a path.tags.json file """
+
+    def __init__(self, path):
+        self._tags_file = f"{path}.tags.json"
+
+    @property
+    def tags(self):
+        try:
+            with open(self._tags_file) as fd:
+                return [Tag(*tag) for tag in json.load(fd)]
+        except FileNotFoundError:
+            return []
+
+    @tags.setter
+    def tags(self, tags):
+        with open(self._tags_file, "w") as fd:
+            json.dump([[tag.name, tag.color] for tag in tags], fd)
+
+
+def install():
+    """ install the fakes as the osxphotos and osxmetadata modules """
+    osxphotos = types.ModuleType("osxphotos")
+    osxphotos.PhotosDB = PhotosDB
+    osxphotos.PhotoInfo = PhotoInfo
+    osxmetadata = types.ModuleType("osxmetadata")
+    osxmetadata.OSXMetaData = OSXMetaData
+    osxmetadata.Tag = Tag
+    sys.modules.update(
+        {"osxphotos": osxphotos, "osxmetadata": osxmetadata,}
+    )
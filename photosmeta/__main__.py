@@ -30,9 +30,6 @@
 # todo: option to export then apply tags (e.g. don't tag original)
 # todo: standardize/cleanup exception handling in helper functions
 # todo: how are live photos handled
-# todo: use -stay_open with exiftool to aviod repeated subprocess calls
-# todo: right now, options (keyword, person, etc) are OR...add option for AND
-#         e.g. only process photos in album=Test AND person=Joe
 # todo: options to add:
 # --exportbydate to create date folders in export folder (e.g. 2019/10/05/file.jpg, etc)
 # todo: test cases:
@@ -43,26 +40,62 @@
 #   see: https://developer.apple.com/library/archive/documentation/CoreServices/Reference/MetadataAttributesRef/Reference/CommonAttrs.html#//apple_ref/doc/uid/TP40001694-SW1
 
 
+# heavy dependencies (osxphotos, osxmetadata, tqdm) are imported only where they're
+# used so --version, --help and argument errors don't pay their import cost
 import argparse
-import itertools
+import atexit
+import contextlib
+import hashlib
 import json
 import logging
 import os.path
 import pathlib
 import pprint
 import re
-import subprocess
 import sys
-from functools import lru_cache
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import osxphotos
-from osxphotos.utils import dd_to_dms_str
-from osxmetadata import OSXMetaData, Tag
-from tqdm import tqdm
-
-from ._util import build_list, check_file_exists
+from ._adaptive import DECREASE, INCREASE, AdaptiveLimit
+from ._copy import COPY_MODES, HARDLINK, REFLINK, break_link, copy_data
+from ._diff import READ_TAGS, build_exif_cmd, build_restore_cmd, diff_tags, tag_list
+from ._exiftool import (
+    ExifToolSession,
+    close_finished_sessions,
+    get_exiftool_session,
+    read_tags,
+)
+from ._export import ExportDestinations, ExportManifests
+from ._jpeg import read_jpeg_tags
+from ._journal import JournalError, RunJournal
+from ._pipeline import chunked, stage
+from ._planner import (
+    ExportOp,
+    FileOp,
+    PhotoPlan,
+    StalePlanError,
+    group_writes,
+    read_plan_file,
+    write_group,
+)
+from ._record import PhotoRecord
+from ._select import MATCH_ALL, MATCH_ANY, select_photos
+from ._snapshot import LibrarySnapshot, library_key, load_snapshot, save_snapshot
+from ._state import SyncState, metadata_fingerprint
+from ._stats import ThreadProfiler, peak_rss_mb, stats
+from ._undo import UndoLog, UndoLogError, read_undo_log
+from ._util import (
+    build_list,
+    check_file_exists,
+    claim_path,
+    dd_to_dms_str,
+    file_stat,
+)
 from ._version import __version__
+from ._volumes import Volumes
+from ._xmp import write_sidecar
 
 # TODO: cleanup globals to minimize number of them
 # Globals
@@ -78,6 +111,19 @@ logging.basicConfig(
 if not _DEBUG:
     logging.disable(logging.DEBUG)
 
+# number of photos whose tags are read with a single exiftool command
+_READ_BATCH_SIZE = 256
+
+# number of batches of exported photos that can wait to be tagged
+_EXPORT_QUEUE_SIZE = 2
+
+# person name Photos 5 gives faces it hasn't identified
+# (osxphotos._constants._UNKNOWN_PERSON, copied so osxphotos isn't imported to plan)
+_UNKNOWN_PERSON = "_UNKNOWN_"
+
+# guards output from worker threads
+_OUTPUT_LOCK = threading.Lock()
+
 
 def _debug(debug):
     """ Enable or disable debug logging """
@@ -87,10 +133,19 @@ def _debug(debug):
         logging.disable(logging.DEBUG)
 
 
+def write(s):
+    """ write s above the progress bar
+        output is serialized so lines from worker threads don't interleave """
+    from tqdm import tqdm
+
+    with _OUTPUT_LOCK:
+        tqdm.write(s)
+
+
 def verbose(s):
     """ print s if global _VERBOSE == True """
     if _VERBOSE:
-        tqdm.write(s)
+        write(s)
 
 
 # custom argparse class to show help if error triggered
@@ -151,6 +206,14 @@ def process_arguments():
     parser.add_argument(
         "--uuid", action="append", help="only process file matching UUID"
     )
+    parser.add_argument(
+        "--match",
+        choices=[MATCH_ANY, MATCH_ALL],
+        default=MATCH_ANY,
+        help="with 'any' (default), process photos matching any of --album, --keyword, "
+        "--person, --uuid; with 'all', only process photos matching every --album, "
+        "--keyword and --person given (and any --uuid given)",
+    )
     parser.add_argument(
         "--all",
         action="store_true",
@@ -192,8 +255,8 @@ def process_arguments():
         default=False,
         help="write tags/keywords to file's extended attributes (kMDItemUserTags) "
         "so you can search in spotlight using 'tag:' "
-        "May be combined with -xattrperson "
-        "CAUTION: this overwrites all existing kMDItemUserTags (to be fixed in future release)",
+        "May be combined with --xattrperson "
+        "Tags are merged with any existing kMDItemUserTags",
     )
     parser.add_argument(
         "--xattrperson",
@@ -202,7 +265,7 @@ def process_arguments():
         help="write person (faces) to file's extended attributes (kMDItemUserTags) "
         "so you can search in spotlight using 'tag:' "
         "May be combined with --xattrtag "
-        "CAUTION: this overwrites all existing kMDItemUserTags (to be fixed in future release)",
+        "Tags are merged with any existing kMDItemUserTags",
     )
     parser.add_argument(
         "--list",
@@ -211,6 +274,23 @@ def process_arguments():
         help="list keywords, albums, persons found in database then exit: "
         "--list=keyword, --list=album, --list=person",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="always load the Photos database instead of using (and saving) a cached "
+        "snapshot of it; the snapshot is kept in ~/.cache/photosmeta and is "
+        "automatically refreshed when the library changes",
+    )
+    parser.add_argument(
+        "--no-native-read",
+        action="store_true",
+        default=False,
+        help="read the existing metadata of JPEG and HEIC files with exiftool; by "
+        "default it is read directly from the file's EXIF, IPTC and XMP headers and "
+        "exiftool is only used for other formats (e.g. RAW) or files the built-in "
+        "reader can't handle",
+    )
     parser.add_argument(
         "--export",
         help="export photos before applying metadata; set EXPORT to the export path; "
@@ -223,6 +303,18 @@ def process_arguments():
         help="Automatically create output folders to organize photos "
         "by date created (e.g. DEST/2019/12/20/photoname.jpg).",
     )
+    parser.add_argument(
+        "--export-update",
+        action="store_true",
+        default=False,
+        help="with --export, don't export photos again that were exported to the "
+        "same folder before and haven't changed since (the photo's file has the same "
+        "size and modification time or, failing that, the same SHA-256 hash and the "
+        "exported file hasn't been changed); their metadata is only rewritten if it "
+        "differs. Exports are recorded in a .photosmeta_export.jsonl file in each "
+        "export folder. Changed photos replace their earlier export instead of being "
+        "exported as photoname (1).ext",
+    )
     parser.add_argument(
         "--edited",
         action="store_true",
@@ -239,6 +331,161 @@ def process_arguments():
         default=False,
         help="Use photo's original filename instead of current filename for export",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        metavar="N",
+        help="process N photos in parallel, each worker with its own exiftool process "
+        "(default: 1)",
+    )
+    parser.add_argument(
+        "--adaptive-jobs",
+        action="store_true",
+        help="adjust the number of exiftool writes run at once during the run, "
+        "between 1 and --jobs: grow it while throughput improves, shrink it when the "
+        "time per file of the exiftool reads and writes is above --latency-ceiling",
+    )
+    parser.add_argument(
+        "--latency-ceiling",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="with --adaptive-jobs, the time per file the exiftool reads and writes "
+        "should stay under (default: 1.0)",
+    )
+    parser.add_argument(
+        "--adaptive-log",
+        metavar="PATH",
+        help="with --adaptive-jobs, append each adjustment decision, with the "
+        "throughput and latency it was based on, to PATH as a line of JSON",
+    )
+    parser.add_argument(
+        "--by-volume",
+        action="store_true",
+        help="order the photos by the volume (disk) their files are on, in on-disk "
+        "order on each volume, and process the volumes at the same time, limiting the "
+        "files worked on at once on hard disks to --hdd-jobs; the throughput of each "
+        "volume is reported",
+    )
+    parser.add_argument(
+        "--hdd-jobs",
+        type=int,
+        default=2,
+        metavar="N",
+        help="with --by-volume, work on at most N files at once on each hard disk; "
+        "other volumes use --jobs (default: 2)",
+    )
+    parser.add_argument(
+        "--copy-mode",
+        choices=COPY_MODES,
+        default="auto",
+        help="how --export copies files: reflink clones them without copying the data "
+        "(copy-on-write filesystems such as APFS, btrfs and XFS), hardlink exports "
+        "hard links to the photos' files that are replaced by a new file when their "
+        "metadata is written, copy copies the data (in the kernel where possible); "
+        "auto (default) clones files if the filesystem supports it, otherwise copies them",
+    )
+    parser.add_argument(
+        "--export-jobs",
+        type=int,
+        default=2,
+        metavar="N",
+        help="with --export, copy up to N files in parallel; photos are exported "
+        "ahead of the photos being tagged so copying and tagging overlap (default: 2)",
+    )
+    parser.add_argument(
+        "--state",
+        metavar="PATH",
+        help="keep track of the metadata written to each photo in SQLite database PATH "
+        "(created if needed) and skip photos whose metadata and files have not changed "
+        "since the last run",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        default=False,
+        help="with --state, process every selected photo even if it has not changed "
+        "(the state database is still updated)",
+    )
+    parser.add_argument(
+        "--sidecar",
+        action="store_true",
+        default=False,
+        help="write metadata to an XMP sidecar next to each photo (photoname.xmp) "
+        "instead of into the photo; exiftool is not used. Most useful with --export. "
+        "If a sidecar already exists, keywords and persons are merged with it and "
+        "other data in it is kept",
+    )
+    parser.add_argument(
+        "--plan",
+        metavar="PATH",
+        help="don't change any files, instead write everything that would be done "
+        "(exports, exiftool tag assignments and extended attribute tags for each file) "
+        "to plan file PATH to be applied later with --apply",
+    )
+    parser.add_argument(
+        "--apply",
+        action="append",
+        metavar="PLAN",
+        help="apply plan file PLAN written by --plan without loading the Photos "
+        "database; may be repeated. Plan files have one photo per line so a plan can be "
+        "split (e.g. with split -l) and the parts applied in parallel. "
+        "Photos whose files changed after the plan was made are not updated",
+    )
+    parser.add_argument(
+        "--undo-log",
+        metavar="PATH",
+        help="instead of having exiftool keep a filename.extension_original backup "
+        "copy of each file it writes, record the previous value of each tag changed "
+        "in undo log PATH (appended to if it exists) and write the files in place. "
+        "The changes can be reverted with --rollback PATH. "
+        "Not used for exported files or with --sidecar; extended attributes "
+        "are not recorded",
+    )
+    parser.add_argument(
+        "--rollback",
+        metavar="LOG",
+        help="restore the tags recorded in undo log LOG written by --undo-log to "
+        "their values before photosmeta changed them, without loading the Photos "
+        "database. Use --full on the next run if photos were skipped with --state",
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="PATH",
+        help="record each photo processed (or failed) in journal file PATH "
+        "so the run can be continued with --resume if it is interrupted",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="with --journal, skip photos the journal records as already processed; "
+        "photos that failed are tried again",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=0,
+        metavar="N",
+        help="retry photos that could not be processed up to N times "
+        "after the other photos are done (default: 0)",
+    )
+    parser.add_argument(
+        "--retry-delay",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="wait SECONDS before the first retry, doubling for each further retry "
+        "(default: 1)",
+    )
+    parser.add_argument(
+        "--failed",
+        metavar="PATH",
+        help="write the photos that could not be processed, with the error for each, "
+        "to PATH as JSON",
+    )
     parser.add_argument(
         "--albums-as-keywords",
         action="store_true",
@@ -251,6 +498,19 @@ def process_arguments():
         default=False,
         help="Store person names as keywords",
     )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="time each stage of processing (database load, export, exiftool reads "
+        "and writes, extended attributes, ...) and write counters, cumulative times "
+        "and latency histograms to PATH as JSON at the end of the run",
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="PATH",
+        help="profile the run with cProfile (all threads) and write the stats to PATH; "
+        "view with python -m pstats PATH",
+    )
 
     # if no args, show help and exit
     if len(sys.argv) == 1:
@@ -260,96 +520,121 @@ def process_arguments():
     return parser.parse_args()
 
 
-@lru_cache(maxsize=1)
-def get_exiftool_path():
-    """ return path of exiftool, cache result """
-    result = subprocess.run(["which", "exiftool"], stdout=subprocess.PIPE)
-    exiftool_path = result.stdout.decode("utf-8")
-    logging.debug("exiftool path = %s" % (exiftool_path))
-    if exiftool_path:
-        return exiftool_path.rstrip()
-    else:
-        sys.exit(
-            "Could not find exiftool. Please download and install from "
-            "https://exiftool.org/"
-        )
-
-
-def get_exif_info_as_json(photopath):
-    """ get exif info from file as JSON via exiftool """
+def get_exif_info_as_json(photopath, native=True):
+    """ get exif info from file as JSON via exiftool
+        only the tags in READ_TAGS are read, without print conversion (-n)
+        native: read JPEG and HEIC files with the built-in reader instead of exiftool
+        raises ExifToolError if exiftool can't read the file """
 
     if not check_file_exists(photopath):
         raise ValueError("Photopath %s does not appear to be valid file" % photopath)
 
-    exiftool = get_exiftool_path()
-    exif_cmd = [exiftool, "-G", "-j", "-sort", photopath]
-
-    try:
-        proc = subprocess.run(exif_cmd, check=True, stdout=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        sys.exit("subprocess error calling command %s %s: " % (exif_cmd, e))
+    if native:
+        with stats.timer("native_read_file"):
+            exif_info = read_jpeg_tags(photopath, READ_TAGS)
+        if exif_info is not None:
+            stats.incr("native_reads")
+            return [exif_info]
+
+    exif_cmd = ["-G", "-n", *[f"-{tag}" for tag in READ_TAGS], photopath]
+    with stats.timer("exiftool_read_file"):
+        return get_exiftool_session().execute_json(*exif_cmd)
+
+
+def _volume_limit(volumes, *paths):
+    """ return context manager holding a worker of the volumes of paths
+        (see Volumes.limit) or doing nothing if volumes is None """
+    if volumes is None:
+        return contextlib.nullcontext()
+    return volumes.limit(*paths)
+
+
+def _adaptive_slot(adaptive, files=1):
+    """ return context manager for an exiftool write of files files
+        (see AdaptiveLimit.slot) or doing nothing if adaptive is None """
+    if adaptive is None:
+        return contextlib.nullcontext()
+    return adaptive.slot(files)
+
+
+def _export_file(plan, fileop, filename, manifests=None, edited=False):
+    """ copy the file of fileop to plan.export.dest as filename and point fileop to
+        the copy; if manifests is given, the copy is recorded in the export manifest """
+    export = plan.export
+    source = fileop.path
+    source_stat = file_stat(source)
+    # hash the source for the manifest as it's copied, unless it's cloned or linked
+    digest = hashlib.sha256() if manifests is not None else None
+    with stats.timer("export_copy"):
+        dest_path = claim_path(export.dest, filename, overwrite=export.overwrite)
+        try:
+            method = copy_data(source, dest_path, export.copy_mode, digest)
+        except BaseException:
+            if not export.overwrite:
+                # remove the empty file claiming the name, or the next attempt
+                # would be exported as "name (1).jpg"
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(dest_path)
+            raise
+    fileop.path = dest_path
+    fileop.linked = method == HARDLINK
+    stats.incr("export_files_copied")
+    stats.incr(f"export_{method}")
+    if method in (REFLINK, HARDLINK):
+        stats.incr("export_bytes_cloned", source_stat[0])
+        digest = None
     else:
-        logging.debug("returncode: %d" % proc.returncode)
-        logging.debug(
-            "Have {} bytes in stdout:\n{}".format(
-                len(proc.stdout), proc.stdout.decode("utf-8")
-            )
+        stats.incr("export_bytes_copied", source_stat[0])
+    if manifests is not None:
+        manifests.record_copy(
+            fileop.path,
+            plan.uuid,
+            export.name,
+            edited,
+            source,
+            source_stat,
+            digest.hexdigest() if digest is not None else None,
         )
-
-    return json.loads(proc.stdout.decode("utf-8").rstrip("\r\n"))
+    return fileop.path
 
 
-def export_photo(
-    photo, dest, verbose, export_by_date, overwrite, export_edited, original_name
-):
+def export_photo(plan, verbose, manifests=None, destinations=None):
     """ Helper function for export that does the actual export
-        photo: PhotoInfo object
-        dest: destination path as string
+        plan: PhotoPlan with export set; its files are copied to plan.export.dest
+              and its FileOps updated to point to the exported files
         verbose: boolean; print verbose output
-        export_by_date: boolean; create export folder in form dest/YYYY/MM/DD
-        overwrite: boolean; overwrite dest file if it already exists
-        original_name: boolean; use original filename instead of current filename
-        returns destination path of exported photo or None if photo was missing 
-    """
-
-    if photo.ismissing:
-        space = " " if not verbose else ""
-        tqdm.write(f"{space}Skipping missing photos {photo.filename}")
-        return None
-    elif not os.path.exists(photo.path):
-        space = " " if not verbose else ""
-        tqdm.write(
-            f"{space}WARNING: file {photo.path} is missing but ismissing=False, "
-            f"skipping {photo.filename}"
-        )
-        return None
-
-    filename = None
-    filename = photo.original_filename if original_name else photo.filename
+        manifests: optional ExportManifests to record the exported files in
+        destinations: optional ExportDestinations; the export folder is created
+                      through it so each folder is only created once
+        if a file already exists in the export folder, the file is exported with
+        name filename (1).jpg, filename (2).jpg, etc unless plan.export.overwrite is set
+        the edited version, if in plan, is exported as filename_edited.jpg
+        returns destination path of exported photo """
+
+    export = plan.export
+    original, *edited = plan.files
     if verbose:
-        tqdm.write(f"Exporting {photo.filename} as {filename}")
-
-    if export_by_date:
-        date_created = photo.date.timetuple()
-        dest = create_path_by_date(dest, date_created)
+        write(f"Exporting {plan.filename} as {export.filename}")
 
-    photo_path = photo.export(dest, filename, overwrite=overwrite)[0]
+    if destinations is not None:
+        destinations.create_folder(export.dest)
+    else:
+        os.makedirs(export.dest, exist_ok=True)
+    photo_path = _export_file(plan, original, export.filename, manifests)
 
-    # if export-edited, also export the edited version
-    # verify the photo has adjustments and valid path to avoid raising an exception
-    if export_edited and photo.hasadjustments and photo.path_edited is not None:
+    for fileop in edited:
         edited_name = pathlib.Path(pathlib.Path(photo_path).name)
         edited_name = f"{edited_name.stem}_edited{edited_name.suffix}"
         if verbose:
-            tqdm.write(f"Exporting edited version of {filename} as {edited_name}")
-        photo.export(dest, edited_name, overwrite=overwrite, edited=True)
+            write(f"Exporting edited version of {export.filename} as {edited_name}")
+        _export_file(plan, fileop, edited_name, manifests, edited=True)
 
+    plan.export = None
     return photo_path
 
 
-def process_photo(
+def plan_photo(
     photo,
-    test=False,
     export=None,
     inplace=False,
     xattrtag=False,
@@ -359,11 +644,18 @@ def process_photo(
     original_name=False,
     albums_as_keywords=False,
     persons_as_keywords=False,
+    exif_info=None,
+    sidecar=False,
+    native_read=True,
+    undo=False,
+    manifests=None,
+    copy_mode="auto",
 ):
-    """ process a photo using exiftool to write metadata to image file 
-        test: run in test mode (don't actually process anything) 
-        export: must be a valid path; if not None, all photos will be exported to export path before processing 
-                will test to verify export is valid directory; 
+    """ plan the metadata updates needed to write Photos metadata to a photo's image file(s)
+        photo: PhotoRecord object
+        the photo's existing tags are read and compared to the Photos metadata;
+        apply_plans does the actual exporting and writing
+        export: must be a valid path; if not None, photo will be exported to export path before processing 
                 if file exists in export path, new file will be created with name filename (1).jpg, filename (2).jpg, etc 
         inplace: modify files in place (don't export) 
         xattrtag: apply keywords to extended attribute tags 
@@ -372,34 +664,87 @@ def process_photo(
         edited: also modify (inplace) or export edited version if one exits
         original_name: use original filename instead of current filename for export 
         albums_as_keywords: treat album names as keywords 
-        persons_as_keywords: treat person names as keywords """
+        persons_as_keywords: treat person names as keywords
+        exif_info: dict of tags already read from the photo (e.g. by read_tags);
+                   if None, tags are read from the file being processed
+        sidecar: write metadata to an XMP sidecar next to each file instead of
+                 into the file; the file's tags aren't read, keywords and persons
+                 are merged with those in an existing sidecar instead
+        native_read: read tags from JPEG and HEIC files with the built-in reader,
+                     not exiftool
+        undo: keep the previous values of the tags changed in each file for the undo
+              log instead of having exiftool make a backup copy of the file
+        manifests: optional ExportManifests; if given, files exported before that are
+                   still up to date copies aren't exported again (only their metadata
+                   is updated if needed) and the exports are recorded in the manifests
+        copy_mode: how exported files are copied, one of COPY_MODES
+        returns PhotoPlan or None if the photo is missing """
 
     exif_cmd = []
 
     photopath = photo.path
     if photo.ismissing or not photopath or not os.path.exists(photopath):
-        tqdm.write(
+        write(
             f"WARNING: skipping missing photo '{photo.filename}' "
             f"(ismissing={photo.ismissing}, path='{photopath}'); skipping"
         )
-        return
+        return None
 
-    # if export path set, then copy file before applying metadata
+    paths = [photopath]
+    # if edited, also process the edited version
+    if edited and photo.hasadjustments:
+        if photo.path_edited and os.path.exists(photo.path_edited):
+            paths.append(photo.path_edited)
+        else:
+            write(
+                f"WARNING: skipping file {photo.path_edited}, does not appear to exist"
+            )
+
+    # if export path set, the files are exported before metadata is applied;
+    # the exported files are copies so their metadata is read from the photo's files
+    # unless up to date copies from an earlier export are updated instead
+    export_op = None
     if export:
-        verbose(f"Exporting {photopath} to {export}")
-        if not test:
-            # photo, dest, verbose, export_by_date, overwrite, export_edited, original_name
-            photopath = export_photo(
-                photo, export, _VERBOSE, export_by_date, False, edited, original_name
+        dest = export
+        if export_by_date:
+            dest = path_by_date(export, photo.date.timetuple())
+        filename = photo.original_filename if original_name else photo.filename
+        copies = None
+        if manifests is not None:
+            with stats.timer("export_check"):
+                copies = manifests.current_copies(dest, photo.uuid, filename, paths)
+        if copies is not None:
+            verbose(f"Skipping export of {photopath}, {copies[0]} is up to date")
+            stats.incr("export_files_skipped", len(paths))
+            stats.incr("export_bytes_skipped", sum(map(os.path.getsize, paths)))
+            paths = copies
+            exif_info = None
+        else:
+            verbose(f"Exporting {photopath} to {export}")
+            # replace the earlier export of the photo instead of adding "name (1).jpg"
+            previous = (
+                manifests.exported_name(dest, photo.uuid, filename)
+                if manifests is not None
+                else None
+            )
+            export_op = ExportOp(
+                dest,
+                previous or filename,
+                overwrite=previous is not None,
+                name=filename,
+                copy_mode=copy_mode,
             )
 
-    # get existing metadata
-    j = get_exif_info_as_json(photopath)
+    # get existing metadata unless it was prefetched
+    if sidecar:
+        exif_info = {}
+    elif exif_info is None:
+        exif_info = get_exif_info_as_json(paths[0], native=native_read)[0]
 
-    logging.debug("json metadata for %s = %s" % (photopath, j))
+    logging.debug("json metadata for %s = %s" % (paths[0], exif_info))
 
-    keywords = None
-    persons = None
+    # desired state of each tag written: tag -> value or list of values
+    desired = {}
 
     keywords_raw = None
     persons_raw = None
@@ -407,62 +752,55 @@ def process_photo(
     keywords_raw = set()
     if photo.keywords:
         # merge existing keywords, removing duplicates
-        tmp1 = j[0]["IPTC:Keywords"] if "IPTC:Keywords" in j[0] else None
-        tmp2 = j[0]["XMP:TagsList"] if "XMP:TagsList" in j[0] else None
-        tmp3 = j[0]["XMP:Subject"] if "XMP:Subject" in j[0] else None
+        tmp1 = tag_list(exif_info, "IPTC:Keywords")
+        tmp2 = tag_list(exif_info, "XMP:TagsList")
+        tmp3 = tag_list(exif_info, "XMP:Subject")
         tmp4 = photo.persons if persons_as_keywords and photo.persons else None
 
         keywords_raw = build_list([photo.keywords, tmp1, tmp2, tmp3, tmp4])
         keywords_raw = set(keywords_raw)
-        for keyword in keywords_raw:
-            exif_cmd.append(f"-XMP:TagsList={keyword}")
-            exif_cmd.append(f"-keywords={keyword}")
-            exif_cmd.append(f"-XMP:Subject={keyword}")
 
+    # lists are sorted so photos with the same tags get identical exiftool
+    # commands, which group_writes runs as a single command
+    keyword_list = sorted(keywords_raw)
     # process albums as keywords if requested
     # don't process any album names that have already been processed as keywords
     if albums_as_keywords:
-        for album in photo.albums:
-            if album not in keywords_raw:
-                exif_cmd.append(f"-XMP:TagsList={album}")
-                exif_cmd.append(f"-keywords={album}")
-                exif_cmd.append(f"-XMP:Subject={album}")
+        keyword_list.extend(sorted(set(photo.albums) - set(keywords_raw)))
+    if keyword_list:
+        desired["XMP:TagsList"] = keyword_list
+        desired["IPTC:Keywords"] = keyword_list
+        desired["XMP:Subject"] = keyword_list
 
     if photo.persons:
-        # tmp1 = j[0]["XMP:Subject"] if "XMP:Subject" in j[0] else None
-        tmp2 = j[0]["XMP:PersonInImage"] if "XMP:PersonInImage" in j[0] else None
-        #        print ("photopath %s tmp1 = '%s' tmp2 = '%s'" % (photopath, tmp1, tmp2))
-        # persons_raw = build_list([photo.persons, tmp1, tmp2])
+        tmp2 = tag_list(exif_info, "XMP:PersonInImage")
         persons_raw = build_list([photo.persons, tmp2])
         persons_raw = set(persons_raw)
 
         # Photos 5 identifies all faces even if unknown, remove these
-        if osxphotos._constants._UNKNOWN_PERSON in persons_raw:
-            persons_raw.remove(osxphotos._constants._UNKNOWN_PERSON)
+        persons_raw.discard(_UNKNOWN_PERSON)
 
-        for person in persons_raw:
-            exif_cmd.append(f"-xmp:PersonInImage={person}")
+        if persons_raw:
+            desired["XMP:PersonInImage"] = sorted(persons_raw)
 
     # desc = desc or _dbphotos[uuid]["extendedDescription"]
     desc = photo.description
     if desc:
-        exif_cmd.append(f"-ImageDescription={desc}")
-        exif_cmd.append(f"-xmp:description={desc}")
+        desired["EXIF:ImageDescription"] = desc
+        desired["XMP:Description"] = desc
 
     # title = name
     title = photo.title
     if title:
-        exif_cmd.append(f"-xmp:title={title}")
+        desired["XMP:Title"] = title
 
     (lat, lon) = photo.location
     if lat is not None and lon is not None:
         lat_str, lon_str = dd_to_dms_str(lat, lon)
-        exif_cmd.append(f"-EXIF:GPSLatitude={lat_str}")
-        exif_cmd.append(f"-EXIF:GPSLongitude={lon_str}")
-        lat_ref = "North" if lat >= 0 else "South"
-        lon_ref = "East" if lon >= 0 else "West"
-        exif_cmd.append(f"-EXIF:GPSLatitudeRef={lat_ref}")
-        exif_cmd.append(f"-EXIF:GPSLongitudeRef={lon_ref}")
+        desired["EXIF:GPSLatitude"] = lat_str
+        desired["EXIF:GPSLongitude"] = lon_str
+        desired["EXIF:GPSLatitudeRef"] = "North" if lat >= 0 else "South"
+        desired["EXIF:GPSLongitudeRef"] = "East" if lon >= 0 else "West"
 
     # process date/time and timezone offset
     date = photo.date
@@ -473,107 +811,863 @@ def process_photo(
     offset = re.findall(r"([+-]?)([\d]{2})([\d]{2})", offsettime)
     offset = offset[0]  # findall returns list of tuples
     offsettime = f"{offset[0]}{offset[1]}:{offset[2]}"
-    exif_cmd.append(f"-EXIF:DateTimeOriginal={datetimeoriginal}")
-    exif_cmd.append(f"-EXIF:OffsetTimeOriginal={offsettime}")
+    desired["EXIF:DateTimeOriginal"] = datetimeoriginal
+    desired["EXIF:OffsetTimeOriginal"] = offsettime
 
     if photo.date_modified is not None:
-        exif_cmd.append(
-            f"-EXIF:ModifyDate={photo.date_modified.strftime('%Y:%m:%d %H:%M:%S')}"
-        )
+        desired["EXIF:ModifyDate"] = photo.date_modified.strftime("%Y:%m:%d %H:%M:%S")
+
+    xattr_tags = None
+    if (xattrtag and keywords_raw) or (xattrperson and persons_raw):
+        xattr_tags = []
+        if xattrtag and keywords_raw:
+            xattr_tags = build_list([xattr_tags, sorted(keywords_raw)])
+        if xattrperson and persons_raw:
+            xattr_tags = build_list([xattr_tags, sorted(persons_raw)])
+
+    plan = PhotoPlan(
+        photo.uuid,
+        photo.filename,
+        export=export_op,
+        manifest=bool(export) and manifests is not None,
+    )
 
-    # only run exiftool if something to update
-    if exif_cmd:
-        paths = [photopath]
-        # if edited, also process the edited version
-        if edited and photo.hasadjustments:
-            if export:
-                edited_path = pathlib.Path(photopath)
-                edited_name = f"{edited_path.stem}_edited{edited_path.suffix}"
-                edited_path = pathlib.Path(photopath).parent / pathlib.Path(edited_name)
-                if os.path.exists(edited_path):
-                    paths.append(str(edited_path))
-                else:
-                    tqdm.write(
-                        f"WARNING: skipping file {str(edited_path)}, does not appear to exist"
+    def _linked(path):
+        """ return True if path is an export that is (or may still be) a hard link
+            to the photo's file; it must be replaced by a new file when written,
+            not changed in place """
+        if not export:
+            return False
+        if export_op is not None:
+            return copy_mode == HARDLINK
+        return os.stat(path).st_nlink > 1
+
+    if sidecar:
+        # write_sidecar merges with any existing sidecar and skips it if up to date
+        for photopath in paths:
+            fileop = FileOp(photopath, [], xattr_tags, desired)
+            # export_photo sets linked for new exports
+            fileop.linked = export_op is None and _linked(photopath)
+            plan.files.append(fileop)
+        return plan
+
+    for photopath in paths:
+        # process both original and edited if requested
+        # only run exiftool if a tag in the file differs from the desired value
+        linked = _linked(photopath)
+        current = exif_info if photopath == paths[0] else None
+        if current is None:
+            current = get_exif_info_as_json(photopath, native=native_read)[0]
+        changes = diff_tags(desired, current)
+
+        exif_cmd = []
+        undo_tags = None
+        if changes:
+            exif_cmd = build_exif_cmd(changes)
+            if undo and not export:
+                undo_tags = {tag: current.get(tag) for tag in changes}
+            if linked:
+                exif_cmd.append("-overwrite_original")
+            elif inplace or export or undo_tags is not None:
+                exif_cmd.append("-overwrite_original_in_place")
+
+            # -P = preserve timestamp
+            exif_cmd.append("-P")
+        else:
+            stats.incr("writes_skipped")
+            verbose(f"Skipping {photopath}, metadata already up to date")
+
+        fileop = FileOp(photopath, exif_cmd, xattr_tags, undo_tags=undo_tags)
+        fileop.linked = export_op is None and linked
+        plan.files.append(fileop)
+
+    return plan
+
+
+def prepare_plans(
+    plans,
+    pool=None,
+    test=False,
+    undo_log=None,
+    manifests=None,
+    destinations=None,
+    volumes=None,
+):
+    """ check each plan in plans can be applied and export its files if requested
+        plans: list of PhotoPlan
+        pool: optional concurrent.futures executor used to run the exports
+        test, undo_log, manifests, destinations, volumes: as for apply_plans
+        returns dict of plan uuid -> error for plans that can't be applied """
+
+    mapper = pool.map if pool is not None else map
+
+    def _prepare(plan):
+        """ check saved plan is still valid and export its files if requested
+            return error or None """
+        changed = plan.changed_files()
+        if changed:
+            return StalePlanError(
+                f"file(s) changed since the plan was made: {', '.join(changed)}"
+            )
+        if (
+            not test
+            and undo_log is None
+            and any(f.undo_tags is not None for f in plan.files)
+        ):
+            # the files would be written in place without any backup
+            return ValueError("plan was made with --undo-log, apply it with --undo-log")
+        if plan.export is not None and not test:
+            export = plan.export
+            try:
+                with _volume_limit(
+                    volumes,
+                    *[fileop.path for fileop in plan.files],
+                    os.path.join(export.dest, export.filename),
+                ), stats.busy("export"):
+                    export_photo(
+                        plan,
+                        _VERBOSE,
+                        manifests if plan.manifest else None,
+                        destinations,
                     )
-            else:
-                paths.append(photo.path_edited)
+            except Exception as e:
+                return e
+        return None
 
-        if inplace or export:
-            exif_cmd.append("-overwrite_original_in_place")
+    return {
+        plan.uuid: error
+        for plan, error in zip(plans, mapper(_prepare, plans))
+        if error is not None
+    }
 
-        # -P = preserve timestamp
-        exif_cmd.append("-P")
 
-        # add photopath as last argument
-        exiftool = get_exiftool_path()
-        exif_cmd.insert(0, exiftool)
-        for photopath in paths:
-            # process both original and edited if requested
-            logging.debug(f"running: {[*exif_cmd,photopath]}")
-
-            if not test:
-                try:
-                    # SECURITY NOTE: none of the args to exiftool are shell quoted
-                    # as subprocess.run does this as long as shell=True is not used
-                    proc = subprocess.run(
-                        [*exif_cmd, photopath], check=True, stdout=subprocess.PIPE
-                    )
-                except subprocess.CalledProcessError as e:
-                    sys.exit("subprocess error calling command %s %s" % (exif_cmd, e))
-                else:
-                    logging.debug("returncode: %d" % proc.returncode)
-                    logging.debug(
-                        "Have {} bytes in stdout:\n{}".format(
-                            len(proc.stdout), proc.stdout.decode("utf-8")
-                        )
-                    )
-                    verbose(proc.stdout.decode("utf-8"))
-            else:
-                verbose(f"TEST: Processed {photo.filename}")
-                logging.debug(f"TEST: {[*exif_cmd, photopath]}")
-
-            # update xattr tags if requested
-            if (xattrtag and keywords_raw) or (xattrperson and persons_raw):
-                taglist = []
-                if xattrtag and keywords_raw:
-                    taglist = build_list([taglist, list(keywords_raw)])
-                if xattrperson and persons_raw:
-                    taglist = build_list([taglist, list(persons_raw)])
-
-                verbose(f"Applying extended attributes to {photopath}")
-
-                if not test:
-                    try:
-                        meta = OSXMetaData(photopath)
-                        for tag in taglist:
-                            meta.tags += [Tag(tag)]
-                    except Exception as e:
-                        raise e
-                else:
-                    verbose(f"TEST: applied extended attributes to {photopath}")
-    else:
-        verbose(f"Skipping photo {photopath}, nothing to do")
+def iter_prepared(
+    batches,
+    pool,
+    plans=None,
+    test=False,
+    undo_log=None,
+    manifests=None,
+    destinations=None,
+    volumes=None,
+):
+    """ generator yielding (batch, plan_errors) for each batch in batches once
+        prepare_plans has exported the files of the plans in the batch;
+        run it as a stage so the next batches are exported while the files
+        of a batch are being written
+        pool: concurrent.futures executor used to run the exports
+        plans: function returning the list of PhotoPlan in a batch;
+               by default a batch is a list of PhotoPlan """
+    for batch in batches:
+        plan_errors = prepare_plans(
+            plans(batch) if plans is not None else batch,
+            pool=pool,
+            test=test,
+            undo_log=undo_log,
+            manifests=manifests,
+            destinations=destinations,
+            volumes=volumes,
+        )
+        yield batch, plan_errors
 
-    return
 
+def apply_plans(
+    plans,
+    pool=None,
+    test=False,
+    undo_log=None,
+    manifests=None,
+    plan_errors=None,
+    destinations=None,
+    volumes=None,
+    adaptive=None,
+):
+    """ apply the updates in plans: export (if requested), exiftool writes, xattrs
+        exiftool writes with identical arguments are grouped into a single exiftool command
+        plans: list of PhotoPlan
+        pool: optional concurrent.futures executor used to run the exports and writes
+        test: if True, only report what would be done
+        undo_log: optional UndoLog; the previous tag values of the files are recorded
+                  and flushed to it before any file is written
+        manifests: optional ExportManifests the exports of plans made with an export
+                   manifest are recorded in
+        plan_errors: dict of plan uuid -> error returned by prepare_plans if the plans
+                     were already prepared (e.g. by iter_prepared), else None
+        destinations: optional ExportDestinations the export folders are created with
+        volumes: optional Volumes limiting the files worked on at once on each volume
+        adaptive: optional AdaptiveLimit limiting the exiftool writes run at once
+        generator yielding (plan, error) for each plan; error is None if the plan was applied """
+
+    mapper = pool.map if pool is not None else map
+
+    def _write_group(group):
+        exif_cmd, paths = group
+        with _volume_limit(volumes, *paths), _adaptive_slot(
+            adaptive, len(paths)
+        ), stats.busy("write"), stats.timer("exiftool_write"):
+            return write_group(exif_cmd, paths)
+
+    if plan_errors is None:
+        plan_errors = prepare_plans(
+            plans,
+            pool=pool,
+            test=test,
+            undo_log=undo_log,
+            manifests=manifests,
+            destinations=destinations,
+            volumes=volumes,
+        )
+    # errors by path (for writes)
+    failures = {}
+
+    if undo_log is not None and not test:
+        for plan in plans:
+            if plan.uuid in plan_errors:
+                continue
+            for fileop in plan.files:
+                if fileop.exif_cmd and fileop.undo_tags is not None:
+                    undo_log.record(fileop.path, fileop.undo_tags)
+        with stats.timer("undo_log"):
+            undo_log.flush()
+
+    groups = group_writes(plan for plan in plans if plan.uuid not in plan_errors)
+    if test:
+        for exif_cmd, paths in groups:
+            for path in paths:
+                verbose(f"TEST: Processed {path}")
+                logging.debug(f"TEST: {[*exif_cmd, path]}")
+    else:
+        # SECURITY NOTE: args are passed to exiftool one per line via
+        # the -stay_open argfile, no shell is involved
+        for (exif_cmd, paths), (output, errors) in zip(
+            groups, mapper(_write_group, groups)
+        ):
+            logging.debug(f"ran: {[*exif_cmd, *paths]}")
+            verbose(output)
+            failures.update(errors)
+
+    def _apply_files(plan):
+        """ write XMP sidecars and update xattr tags for files in plan,
+            return first error or None """
+        with stats.busy("write"):
+            error = plan_errors.get(plan.uuid) or next(
+                (failures[p] for p in plan.paths if p in failures), None
+            )
+            if error is not None:
+                return error
+            for fileop in plan.files:
+                if fileop.xmp_tags:
+                    if test:
+                        verbose(f"TEST: wrote XMP sidecar for {fileop.path}")
+                    else:
+                        try:
+                            with stats.timer("xmp_sidecar"):
+                                updated = write_sidecar(fileop.path, fileop.xmp_tags)
+                            if updated:
+                                verbose(f"Wrote XMP sidecar for {fileop.path}")
+                            else:
+                                stats.incr("sidecars_skipped")
+                        except Exception as e:
+                            return e
+                if not fileop.xattr_tags:
+                    continue
+                verbose(f"Applying extended attributes to {fileop.path}")
+                if test:
+                    verbose(f"TEST: applied extended attributes to {fileop.path}")
+                    continue
+                try:
+                    from ._xattr import write_user_tags
+
+                    if fileop.linked and os.stat(fileop.path).st_nlink > 1:
+                        # don't change the tags of the photo's file too
+                        break_link(fileop.path)
+                    with stats.timer("xattr"):
+                        updated = write_user_tags(fileop.path, fileop.xattr_tags)
+                    if not updated:
+                        stats.incr("xattr_skipped")
+                except Exception as e:
+                    return e
+            if plan.manifest and manifests is not None and not test:
+                # record the exported files as written so they're skipped next time
+                for path in plan.paths:
+                    manifests.update_stat(path)
+            return None
+
+    yield from zip(plans, mapper(_apply_files, plans))
+
+
+def apply_batch(plans, **kwargs):
+    """ generator yielding (plan, error) for each plan like apply_plans(plans, **kwargs)
+        an exception that stops the whole batch (e.g. the undo log can't be written)
+        is yielded as the error of each plan not yet applied so the run can go on
+        with the next batch """
+    applied = 0
+    try:
+        for result in apply_plans(plans, **kwargs):
+            applied += 1
+            yield result
+    except Exception as e:
+        logging.debug(f"batch of {len(plans)} plans failed: {e!r}")
+        for plan in plans[applied:]:
+            yield plan, e
+
+
+def iter_photo_batches(photosdb, uuids, keep=None, batch_size=_READ_BATCH_SIZE):
+    """ generator yielding (photos, skipped) for each batch of batch_size uuids
+        photos: list of PhotoRecord objects for the batch, in uuids order
+        skipped: number of photos in the batch left out because keep(photo) was False
+        PhotoInfo objects are only created for one batch at a time and
+        are dropped once their PhotoRecord has been extracted """
+    for chunk in chunked(uuids, batch_size):
+        with stats.timer("resolve_batch"):
+            by_uuid = {
+                photo.uuid: photo
+                if isinstance(photo, PhotoRecord)
+                else PhotoRecord.from_photoinfo(photo)
+                for photo in photosdb.photos(uuid=chunk)
+            }
+            photos = [by_uuid[uuid] for uuid in chunk if uuid in by_uuid]
+        if keep is not None:
+            with stats.timer("state_check_batch"):
+                photos = [photo for photo in photos if keep(photo)]
+        yield photos, len(chunk) - len(photos)
+
+
+def iter_batches_with_tags(batches, prefetch=True, native=True, adaptive=None):
+    """ generator yielding (photos, skipped) for each (photos, skipped) in batches
+        with photos as list of (photo, exif_info)
+        if prefetch is True, tags for all photos in a batch are read:
+        JPEG and HEIC files with the built-in reader (if native is True) and the rest
+        with a single exiftool command on a session dedicated to reading,
+        started only if needed;
+        exif_info is None if tags were not prefetched or could not be read
+        adaptive: optional AdaptiveLimit the time taken by the exiftool reads is
+                  reported to """
+    if not prefetch:
+        for photos, skipped in batches:
+            yield [(photo, None) for photo in photos], skipped
+        return
 
-def create_path_by_date(dest, dt):
-    """ Creates a path in dest folder in form dest/YYYY/MM/DD/
-        dest: valid path as str
+    session = ExifToolSession()
+    try:
+        for photos, skipped in batches:
+            with stats.busy("read"):
+                paths = [
+                    photo.path
+                    for photo in photos
+                    if not photo.ismissing and photo.path and os.path.exists(photo.path)
+                ]
+                tags = {}
+                if native:
+                    with stats.timer("native_read_batch"):
+                        for path in paths:
+                            exif_info = read_jpeg_tags(path, READ_TAGS)
+                            if exif_info is not None:
+                                tags[path] = exif_info
+                    stats.incr("native_reads", len(tags))
+                    paths = [path for path in paths if path not in tags]
+                if paths:
+                    start = time.perf_counter()
+                    with stats.timer("exiftool_read_batch"):
+                        tags.update(read_tags(paths, tags=READ_TAGS, session=session))
+                    if adaptive is not None:
+                        adaptive.observe(time.perf_counter() - start, len(paths))
+            yield [(photo, tags.get(photo.path)) for photo in photos], skipped
+    finally:
+        session.close()
+
+
+def path_by_date(dest, dt):
+    """ Returns a path in dest folder in form dest/YYYY/MM/DD/
+        dest: path as str
         dt: datetime.timetuple() object
-        Checks to see if path exists, if it does, do nothing and return path
-        If path does not exist, creates it and returns path"""
-    if not os.path.isdir(dest):
-        raise FileNotFoundError(f"dest {dest} must be valid path")
+        The path is not created; export_photo creates it when the photo is exported
+        and process_photos names the export in memory from a listing of the path """
     yyyy, mm, dd = dt[0:3]
     yyyy = str(yyyy).zfill(4)
     mm = str(mm).zfill(2)
     dd = str(dd).zfill(2)
-    new_dest = os.path.join(dest, yyyy, mm, dd)
-    if not os.path.isdir(new_dest):
-        os.makedirs(new_dest)
-    return new_dest
+    return os.path.join(dest, yyyy, mm, dd)
+
+
+def _fingerprint(photo, args):
+    """ return metadata fingerprint for photo given the options in args """
+    # the export options only matter, and are only included, when exporting
+    export = bool(args.export)
+    return metadata_fingerprint(
+        photo,
+        export=args.export,
+        export_by_date=export and args.export_by_date,
+        original_name=export and args.original_name,
+        copy_mode=args.copy_mode if export else None,
+        xattrtag=args.xattrtag,
+        xattrperson=args.xattrperson,
+        edited=args.edited,
+        albums_as_keywords=args.albums_as_keywords,
+        persons_as_keywords=args.persons_as_keywords,
+        sidecar=args.sidecar,
+    )
+
+
+def process_photos(
+    photosdb,
+    uuids,
+    args,
+    state=None,
+    journal=None,
+    attempt=1,
+    plan_file=None,
+    undo_log=None,
+    volumes=None,
+    adaptive=None,
+):
+    """ process the photos with the given uuids as a pipeline of stages:
+        resolve PhotoRecord -> read tags -> plan -> write -> xattr
+        stages run concurrently, passing batches of photos through bounded queues
+        so memory use doesn't grow with the number of photos;
+        planning and writing use a pool of args.jobs worker threads,
+        each with its own exiftool session;
+        errors are reported per photo and don't stop the run
+        state: optional SyncState; photos that haven't changed since they were
+               last written are skipped unless args.full is set
+        journal: optional RunJournal each photo processed or failed is recorded in
+        attempt: number of times these photos have been tried in this run, for journal
+        plan_file: optional file object; if given, the plans are written to it
+                   (see PhotoPlan.to_json) instead of being applied
+        undo_log: optional UndoLog the previous values of the tags written are
+                  recorded in; files are then written without a backup copy
+        volumes: optional Volumes limiting the files worked on at once on each volume
+        adaptive: optional AdaptiveLimit adjusting the exiftool writes run at once
+        returns dict of uuid -> (photo, error) for photos that could not be processed """
+
+    keep = None
+    if state is not None and not args.full and not args.showmissing:
+
+        def keep(photo):
+            if state.is_current(photo.uuid, _fingerprint(photo, args)):
+                stats.incr("photos_unchanged")
+                return False
+            return True
+
+    def _plan(photo, exif_info):
+        verbose(f"processing photo: {photo.filename} {photo.path}")
+        if photo.ismissing and args.showmissing:
+            write(
+                f"Missing photo: '{photo.filename}' in database but ismissing flag set; path: {photo.path}"
+            )
+        elif not args.showmissing:
+            with _volume_limit(volumes, photo.path), stats.busy("plan"), stats.timer(
+                "plan"
+            ):
+                return plan_photo(
+                    photo,
+                    export=args.export,
+                    inplace=args.inplace,
+                    xattrtag=args.xattrtag,
+                    xattrperson=args.xattrperson,
+                    export_by_date=args.export_by_date,
+                    edited=args.edited,
+                    original_name=args.original_name,
+                    albums_as_keywords=args.albums_as_keywords,
+                    persons_as_keywords=args.persons_as_keywords,
+                    exif_info=exif_info,
+                    sidecar=args.sidecar,
+                    native_read=not args.no_native_read,
+                    undo=bool(args.undo_log),
+                    manifests=manifests,
+                    copy_mode=args.copy_mode,
+                )
+        return None
+
+    manifests = ExportManifests() if args.export and args.export_update else None
+    # export folders are listed once and new exports named in memory
+    destinations = ExportDestinations()
+    failed = {}
+
+    def _error(photo, e):
+        stats.incr("photo_errors")
+        failed[photo.uuid] = (photo, e)
+        write(f"ERROR: could not process photo {photo.filename}: {e}")
+        if journal is not None and not args.test and plan_file is None:
+            journal.record_failure(photo.uuid, photo.filename, photo.path, e, attempt)
+
+    def _plan_batches(batches):
+        """ plan each photo in each batch; yields (list of (photo, plan), done)
+            where done is the number of photos in the batch that need no further work """
+        for photos, done in batches:
+            futures = [
+                (photo, pool.submit(_plan, photo, exif_info))
+                for photo, exif_info in photos
+            ]
+            planned = []
+            for photo, future in futures:
+                try:
+                    plan = future.result()
+                except Exception as e:
+                    _error(photo, e)
+                    plan = None
+                if plan is None:
+                    done += 1
+                    continue
+                if plan.export is not None:
+                    # name the exports here, in order, so they don't depend on
+                    # which of the plans running concurrently finishes first
+                    with stats.timer("export_names"):
+                        plan.export.filename = destinations.claim(
+                            plan.export.dest,
+                            plan.export.filename,
+                            edited=len(plan.files) > 1,
+                            overwrite=plan.export.overwrite,
+                        )
+                planned.append((photo, plan))
+            yield planned, done
+
+    from tqdm import tqdm
+
+    jobs = max(1, args.jobs)
+    export_jobs = max(1, args.export_jobs)
+    prefetch = not args.showmissing and not args.sidecar
+    # exports run in a stage of their own, on their own pool, so the files
+    # of the next batches are copied while a batch is being tagged
+    export_stage = bool(args.export) and plan_file is None and not args.showmissing
+    if prefetch:
+        stats.set_workers("read", 1)
+    stats.set_workers("plan", jobs)
+    if export_stage:
+        stats.set_workers("export", export_jobs)
+    if plan_file is None:
+        stats.set_workers("write", jobs)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool, ThreadPoolExecutor(
+        max_workers=export_jobs
+    ) as export_pool, tqdm(total=len(uuids), disable=args.noprogress) as progress:
+        batches = stage(iter_photo_batches(photosdb, uuids, keep=keep))
+        batches = stage(
+            iter_batches_with_tags(
+                batches,
+                prefetch=prefetch,
+                native=not args.no_native_read,
+                adaptive=adaptive,
+            )
+        )
+        batches = stage(_plan_batches(batches))
+        if export_stage:
+            batches = stage(
+                iter_prepared(
+                    batches,
+                    export_pool,
+                    plans=lambda batch: [plan for _, plan in batch[0]],
+                    test=args.test,
+                    undo_log=undo_log,
+                    manifests=manifests,
+                    destinations=destinations,
+                    volumes=volumes,
+                ),
+                maxsize=_EXPORT_QUEUE_SIZE,
+            )
+        else:
+            batches = ((batch, None) for batch in batches)
+        for (planned, done), plan_errors in batches:
+            progress.update(done)
+            if plan_file is not None:
+                for _, plan in planned:
+                    plan_file.write(plan.to_json() + "\n")
+                stats.incr("photos_planned", len(planned))
+                progress.update(len(planned))
+                continue
+            # apply all the writes in a batch together
+            # so files needing the same tags are written by one exiftool command
+            results = apply_batch(
+                [plan for _, plan in planned],
+                pool=pool,
+                test=args.test,
+                undo_log=undo_log,
+                manifests=manifests,
+                plan_errors=plan_errors,
+                destinations=destinations,
+                volumes=volumes,
+                adaptive=adaptive,
+            )
+            for (photo, _), (plan, error) in zip(planned, results):
+                if error is not None:
+                    _error(photo, error)
+                    progress.update(1)
+                    continue
+                if state is not None and not args.test:
+                    with stats.timer("state_update"):
+                        state.update(photo.uuid, _fingerprint(photo, args), plan.paths)
+                if journal is not None and not args.test:
+                    journal.record_done(photo.uuid)
+                if volumes is not None:
+                    volumes.record_done(photo.path)
+                progress.update(1)
+    stats.add_elapsed(time.perf_counter() - start)
+    # the pools' threads are done, don't keep their exiftool processes running
+    close_finished_sessions()
+
+    return failed
+
+
+def process_with_retries(
+    photosdb,
+    uuids,
+    args,
+    state=None,
+    journal=None,
+    plan_file=None,
+    undo_log=None,
+    volumes=None,
+    adaptive=None,
+):
+    """ process the photos with the given uuids then retry the photos that failed
+        up to args.retries times, waiting args.retry_delay seconds before the first
+        retry and twice as long before each further retry
+        returns dict of uuid -> (photo, error, attempts) for photos that still failed """
+    failed = {}
+    attempts = 0
+    while uuids:
+        if attempts:
+            delay = args.retry_delay * 2 ** (attempts - 1)
+            write(
+                f"Retrying {len(uuids)} failed photo(s) in {delay:g} second(s) "
+                f"(retry {attempts} of {args.retries})"
+            )
+            time.sleep(delay)
+        attempts += 1
+        failed = process_photos(
+            photosdb,
+            uuids,
+            args,
+            state=state,
+            journal=journal,
+            attempt=attempts,
+            plan_file=plan_file,
+            undo_log=undo_log,
+            volumes=volumes,
+            adaptive=adaptive,
+        )
+        if attempts > args.retries:
+            break
+        # keep the photos in the order they were selected
+        uuids = [uuid for uuid in uuids if uuid in failed]
+    return {uuid: (photo, error, attempts) for uuid, (photo, error) in failed.items()}
+
+
+def write_failures(path, failed):
+    """ write the photos in failed (dict of uuid -> (photo, error, attempts))
+        to path as a JSON list """
+    failures = [
+        {
+            "uuid": uuid,
+            "filename": photo.filename,
+            "path": photo.path,
+            "error": str(error),
+            "error_type": type(error).__name__,
+            "attempts": attempts,
+        }
+        for uuid, (photo, error, attempts) in failed.items()
+    ]
+    with open(path, "w") as fd:
+        json.dump(failures, fd, indent=2)
+
+
+def _apply_plan_batches(batches, args, undo_log=None, adaptive=None):
+    """ apply each list of PhotoPlan in batches with a pool of args.jobs threads;
+        exports are done ahead by a pool of args.export_jobs threads
+        adaptive: optional AdaptiveLimit adjusting the exiftool writes run at once
+        returns number of photos whose plan could not be applied """
+    from tqdm import tqdm
+
+    failed = 0
+    jobs = max(1, args.jobs)
+    export_jobs = max(1, args.export_jobs)
+    stats.set_workers("export", export_jobs)
+    stats.set_workers("write", jobs)
+    # for plans made with --export-update
+    manifests = ExportManifests()
+    destinations = ExportDestinations()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool, ThreadPoolExecutor(
+        max_workers=export_jobs
+    ) as export_pool, tqdm(disable=args.noprogress) as progress:
+        batches = stage(
+            iter_prepared(
+                batches,
+                export_pool,
+                test=args.test,
+                undo_log=undo_log,
+                manifests=manifests,
+                destinations=destinations,
+            ),
+            maxsize=_EXPORT_QUEUE_SIZE,
+        )
+        for plans, plan_errors in batches:
+            for plan, error in apply_batch(
+                plans,
+                pool=pool,
+                test=args.test,
+                undo_log=undo_log,
+                manifests=manifests,
+                plan_errors=plan_errors,
+                destinations=destinations,
+                adaptive=adaptive,
+            ):
+                if error is not None:
+                    failed += 1
+                    stats.incr("photo_errors")
+                    write(f"ERROR: could not process photo {plan.filename}: {error}")
+                progress.update(1)
+    stats.add_elapsed(time.perf_counter() - start)
+    # the pools' threads are done, don't keep their exiftool processes running
+    close_finished_sessions()
+    return failed
+
+
+def apply_plan_files(paths, args, undo_log=None, adaptive=None):
+    """ apply the plans saved in plan files paths (see --plan)
+        the Photos database isn't needed as plans hold everything to be done
+        undo_log: optional UndoLog to record the previous tag values in,
+                  for plans made with --undo-log
+        adaptive: optional AdaptiveLimit adjusting the exiftool writes run at once
+        returns number of photos whose plan could not be applied """
+
+    def _batches():
+        for path in paths:
+            verbose(f"Applying plan {path}")
+            yield from stage(chunked(read_plan_file(path), _READ_BATCH_SIZE))
+
+    return _apply_plan_batches(_batches(), args, undo_log=undo_log, adaptive=adaptive)
+
+
+def rollback(path, args):
+    """ restore the tags recorded in undo log path to their previous values
+        returns number of files that could not be restored
+        raises UndoLogError if path is not an undo log """
+    plans = [
+        PhotoPlan(
+            filepath,
+            os.path.basename(filepath),
+            [
+                FileOp(
+                    filepath,
+                    build_restore_cmd(previous)
+                    + ["-overwrite_original_in_place", "-P"],
+                )
+            ],
+        )
+        for filepath, previous in read_undo_log(path).items()
+    ]
+    write(f"Restoring metadata of {len(plans)} file(s) from undo log {path}")
+    return _apply_plan_batches(chunked(plans, _READ_BATCH_SIZE), args)
+
+
+def _open_adaptive(args):
+    """ return AdaptiveLimit for --adaptive-jobs or None if not given;
+        exit if the decision log can't be opened """
+    if not args.adaptive_jobs:
+        return None
+    try:
+        return AdaptiveLimit(
+            args.jobs, args.latency_ceiling, log_path=args.adaptive_log, log=verbose
+        )
+    except OSError as e:
+        sys.exit(f"could not open adaptive jobs log: {e}")
+
+
+def _open_undo_log(args):
+    """ return UndoLog for --undo-log or None if not given or nothing will be written;
+        exit if it can't be opened """
+    if not args.undo_log or args.test or args.plan:
+        return None
+    try:
+        return UndoLog(args.undo_log)
+    except (UndoLogError, OSError) as e:
+        sys.exit(f"could not open undo log: {e}")
+
+
+def _mb(size):
+    """ return size in bytes as a string in MB """
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def schedule_by_volume(photosdb, uuids, volumes):
+    """ return uuids reordered so the volumes the photos' files are on are worked on
+        at the same time, each in on-disk order (see Volumes.schedule) """
+    return volumes.schedule(
+        (photo.uuid, photo.path)
+        for chunk in chunked(uuids, _READ_BATCH_SIZE)
+        for photo in photosdb.photos(uuid=chunk)
+    )
+
+
+def report_run(failed, adaptive=None):
+    """ print summary of run
+        failed: number of photos that could not be processed
+        adaptive: AdaptiveLimit used in the run, if any """
+    if stats["photos_unchanged"]:
+        write(f"Skipped {stats['photos_unchanged']} unchanged photo(s)")
+    if stats["sidecars_skipped"]:
+        write(f"Skipped {stats['sidecars_skipped']} XMP sidecar(s) already up to date")
+    if stats["export_files_copied"] or stats["export_files_skipped"]:
+        write(
+            f"Exported {stats['export_files_copied']} file(s) "
+            f"({_mb(stats['export_bytes_copied'])} copied, "
+            f"{_mb(stats['export_bytes_cloned'])} cloned or linked), skipped "
+            f"{stats['export_files_skipped']} file(s) already exported and up to date "
+            f"({_mb(stats['export_bytes_skipped'])})"
+        )
+    if stats["writes_skipped"]:
+        write(
+            f"Skipped {stats['writes_skipped']} exiftool write(s), "
+            "files already had the desired metadata"
+        )
+    if failed:
+        write(f"{failed} photo(s) could not be processed")
+    # leave out stages that had nothing to do, e.g. export when applying plans
+    stages = {
+        stage: usage
+        for stage, usage in stats.utilisation().items()
+        if usage["busy_seconds"]
+    }
+    if stages:
+        write(
+            "Stage utilisation: "
+            + ", ".join(
+                f"{stage} {usage['utilisation']:.0%} of {usage['workers']} worker(s)"
+                for stage, usage in stages.items()
+            )
+        )
+    if adaptive is not None and adaptive.decisions:
+        actions = [decision["action"] for decision in adaptive.decisions]
+        write(
+            f"Adaptive jobs: {actions.count(INCREASE)} increase(s), "
+            f"{actions.count(DECREASE)} decrease(s), finished with {adaptive.limit} "
+            f"of {adaptive.max_workers} worker(s)"
+        )
+    for volume in stats.volumes:
+        if not volume["photos"]:
+            continue
+        write(
+            f"Volume {volume['volume']} ({volume['mount_point']}, {volume['kind']}, "
+            f"{volume['workers']} worker(s)): {volume['photos']} photo(s) in "
+            f"{volume['seconds']:.1f}s, {volume['photos_per_second']:.1f} photo(s)/s, "
+            f"{volume['utilisation']:.0%} utilisation"
+        )
+    write(f"Peak memory usage: {peak_rss_mb():.1f} MB")
+
+
+def _write_profile(path, start):
+    """ write the run's counters and timers to path as JSON
+        start: time.perf_counter() at the start of the run """
+    report = {
+        "version": __version__,
+        "argv": sys.argv[1:],
+        "wall_seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+        **stats.report(),
+    }
+    with open(path, "w") as fd:
+        json.dump(report, fd, indent=2)
 
 
 def main():
@@ -594,6 +1688,15 @@ def main():
         print(f"Version: {__version__}")
         sys.exit(0)
 
+    # the reports are written at exit so they cover runs ending in sys.exit
+    if args.profile:
+        stats.timing = True
+        atexit.register(_write_profile, args.profile, time.perf_counter())
+    if args.cprofile:
+        profiler = ThreadProfiler()
+        atexit.register(profiler.dump, args.cprofile)
+        profiler.start()
+
     if args.export:
         print(
             "DEPRECATED: export option is deprecated.  Consider using osxphotos: https://github.com/RhetTbull/osxphotos",
@@ -619,6 +1722,45 @@ def main():
         if ans.upper() != "Y":
             sys.exit(0)
 
+    if args.resume and not args.journal:
+        sys.exit("--resume requires --journal")
+    if args.export_update and not args.export:
+        sys.exit("--export-update requires --export")
+    if args.adaptive_jobs and args.jobs < 2:
+        sys.exit("--adaptive-jobs requires --jobs N with N of 2 or more")
+
+    if args.rollback:
+        if not os.path.isfile(args.rollback):
+            sys.exit(f"undo log {args.rollback} does not exist")
+        try:
+            failed = rollback(args.rollback, args)
+        except UndoLogError as e:
+            sys.exit(str(e))
+        report_run(failed)
+        if failed:
+            sys.exit(1)
+        sys.exit(0)
+
+    if args.apply:
+        for path in args.apply:
+            if not os.path.isfile(path):
+                sys.exit(f"plan file {path} does not exist")
+        undo_log = _open_undo_log(args)
+        adaptive = _open_adaptive(args)
+        try:
+            failed = apply_plan_files(
+                args.apply, args, undo_log=undo_log, adaptive=adaptive
+            )
+        finally:
+            if undo_log is not None:
+                undo_log.close()
+            if adaptive is not None:
+                adaptive.close()
+        report_run(failed, adaptive)
+        if failed:
+            sys.exit(1)
+        sys.exit(0)
+
     if any([args.all, args.album, args.keyword, args.person, args.uuid, args.list]):
         print("Loading database...")
         db = args.photos_library if args.photos_library is not None else args.database
@@ -626,8 +1768,24 @@ def main():
             sys.exit(
                 "Must pass valid Photos library database via --database or photos_library positional argument"
             )
-        photosdb = osxphotos.PhotosDB(dbfile=db)
-        print(f"Loaded database {photosdb.library_path}")
+        with stats.timer("load_snapshot"):
+            photosdb = None if args.no_cache else load_snapshot(db)
+        if photosdb is not None:
+            print(f"Loaded cached snapshot of database {photosdb.library_path}")
+        else:
+            key = library_key(db)
+            with stats.timer("load_database"):
+                import osxphotos
+
+                photosdb = osxphotos.PhotosDB(dbfile=db)
+            print(f"Loaded database {photosdb.library_path}")
+            if not args.no_cache:
+                with stats.timer("save_snapshot"):
+                    photosdb = LibrarySnapshot.from_photosdb(photosdb)
+                    try:
+                        save_snapshot(db, photosdb, key)
+                    except OSError as e:
+                        write(f"WARNING: could not save snapshot of database: {e}")
     else:
         print(
             "You must select at least one of the following options: "
@@ -656,57 +1814,92 @@ def main():
         sys.exit(0)
 
     # collect list of files to process
-    # for now, all conditions (albums, keywords, uuid, faces) are considered "OR"
+    # with --match any (default), conditions (albums, keywords, uuid, faces) are "OR"
     # e.g. --keyword=family --album=Vacation finds all photos with keyword family OR album Vacation
-    photos = []
-
-    if args.all:
-        # process all the photos
-        photos = photosdb.photos()
-    else:
-        if args.album is not None:
-            photos.extend(photosdb.photos(albums=args.album))
-
-        if args.uuid is not None:
-            photos.extend(photosdb.photos(uuid=args.uuid))
-
-        if args.keyword is not None:
-            photos.extend(photosdb.photos(keywords=args.keyword))
-
-        if args.person is not None:
-            photos.extend(photosdb.photos(persons=args.person))
+    # with --match all, they are "AND"
+    with stats.timer("select"):
+        uuids = select_photos(
+            photosdb,
+            all_photos=args.all,
+            albums=args.album,
+            uuids=args.uuid,
+            keywords=args.keyword,
+            persons=args.person,
+            match=args.match,
+        )
 
     if _DEBUG:
         pp = pprint.PrettyPrinter(indent=4)
         logging.debug("Photos to process:")
-        logging.debug(pp.pformat(photos))
+        logging.debug(pp.pformat(uuids))
+
+    journal = None
+    if args.journal:
+        try:
+            journal = RunJournal(args.journal, db, resume=args.resume)
+        except (JournalError, OSError) as e:
+            sys.exit(f"could not open journal: {e}")
+        if args.resume:
+            if journal.done:
+                total = len(uuids)
+                uuids = [uuid for uuid in uuids if uuid not in journal.done]
+                write(
+                    f"Resuming: skipping {total - len(uuids)} photo(s) "
+                    f"already processed according to journal {args.journal}"
+                )
+            if journal.failures:
+                write(f"Retrying {len(journal.failures)} photo(s) that failed before")
 
     # process each photo
     # if showmissing=True, only list missing photos, don't process them
-    if len(photos) > 0:
-        tqdm.write(f"Processing {len(photos)} photo(s)")
-        for photo in tqdm(iterable=photos, disable=args.noprogress):
-            verbose(f"processing photo: {photo.filename} {photo.path}")
-            if photo.ismissing and args.showmissing:
-                tqdm.write(
-                    f"Missing photo: '{photo.filename}' in database but ismissing flag set; path: {photo.path}"
-                )
-            elif not args.showmissing:
-                process_photo(
-                    photo,
-                    test=args.test,
-                    export=args.export,
-                    inplace=args.inplace,
-                    xattrtag=args.xattrtag,
-                    xattrperson=args.xattrperson,
-                    export_by_date=args.export_by_date,
-                    edited=args.edited,
-                    original_name=args.original_name,
-                    albums_as_keywords=args.albums_as_keywords,
-                    persons_as_keywords=args.persons_as_keywords,
+    if len(uuids) > 0:
+        write(f"Processing {len(uuids)} photo(s)")
+        state = SyncState(args.state) if args.state else None
+        plan_file = open(args.plan, "w", encoding="utf-8") if args.plan else None
+        undo_log = _open_undo_log(args)
+        adaptive = _open_adaptive(args)
+        volumes = None
+        if args.by_volume:
+            volumes = Volumes(args.jobs, args.hdd_jobs)
+            with stats.timer("schedule_by_volume"):
+                uuids = schedule_by_volume(photosdb, uuids, volumes)
+        try:
+            with stats.timer("process_photos"):
+                failed = process_with_retries(
+                    photosdb,
+                    uuids,
+                    args,
+                    state=state,
+                    journal=journal,
+                    plan_file=plan_file,
+                    undo_log=undo_log,
+                    volumes=volumes,
+                    adaptive=adaptive,
                 )
+        finally:
+            if state is not None:
+                state.close()
+            if journal is not None:
+                journal.close()
+            if plan_file is not None:
+                plan_file.close()
+            if undo_log is not None:
+                undo_log.close()
+            if adaptive is not None:
+                adaptive.close()
+            if volumes is not None:
+                stats.set_volumes(volumes.report())
+        report_run(len(failed), adaptive)
+        if args.plan:
+            write(f"Wrote plan for {stats['photos_planned']} photo(s) to {args.plan}")
+        if args.failed:
+            write_failures(args.failed, failed)
+        if failed:
+            sys.exit(1)
     else:
-        tqdm.write("No photos found to process")
+        if journal is not None:
+            journal.close()
+        write("No photos found to process")
 
 
 if __name__ == "__main__":
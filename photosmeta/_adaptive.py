@@ -0,0 +1,150 @@
+# adaptive concurrency for photosmeta
+# with --adaptive-jobs the number of exiftool writes run at once is adjusted during
+# the run, between 1 and --jobs, AIMD style: every few seconds the files written per
+# second and the latency per file of the exiftool reads and writes are measured;
+# if the latency is above --latency-ceiling the limit is halved, if throughput fell
+# after the last increase that increase is undone, otherwise the limit grows by one
+# while the writes are using all the workers allowed
+# each decision is logged (as a JSON line to --adaptive-log) so it can be inspected
+
+import contextlib
+import json
+import threading
+import time
+
+# seconds and number of exiftool calls measured before each decision
+_WINDOW_SECONDS = 2.0
+_MIN_CALLS = 4
+
+# fraction the limit is multiplied by when the latency is above the ceiling
+_DECREASE_FACTOR = 0.5
+
+# fall in throughput after an increase that undoes it, as a fraction
+_THROUGHPUT_TOLERANCE = 0.1
+
+# decision actions
+INCREASE = "increase"
+DECREASE = "decrease"
+HOLD = "hold"
+
+
+class AdaptiveLimit:
+    """ limit on the number of exiftool writes run at once, adjusted during the run
+        from the throughput and latency measured; see slot() and observe()
+        safe to use from multiple threads """
+
+    def __init__(self, max_workers, latency_ceiling, log_path=None, log=None):
+        """ max_workers: most writes run at once; the limit starts at 1
+            latency_ceiling: seconds per file the exiftool calls should stay under
+            log_path: optional path of a file the decisions are appended to
+            log: optional function called with a message for each change of the limit """
+        self.max_workers = max(1, max_workers)
+        self.latency_ceiling = latency_ceiling
+        self.limit = 1
+        self.decisions = []
+        self._cond = threading.Condition()
+        self._active = 0
+        self._log = log
+        self._log_fd = open(log_path, "a", encoding="utf-8") if log_path else None
+        self._last_action = None
+        self._last_throughput = None
+        self._start_window(time.perf_counter())
+
+    def _start_window(self, now):
+        self._window_start = now
+        self._calls = 0
+        self._seconds = 0.0
+        self._files = 0
+        self._written = 0
+        # the writes used all the workers allowed at some point in the window
+        self._saturated = self._active >= self.limit
+
+    @contextlib.contextmanager
+    def slot(self, files=1):
+        """ context manager for an exiftool write of files files: waits until fewer
+            writes than the limit are running and records the time taken """
+        with self._cond:
+            while self._active >= self.limit:
+                self._saturated = True
+                self._cond.wait()
+            self._active += 1
+            if self._active >= self.limit:
+                self._saturated = True
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._cond:
+                self._active -= 1
+                self._written += files
+                self._observe(seconds, files)
+                self._cond.notify_all()
+
+    def observe(self, seconds, files=1):
+        """ record an exiftool call of files files run outside slot(), e.g. a read,
+            that took seconds """
+        with self._cond:
+            self._observe(seconds, files)
+            self._cond.notify_all()
+
+    def _observe(self, seconds, files):
+        self._calls += 1
+        self._seconds += seconds
+        self._files += max(1, files)
+        now = time.perf_counter()
+        elapsed = now - self._window_start
+        if elapsed >= _WINDOW_SECONDS and self._calls >= _MIN_CALLS:
+            self._decide(now, elapsed)
+
+    def _decide(self, now, elapsed):
+        """ adjust the limit from the window that just ended and start a new one """
+        throughput = self._written / elapsed
+        latency = self._seconds / self._files
+        before = self.limit
+        if latency > self.latency_ceiling:
+            action = DECREASE
+            reason = "latency above ceiling"
+            self.limit = max(1, int(self.limit * _DECREASE_FACTOR))
+        elif self._last_action == INCREASE and throughput < self._last_throughput * (
+            1 - _THROUGHPUT_TOLERANCE
+        ):
+            action = DECREASE
+            reason = "throughput fell after increase"
+            self.limit = max(1, self.limit - 1)
+        elif self._saturated and self.limit < self.max_workers:
+            action = INCREASE
+            reason = "all workers busy"
+            self.limit += 1
+        else:
+            action = HOLD
+            reason = "at maximum" if self._saturated else "workers not all busy"
+        if self.limit == before:
+            action = HOLD
+        decision = {
+            "time": time.time(),
+            "action": action,
+            "reason": reason,
+            "workers_before": before,
+            "workers": self.limit,
+            "files_per_second": throughput,
+            "latency_per_file": latency,
+            "calls": self._calls,
+        }
+        self.decisions.append(decision)
+        if self._log_fd is not None:
+            self._log_fd.write(json.dumps(decision) + "\n")
+            self._log_fd.flush()
+        if self._log is not None and action != HOLD:
+            self._log(
+                f"Adaptive jobs: {before} -> {self.limit} worker(s), {reason} "
+                f"({throughput:.1f} file(s)/s, {latency * 1000:.0f} ms per file)"
+            )
+        self._last_action = action
+        self._last_throughput = throughput
+        self._start_window(now)
+
+    def close(self):
+        """ close the decision log """
+        if self._log_fd is not None:
+            self._log_fd.close()
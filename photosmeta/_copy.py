@@ -0,0 +1,220 @@
+# file copy backends for photosmeta exports
+# copy modes:
+#   reflink:  copy-on-write clone (FICLONE on Linux btrfs/XFS, clonefile on macOS APFS);
+#             no data is copied until one of the files is changed
+#   hardlink: hard link to the photo's file; the link is broken when the metadata of
+#             the export is written (exiftool -overwrite_original writes a new file)
+#   copy:     copy the data in the kernel with copy_file_range, or by streaming it
+#             with large buffers into a preallocated file
+#   auto:     reflink if the filesystem supports it, otherwise copy
+# the copies keep the timestamps of the source so exiftool -P preserves them, and its
+# extended attributes (e.g. Finder tags and comments) so --xattrtag merges with them
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import shutil
+import sys
+
+COPY_MODES = ["auto", "reflink", "hardlink", "copy"]
+
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+COPY_FILE_RANGE = "copy_file_range"
+STREAM = "stream"
+
+# ioctl to clone a file on Linux, _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+_STREAM_BUFFER_SIZE = 8 * 1024 * 1024
+
+# errors meaning a copy method isn't supported for the files, try the next one
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+}
+
+# copyfile(3) flag to copy extended attributes on macOS
+_COPYFILE_XATTR = 1 << 2
+
+_clonefile = None
+_copyfile = None
+
+
+class CopyModeError(OSError):
+    """ raised when the requested copy mode isn't supported for the files """
+
+
+def _macos_clonefile():
+    """ return libc clonefile function on macOS """
+    global _clonefile
+    if _clonefile is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        _clonefile = libc.clonefile
+        _clonefile.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+        _clonefile.restype = ctypes.c_int
+    return _clonefile
+
+
+def _macos_copyfile():
+    """ return libc copyfile function on macOS """
+    global _copyfile
+    if _copyfile is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        _copyfile = libc.copyfile
+        _copyfile.argtypes = [
+            ctypes.c_char_p,
+            ctypes.c_char_p,
+            ctypes.c_void_p,
+            ctypes.c_uint32,
+        ]
+        _copyfile.restype = ctypes.c_int
+    return _copyfile
+
+
+def _copy_xattrs(src, dest_path):
+    """ copy the extended attributes of src to dest_path on macOS, where
+        shutil.copystat doesn't; clones and hard links already share them """
+    if sys.platform != "darwin":
+        return
+    if _macos_copyfile()(
+        os.fsencode(src), os.fsencode(dest_path), None, _COPYFILE_XATTR
+    ):
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), src)
+
+
+def _replace_with(dest_path, make):
+    """ create dest_path with make(tmp_path), replacing any file already at dest_path
+        dest_path is never opened for writing, so if it's a hard link the other links
+        to its file are left unchanged
+        returns what make returned """
+    tmp_path = f"{dest_path}.photosmeta.tmp"
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+    try:
+        result = make(tmp_path)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return result
+
+
+def _reflink(src, dest_path):
+    """ clone src to new file dest_path; raises OSError if the filesystem can't """
+    if sys.platform == "darwin":
+        if _macos_clonefile()(os.fsencode(src), os.fsencode(dest_path), 0):
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), src)
+        return
+
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dest_path, "wb") as fdest:
+        fcntl.ioctl(fdest.fileno(), _FICLONE, fsrc.fileno())
+
+
+def _copy_file_range(src, dest_path):
+    """ copy src to new file dest_path in the kernel; raises OSError if it can't """
+    with open(src, "rb") as fsrc, open(dest_path, "wb") as fdest:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = 0
+        while copied < size:
+            count = os.copy_file_range(fsrc.fileno(), fdest.fileno(), size - copied)
+            if count == 0:
+                break
+            copied += count
+
+
+def _stream(src, dest_path, digest=None):
+    """ copy src to new file dest_path through a large buffer, preallocating it;
+        digest: optional hashlib hash object updated with the data """
+    buffer = bytearray(_STREAM_BUFFER_SIZE)
+    view = memoryview(buffer)
+    # large writes bypass the writer's buffer; it only retries short writes
+    with open(src, "rb", buffering=0) as fsrc, open(dest_path, "wb") as fdest:
+        size = os.fstat(fsrc.fileno()).st_size
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fdest.fileno(), 0, size)
+            except OSError:
+                # not supported by the filesystem
+                pass
+        while True:
+            count = fsrc.readinto(buffer)
+            if not count:
+                break
+            if digest is not None:
+                digest.update(view[:count])
+            fdest.write(view[:count])
+        # fallocate may have allocated more than was copied if src shrank
+        fdest.truncate()
+
+
+def _copy(src, tmp_path, mode, digest):
+    """ copy src to new file tmp_path for copy_data, return the method used """
+    if mode == HARDLINK:
+        try:
+            os.link(src, tmp_path)
+        except OSError as e:
+            raise CopyModeError(e.errno, f"can't hard link {src}: {e.strerror}")
+        return HARDLINK
+
+    method = None
+    if mode in (REFLINK, "auto"):
+        try:
+            _reflink(src, tmp_path)
+            method = REFLINK
+        except OSError as e:
+            if mode == REFLINK:
+                raise CopyModeError(e.errno, f"can't clone {src}: {e.strerror}")
+            if e.errno not in _UNSUPPORTED:
+                raise
+
+    if method is None and digest is None and hasattr(os, "copy_file_range"):
+        try:
+            _copy_file_range(src, tmp_path)
+            method = COPY_FILE_RANGE
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+
+    if method is None:
+        _stream(src, tmp_path, digest)
+        method = STREAM
+
+    # copies the extended attributes too, except on macOS
+    shutil.copystat(src, tmp_path)
+    if method != REFLINK:
+        _copy_xattrs(src, tmp_path)
+    return method
+
+
+def copy_data(src, dest_path, mode="auto", digest=None):
+    """ copy the contents and timestamps of file src to dest_path using copy mode
+        (see COPY_MODES), replacing dest_path if it exists
+        the copy is made in a new file that then replaces dest_path, so an earlier
+        export hard linked to the photo's file doesn't change the photo's file
+        digest: optional hashlib hash object to update with the contents of src;
+                only updated if the data is streamed: with digest, data that can't be
+                cloned is streamed instead of copied with copy_file_range
+        returns the method used: REFLINK, HARDLINK, COPY_FILE_RANGE or STREAM
+        raises CopyModeError if mode is reflink or hardlink and that isn't possible """
+    return _replace_with(dest_path, lambda tmp_path: _copy(src, tmp_path, mode, digest))
+
+
+def break_link(path):
+    """ replace hard link path with a copy of the file so the file can be changed
+        without changing the other links to it """
+    copy_data(path, path, "copy")
@@ -0,0 +1,111 @@
+# compare the metadata photosmeta wants to write with the metadata already in a file
+# so exiftool is only run when at least one tag actually differs
+
+import re
+
+from ._exiftool import MERGE_TAGS
+
+# tags photosmeta may write, in addition to MERGE_TAGS
+WRITE_TAGS = [
+    "EXIF:ImageDescription",
+    "XMP:Description",
+    "XMP:Title",
+    "EXIF:GPSLatitude",
+    "EXIF:GPSLongitude",
+    "EXIF:GPSLatitudeRef",
+    "EXIF:GPSLongitudeRef",
+    "EXIF:DateTimeOriginal",
+    "EXIF:OffsetTimeOriginal",
+    "EXIF:ModifyDate",
+]
+
+# tags that must be read from a file to merge and diff its metadata
+READ_TAGS = MERGE_TAGS + WRITE_TAGS
+
+# tags which hold a list of values
+LIST_TAGS = set(MERGE_TAGS)
+
+_GPS_TAGS = {"EXIF:GPSLatitude", "EXIF:GPSLongitude"}
+_GPS_REF_TAGS = {"EXIF:GPSLatitudeRef", "EXIF:GPSLongitudeRef"}
+
+# ~1 meter; dd_to_dms_str rounds seconds so values won't round trip exactly
+_GPS_TOLERANCE = 1e-5
+
+_DMS_RE = re.compile(r"""(\d+(?:\.\d+)?) deg (\d+(?:\.\d+)?)' (\d+(?:\.\d+)?)\"?""")
+
+
+def tag_list(exif_info, tag):
+    """ return values of tag in exif_info as a list of str
+        exiftool returns a single value for a one-item list and numbers for numeric strings """
+    value = exif_info.get(tag)
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    return [str(v) for v in value]
+
+
+def _gps_value(value):
+    """ return GPS coordinate as unsigned float from either
+        decimal degrees (exiftool -n) or "DD deg MM' SS.SS\"" (dd_to_dms_str) """
+    match = _DMS_RE.match(str(value))
+    if match:
+        deg, mins, secs = (float(x) for x in match.groups())
+        return deg + mins / 60 + secs / 3600
+    return abs(float(value))
+
+
+def _tag_equal(tag, desired, current):
+    """ return True if desired value of tag matches current value read from file """
+    if current is None:
+        return False
+    if tag in LIST_TAGS:
+        return set(desired) == set(tag_list({tag: current}, tag))
+    if tag in _GPS_TAGS:
+        try:
+            return abs(_gps_value(desired) - _gps_value(current)) < _GPS_TOLERANCE
+        except ValueError:
+            return False
+    if tag in _GPS_REF_TAGS:
+        # exiftool -n returns N/S/E/W, photosmeta writes North/South/East/West
+        return str(desired)[:1].upper() == str(current)[:1].upper()
+    return str(desired).strip() == str(current).strip()
+
+
+def diff_tags(desired, current):
+    """ return dict of tags from desired whose value differs from current
+        desired: dict of tag -> value (or list of values for LIST_TAGS) to write
+        current: dict of tag -> value as read by exiftool -G -n -j """
+    return {
+        tag: value
+        for tag, value in desired.items()
+        if not _tag_equal(tag, value, current.get(tag))
+    }
+
+
+def build_exif_cmd(tags):
+    """ return list of exiftool arguments that assign tags
+        tags: dict of tag -> value (or list of values for LIST_TAGS) """
+    exif_cmd = []
+    for tag, value in tags.items():
+        if tag in LIST_TAGS:
+            # first assignment replaces the list, the rest are appended
+            exif_cmd.extend(f"-{tag}={v}" for v in value)
+        else:
+            exif_cmd.append(f"-{tag}={value}")
+    return exif_cmd
+
+
+def build_restore_cmd(previous):
+    """ return list of exiftool arguments that restore tags to the values in previous
+        previous: dict of tag -> value as read by exiftool -G -n -j, None if not set;
+        values are written without print conversion (TAG#=) as they were read with -n """
+    exif_cmd = []
+    for tag, value in previous.items():
+        if value is None or value == []:
+            exif_cmd.append(f"-{tag}=")
+        elif tag in LIST_TAGS:
+            exif_cmd.extend(f"-{tag}#={v}" for v in tag_list(previous, tag))
+        else:
+            exif_cmd.append(f"-{tag}#={value}")
+    return exif_cmd
@@ -0,0 +1,249 @@
+# persistent exiftool session for photosmeta
+# uses exiftool's -stay_open mode so a single exiftool process
+# (and Perl interpreter) serves every read and write in a run
+# see: https://exiftool.org/exiftool_pod.html#stay_open-FLAG
+
+import atexit
+import json
+import logging
+import os
+import selectors
+import subprocess
+import sys
+import threading
+from functools import lru_cache
+
+# exiftool writes "{readyNNN}" to stdout when a command completes;
+# -echo4 is used to write the same sentinel to stderr
+_SENTINEL = "{ready%d}"
+
+# the only tags read from existing files; these are merged with metadata from Photos
+MERGE_TAGS = ["IPTC:Keywords", "XMP:TagsList", "XMP:Subject", "XMP:PersonInImage"]
+
+
+class ExifToolError(Exception):
+    """ raised when exiftool reports an error for a command """
+
+    def __init__(self, args, stderr):
+        self.args_ = args
+        self.stderr = stderr
+        super().__init__(stderr.strip())
+
+
+class ExifToolDiedError(ExifToolError):
+    """ raised when exiftool exits during a command and again when the command is
+        retried in a new process, e.g. when a file crashes it """
+
+
+@lru_cache(maxsize=1)
+def get_exiftool_path():
+    """ return path of exiftool, cache result """
+    result = subprocess.run(["which", "exiftool"], stdout=subprocess.PIPE)
+    exiftool_path = result.stdout.decode("utf-8")
+    logging.debug("exiftool path = %s" % (exiftool_path))
+    if exiftool_path:
+        return exiftool_path.rstrip()
+    else:
+        sys.exit(
+            "Could not find exiftool. Please download and install from "
+            "https://exiftool.org/"
+        )
+
+
+def _encode_arg(arg):
+    """ encode a single argument as a line in an exiftool argfile
+        arguments containing newlines, tabs, backslashes or leading/trailing space
+        are written as C strings using exiftool's #[CSTR] prefix """
+    arg = str(arg)
+    if any(c in arg for c in "\n\r\t\\") or arg != arg.strip() or arg.startswith("#"):
+        arg = (
+            arg.replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+            .replace("\t", "\\t")
+            .replace(" ", "\\x20")
+        )
+        return f"#[CSTR]{arg}\n"
+    return f"{arg}\n"
+
+
+class ExifToolSession:
+    """ a long-lived exiftool process run with -stay_open True -@ -
+        commands are sent one argument per line on stdin and terminated with -executeNNN;
+        output is read until exiftool prints the {readyNNN} sentinel
+        if the exiftool process dies, it is restarted and the command retried once """
+
+    def __init__(self, exiftool=None):
+        self._exiftool = exiftool
+        self._proc = None
+        self._count = 0
+
+    @property
+    def running(self):
+        """ True if the exiftool process is running """
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self):
+        """ start the exiftool process; no-op if already running """
+        if self.running:
+            return
+        exiftool = self._exiftool or get_exiftool_path()
+        logging.debug(f"starting exiftool session: {exiftool}")
+        self._proc = subprocess.Popen(
+            [exiftool, "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    def close(self):
+        """ tell exiftool to exit and wait for it """
+        if self._proc is None:
+            return
+        proc, self._proc = self._proc, None
+        try:
+            if proc.poll() is None:
+                proc.stdin.write(b"-stay_open\nFalse\n")
+                proc.stdin.flush()
+                proc.stdin.close()
+                proc.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+            proc.wait()
+        finally:
+            proc.stdout.close()
+            proc.stderr.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, *args):
+        """ run exiftool with args and return stdout as str
+            raises ExifToolError if exiftool reports an error,
+            ExifToolDiedError if exiftool exits while running the command twice """
+        try:
+            stdout, stderr = self._execute(args)
+        except (OSError, EOFError) as e:
+            # exiftool crashed or pipe broke; restart and try once more
+            logging.debug(f"exiftool session died ({e}), restarting")
+            self.close()
+            try:
+                stdout, stderr = self._execute(args)
+            except (OSError, EOFError) as e:
+                # leave the session to be restarted by the next command
+                self.close()
+                raise ExifToolDiedError(list(args), f"exiftool exited: {e!r}") from e
+
+        logging.debug(
+            "Have {} bytes in stdout:\n{}".format(len(stdout), stdout.rstrip("\r\n"))
+        )
+        if stderr:
+            logging.debug(f"stderr: {stderr}")
+        if any(line.startswith("Error") for line in stderr.splitlines()):
+            raise ExifToolError(list(args), stderr)
+        return stdout
+
+    def execute_json(self, *args):
+        """ run exiftool with args and -j, return decoded JSON output """
+        stdout = self.execute("-j", *args)
+        if not stdout.strip():
+            return []
+        return json.loads(stdout)
+
+    def _execute(self, args):
+        """ send one command to exiftool and collect stdout, stderr """
+        self.start()
+        self._count += 1
+        sentinel = _SENTINEL % self._count
+        cmd = "".join(_encode_arg(arg) for arg in args)
+        cmd += f"-echo4\n{sentinel}\n-execute{self._count}\n"
+
+        self._proc.stdin.write(cmd.encode("utf-8"))
+        self._proc.stdin.flush()
+
+        # read stdout and stderr together so neither pipe can fill and block exiftool
+        marker = sentinel.encode("utf-8")
+        buffers = {self._proc.stdout: b"", self._proc.stderr: b""}
+        done = set()
+        with selectors.DefaultSelector() as sel:
+            for stream in buffers:
+                sel.register(stream, selectors.EVENT_READ)
+            while len(done) < len(buffers):
+                for key, _ in sel.select():
+                    stream = key.fileobj
+                    data = os.read(stream.fileno(), 65536)
+                    if not data:
+                        raise EOFError("exiftool exited unexpectedly")
+                    buffers[stream] += data
+                    if buffers[stream].rstrip(b"\r\n").endswith(marker):
+                        done.add(stream)
+                        sel.unregister(stream)
+
+        stdout = buffers[self._proc.stdout].rstrip(b"\r\n")[: -len(marker)]
+        stderr = buffers[self._proc.stderr].rstrip(b"\r\n")[: -len(marker)]
+        return stdout.decode("utf-8"), stderr.decode("utf-8")
+
+
+# each thread gets its own session as a session can only run one command at a time
+_local = threading.local()
+# list of (session, thread it belongs to)
+_sessions = []
+_sessions_lock = threading.Lock()
+
+
+def get_exiftool_session():
+    """ return the ExifToolSession for the calling thread, creating it if needed """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = ExifToolSession()
+        with _sessions_lock:
+            _sessions.append((session, threading.current_thread()))
+    return session
+
+
+def close_finished_sessions():
+    """ close the sessions of threads that have finished, e.g. the workers of
+        a thread pool that was shut down """
+    with _sessions_lock:
+        finished = [session for session, thread in _sessions if not thread.is_alive()]
+        _sessions[:] = [item for item in _sessions if item[0] not in finished]
+    for session in finished:
+        session.close()
+
+
+@atexit.register
+def close_exiftool_sessions():
+    """ close every session created by get_exiftool_session """
+    with _sessions_lock:
+        while _sessions:
+            _sessions.pop()[0].close()
+
+
+def read_tags(paths, tags=MERGE_TAGS, session=None):
+    """ read tags for many files with a single exiftool command
+        paths: list of file paths
+        tags: list of tags to read (in group:tag form); if None, read all tags
+        session: ExifToolSession to use; if None, uses the shared session
+        returns dict of SourceFile -> dict of tags (as read by exiftool -G -n -j)
+        files exiftool can't read are left out of the returned dict """
+    if not paths:
+        return {}
+    session = session or get_exiftool_session()
+    args = ["-G", "-n", *[f"-{tag}" for tag in tags or []]]
+    try:
+        results = session.execute_json(*args, *paths)
+    except ExifToolError:
+        # a single bad file fails the whole batch; fall back to reading
+        # each file so the others still get their tags
+        results = []
+        for path in paths:
+            try:
+                results.extend(session.execute_json(*args, path))
+            except ExifToolError as e:
+                # a file that crashes exiftool fails on its own here
+                logging.debug(f"could not read tags from {path}: {e}")
+    return {result["SourceFile"]: result for result in results}
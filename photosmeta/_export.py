@@ -0,0 +1,259 @@
+# export manifests for photosmeta
+# each export folder gets a manifest recording, for every file photosmeta exported
+# to it, the photo and source file it was copied from (size, mtime and, unless it
+# was cloned or linked, SHA-256 of the source) and the size and mtime of the
+# exported file after its metadata was written; with --export-update an export whose source and exported file are both
+# unchanged is not copied again, instead of being copied to a new "name (1).jpg"
+# the manifest is an append-only file of JSON lines, the last entry for a file wins
+# ExportDestinations picks the names of new exports in memory from one listing of
+# each export folder and creates each folder once, instead of probing the disk
+
+import hashlib
+import json
+import os
+import threading
+
+from ._util import file_stat
+
+MANIFEST_NAME = ".photosmeta_export.jsonl"
+
+# rewrite a manifest when it has this many more lines than entries
+_COMPACT_LINES = 1000
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _source_current(folder, entry, source):
+    """ return (current, source_stat): current is True if the file exported to folder
+        as entry is an up to date copy of source: source is the file it was copied
+        from and hasn't changed (same size and mtime or, if only the mtime changed,
+        same SHA-256) and the exported file hasn't changed since its metadata was
+        written; source_stat is the [size, mtime_ns] of source """
+    source_stat = file_stat(source)
+    if (
+        entry["source"] != source
+        or entry["stat"] is None
+        or file_stat(os.path.join(folder, entry["file"])) != entry["stat"]
+        or source_stat is None
+    ):
+        return False, source_stat
+    if source_stat == entry["source_stat"]:
+        return True, source_stat
+    if source_stat[0] != entry["source_stat"][0] or entry["source_hash"] is None:
+        # files that were cloned or linked instead of copied weren't hashed
+        return False, source_stat
+    return file_digest(source) == entry["source_hash"], source_stat
+
+
+def file_digest(path):
+    """ return hex SHA-256 of the contents of file at path, read in chunks """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExportManifest:
+    """ manifest of the files exported to one folder """
+
+    def __init__(self, folder):
+        """ load manifest of folder, if it has one """
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        # exported filename -> entry
+        self.entries = {}
+        # (uuid, edited) -> exported filename
+        self._index = {}
+        lines = 0
+        try:
+            with open(self.path, encoding="utf-8") as fd:
+                for line in fd:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line may be partial if the process died while writing it
+                        continue
+                    self._add(entry)
+        except FileNotFoundError:
+            pass
+        if lines - len(self.entries) > _COMPACT_LINES:
+            self._compact()
+
+    def _add(self, entry):
+        previous = self.entries.get(entry["file"])
+        if previous is not None:
+            self._index.pop((previous["uuid"], previous["edited"]), None)
+        self.entries[entry["file"]] = entry
+        self._index[(entry["uuid"], entry["edited"])] = entry["file"]
+
+    def _compact(self):
+        """ rewrite the manifest with only the current entry for each file """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fd:
+            for entry in self.entries.values():
+                fd.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def _write(self, entry):
+        self._add(entry)
+        # entries are only written when a file is exported or written, so the
+        # manifest is opened for each rather than kept open for every folder
+        with open(self.path, "a", encoding="utf-8") as fd:
+            fd.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def lookup(self, uuid, edited=False):
+        """ return entry for the original (or edited) file of photo uuid or None """
+        filename = self._index.get((uuid, edited))
+        return self.entries[filename] if filename is not None else None
+
+    def update_source_stat(self, entry, source_stat):
+        """ record that the source of entry was touched but its contents are the same """
+        self._write({**entry, "source_stat": source_stat})
+
+    def record_copy(self, filename, uuid, name, edited, source, source_stat, digest):
+        """ record that source was exported as filename
+            name: filename the photo was to be exported as (before "(1)" was added)
+            source_stat: [size, mtime_ns] of source when it was copied
+            digest: hex SHA-256 of the source or None if it wasn't hashed """
+        self._write(
+            {
+                "file": filename,
+                "uuid": uuid,
+                "name": name,
+                "edited": edited,
+                "source": source,
+                "source_stat": source_stat,
+                "source_hash": digest,
+                "stat": None,
+            }
+        )
+
+    def update_stat(self, filename):
+        """ record the current size and mtime of exported file filename
+            once its metadata has been written """
+        entry = self.entries.get(filename)
+        if entry is None:
+            return
+        stat = file_stat(os.path.join(self.folder, filename))
+        if stat != entry["stat"]:
+            self._write({**entry, "stat": stat})
+
+
+class ExportManifests:
+    """ the manifests of the export folders used in a run, loaded when first needed
+        safe to use from multiple threads """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._manifests = {}
+
+    def _get(self, folder):
+        folder = os.path.abspath(folder)
+        manifest = self._manifests.get(folder)
+        if manifest is None:
+            manifest = self._manifests[folder] = ExportManifest(folder)
+        return manifest
+
+    def current_copies(self, folder, uuid, name, sources):
+        """ return list of paths of the up to date copies of sources (the original and,
+            optionally, edited file of photo uuid) exported to folder as name, or None
+            if any of them needs to be exported """
+        with self._lock:
+            manifest = self._get(folder)
+            entries = [
+                manifest.lookup(uuid, bool(edited)) for edited in range(len(sources))
+            ]
+        paths = []
+        for entry, source in zip(entries, sources):
+            if entry is None or entry["name"] != name:
+                return None
+            # files are hashed outside the lock
+            current, source_stat = _source_current(manifest.folder, entry, source)
+            if not current:
+                return None
+            if source_stat != entry["source_stat"]:
+                with self._lock:
+                    manifest.update_source_stat(entry, source_stat)
+            paths.append(os.path.join(manifest.folder, entry["file"]))
+        return paths
+
+    def exported_name(self, folder, uuid, name):
+        """ return filename the original of photo uuid was last exported to folder as,
+            if it was to be exported as name, or None """
+        with self._lock:
+            entry = self._get(folder).lookup(uuid)
+        return entry["file"] if entry is not None and entry["name"] == name else None
+
+    def record_copy(self, path, uuid, name, edited, source, source_stat, digest):
+        """ record that source was exported to path (see ExportManifest.record_copy) """
+        folder, filename = os.path.split(path)
+        with self._lock:
+            self._get(folder).record_copy(
+                filename, uuid, name, edited, source, source_stat, digest
+            )
+
+    def update_stat(self, path):
+        """ record the current size and mtime of exported file path, if it's in a manifest """
+        folder, filename = os.path.split(path)
+        with self._lock:
+            self._get(folder).update_stat(filename)
+
+
+class ExportDestinations:
+    """ the names of the files in the export folders used in a run, each folder listed
+        once when first needed, so new exports are named in memory instead of by
+        probing the disk for "name (1).jpg", "name (2).jpg", etc, and each folder is
+        created once; safe to use from multiple threads """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # folder -> names of the files in it and the names claimed, casefolded
+        # as names differing only in case are the same file on macOS
+        self._names = {}
+        # folders known to exist
+        self._folders = set()
+
+    def _listing(self, folder):
+        names = self._names.get(folder)
+        if names is None:
+            try:
+                with os.scandir(folder) as entries:
+                    names = {entry.name.casefold() for entry in entries}
+                self._folders.add(folder)
+            except FileNotFoundError:
+                names = set()
+            self._names[folder] = names
+        return names
+
+    def claim(self, folder, filename, edited=False, overwrite=False):
+        """ return name for a new file filename in folder: filename if no file in the
+            folder has that name and it wasn't claimed before, otherwise the first free
+            of "stem (1).ext", "stem (2).ext", etc
+            edited: the edited version is also exported, as "<name>_edited.ext";
+                    that name must be free too
+            overwrite: the file replaces an earlier export named filename; filename is
+                       returned and claimed so no other export is given that name """
+        stem, suffix = os.path.splitext(filename)
+        with self._lock:
+            names = self._listing(os.path.abspath(folder))
+            count = 0
+            while True:
+                name = f"{stem} ({count}){suffix}" if count else filename
+                claimed = [name]
+                if edited:
+                    claimed.append(f"{os.path.splitext(name)[0]}_edited{suffix}")
+                if overwrite or not names.intersection(n.casefold() for n in claimed):
+                    break
+                count += 1
+            names.update(n.casefold() for n in claimed)
+        return name
+
+    def create_folder(self, folder):
+        """ create folder (and its parents) unless it was created or found before """
+        folder = os.path.abspath(folder)
+        with self._lock:
+            if folder not in self._folders:
+                os.makedirs(folder, exist_ok=True)
+                self._folders.add(folder)
@@ -0,0 +1,142 @@
+# progress journal for photosmeta
+# an append-only file of JSON lines recording each photo completed or failed
+# so an interrupted or failed run can be resumed without redoing finished work
+# entries are buffered and flushed (and fsync'ed) periodically; if the process dies,
+# at most the last few seconds of entries are lost and those photos are redone
+
+import json
+import os
+import threading
+import time
+
+from ._util import ends_with_newline
+
+# bump if the format of the journal changes
+_JOURNAL_VERSION = 1
+
+# flush entries to disk after this many entries or seconds, whichever comes first
+_FLUSH_ENTRIES = 100
+_FLUSH_SECONDS = 5.0
+
+# journal entry status values
+DONE = "done"
+FAILED = "failed"
+
+
+class JournalError(Exception):
+    """ raised when a journal can't be used to resume a run """
+
+
+class RunJournal:
+    """ append-only journal of the photos completed or failed in a run
+        safe to use from multiple threads """
+
+    def __init__(self, path, library_path, resume=False):
+        """ open journal at path for the library at library_path
+            if resume is True, the entries already in the journal are loaded and
+            new entries are appended; otherwise the journal is started afresh
+            raises JournalError if resuming a journal written for a different library """
+        self.path = path
+        self.library_path = os.path.abspath(library_path)
+        self.done = set()
+        self.failures = {}
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+        if resume and os.path.exists(path):
+            self._load()
+            self._fd = open(path, "a", encoding="utf-8")
+            # don't append to a partial last line
+            if self._fd.tell() and not ends_with_newline(path):
+                self._fd.write("\n")
+        else:
+            self._fd = open(path, "w", encoding="utf-8")
+            self._append({"journal": _JOURNAL_VERSION, "library": self.library_path})
+            self.flush()
+
+    def _load(self):
+        """ load entries from the journal """
+        with open(self.path, encoding="utf-8") as fd:
+            for lineno, line in enumerate(fd):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line may be partial if the process died while writing it
+                    continue
+                if lineno == 0:
+                    if entry.get("journal") != _JOURNAL_VERSION:
+                        raise JournalError(f"{self.path} is not a photosmeta journal")
+                    if entry.get("library") != self.library_path:
+                        raise JournalError(
+                            f"journal {self.path} is for library {entry.get('library')}, "
+                            f"not {self.library_path}"
+                        )
+                    continue
+                uuid = entry.get("uuid")
+                if entry.get("status") == DONE:
+                    self.done.add(uuid)
+                    self.failures.pop(uuid, None)
+                elif entry.get("status") == FAILED:
+                    self.failures[uuid] = entry
+
+    def _append(self, entry):
+        self._pending.append(json.dumps(entry))
+
+    def record_done(self, uuid):
+        """ record that photo uuid was processed """
+        with self._lock:
+            self.done.add(uuid)
+            self.failures.pop(uuid, None)
+            self._append({"uuid": uuid, "status": DONE})
+            self._maybe_flush()
+
+    def record_failure(self, uuid, filename, path, error, attempts=1):
+        """ record that processing photo uuid failed with error
+            attempts: number of times processing the photo has been tried in this run """
+        with self._lock:
+            entry = {
+                "uuid": uuid,
+                "status": FAILED,
+                "filename": filename,
+                "path": path,
+                "error": str(error),
+                "error_type": type(error).__name__,
+                "attempts": attempts,
+                "time": time.time(),
+            }
+            self.failures[uuid] = entry
+            self._append(entry)
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (
+            len(self._pending) >= _FLUSH_ENTRIES
+            or time.monotonic() - self._last_flush >= _FLUSH_SECONDS
+        ):
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._fd.write("\n".join(self._pending) + "\n")
+            self._pending = []
+            self._fd.flush()
+            os.fsync(self._fd.fileno())
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        """ write pending entries to disk """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """ flush pending entries and close the journal """
+        with self._lock:
+            self._flush()
+            self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,421 @@
+# native reader for the tags photosmeta reads from JPEG and HEIF (HEIC) files
+# only the APP1 (EXIF, XMP) and APP13 (IPTC) segments at the start of a JPEG file, or
+# the Exif and XMP items of a HEIF file (found from the boxes of its meta box) are
+# parsed, through a memory map so only the pages holding them are read from disk,
+# instead of running exiftool; tags are returned as exiftool -G -n -j would return them
+# files this reader doesn't handle (other formats, extended XMP, unusual IPTC, HEIF
+# items stored in other items or files, damaged metadata) are left to exiftool
+
+import mmap
+import struct
+import xml.etree.ElementTree as ET
+
+from ._xmp import read_xmp_tags
+
+_EXIF_HEADER = b"Exif\0\0"
+_XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\0"
+_XMP_EXTENSION_HEADER = b"http://ns.adobe.com/xmp/extension/\0"
+_PHOTOSHOP_HEADER = b"Photoshop 3.0\0"
+
+# TIFF field type -> size in bytes of one value
+_TYPE_SIZES = {
+    1: 1,
+    2: 1,
+    3: 2,
+    4: 4,
+    5: 8,
+    6: 1,
+    7: 1,
+    8: 2,
+    9: 4,
+    10: 8,
+    11: 4,
+    12: 8,
+}
+_ASCII = 2
+_LONG = 4
+_RATIONAL = 5
+
+# EXIF tag ids
+_IFD0_TAGS = {0x010E: "EXIF:ImageDescription", 0x0132: "EXIF:ModifyDate"}
+_EXIF_IFD_POINTER = 0x8769
+_EXIF_IFD_TAGS = {0x9003: "EXIF:DateTimeOriginal", 0x9011: "EXIF:OffsetTimeOriginal"}
+_GPS_IFD_POINTER = 0x8825
+_GPS_REF_TAGS = {1: "EXIF:GPSLatitudeRef", 3: "EXIF:GPSLongitudeRef"}
+_GPS_TAGS = {2: "EXIF:GPSLatitude", 4: "EXIF:GPSLongitude"}
+
+# IPTC IIM record, dataset of Keywords and CodedCharacterSet and the UTF-8 escape
+_IPTC_KEYWORDS = (2, 25)
+_IPTC_CHARSET = (1, 90)
+_IPTC_UTF8 = b"\x1b%G"
+_PHOTOSHOP_IPTC_RESOURCE = 0x0404
+
+# ftyp brands of HEIF files (images and image sequences, HEVC coded or not)
+_HEIF_BRANDS = {b"mif1", b"msf1", b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx"}
+# content type of the mime item holding a HEIF file's XMP
+_XMP_CONTENT_TYPE = b"application/rdf+xml"
+
+
+class UnsupportedFileError(ValueError):
+    """ raised when a file has metadata the native reader can't read """
+
+
+def _decode(value):
+    """ decode EXIF ASCII value, which is often UTF-8 in practice """
+    value = value.split(b"\0", 1)[0]
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+def _read_ifd(tiff, order, offset):
+    """ return dict of tag id -> (type, count, value bytes) for IFD at offset in tiff """
+    (count,) = struct.unpack_from(f"{order}H", tiff, offset)
+    entries = {}
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, type_, n = struct.unpack_from(f"{order}HHI", tiff, entry)
+        size = _TYPE_SIZES.get(type_, 0) * n
+        if size <= 4:
+            start = entry + 8
+        else:
+            (start,) = struct.unpack_from(f"{order}I", tiff, entry + 8)
+        if start + size > len(tiff):
+            raise UnsupportedFileError(f"EXIF tag {tag:#x} is outside EXIF data")
+        entries[tag] = (type_, n, tiff[start : start + size])
+    return entries
+
+
+def _ascii_tags(entries, names, tags):
+    """ add the ASCII values of entries whose tag id is in names to tags """
+    for tag_id, name in names.items():
+        entry = entries.get(tag_id)
+        if entry is not None and entry[0] == _ASCII:
+            tags[name] = _decode(entry[2])
+
+
+def _pointer(entries, tag_id, order):
+    """ return offset of sub-IFD from pointer tag tag_id or None """
+    entry = entries.get(tag_id)
+    if entry is None or entry[0] != _LONG:
+        return None
+    return struct.unpack(f"{order}I", entry[2])[0]
+
+
+def _exif_tags(tiff):
+    """ return dict of tags read from EXIF (TIFF) data """
+    order = {b"II": "<", b"MM": ">"}.get(bytes(tiff[:2]))
+    if order is None:
+        raise UnsupportedFileError("invalid EXIF byte order")
+    magic, ifd0 = struct.unpack_from(f"{order}HI", tiff, 2)
+    if magic != 42:
+        raise UnsupportedFileError("invalid EXIF header")
+
+    tags = {}
+    entries = _read_ifd(tiff, order, ifd0)
+    _ascii_tags(entries, _IFD0_TAGS, tags)
+
+    offset = _pointer(entries, _EXIF_IFD_POINTER, order)
+    if offset is not None:
+        _ascii_tags(_read_ifd(tiff, order, offset), _EXIF_IFD_TAGS, tags)
+
+    offset = _pointer(entries, _GPS_IFD_POINTER, order)
+    if offset is not None:
+        gps = _read_ifd(tiff, order, offset)
+        _ascii_tags(gps, _GPS_REF_TAGS, tags)
+        for tag_id, name in _GPS_TAGS.items():
+            entry = gps.get(tag_id)
+            if entry is None or entry[0] != _RATIONAL or entry[1] != 3:
+                continue
+            values = struct.unpack(f"{order}6I", entry[2])
+            if 0 in values[1::2]:
+                continue
+            degrees, minutes, seconds = (
+                values[i] / values[i + 1] for i in range(0, 6, 2)
+            )
+            # exiftool -n returns the unsigned coordinate; the sign is in the Ref tag
+            tags[name] = degrees + minutes / 60 + seconds / 3600
+    return tags
+
+
+def _iptc_data(resources):
+    """ return IPTC data from Photoshop image resources or None """
+    pos = 0
+    while pos + 12 <= len(resources):
+        if resources[pos : pos + 4] != b"8BIM":
+            raise UnsupportedFileError("invalid Photoshop image resource")
+        (resource_id,) = struct.unpack_from(">H", resources, pos + 4)
+        # name is a Pascal string padded to an even length
+        name_length = resources[pos + 6]
+        pos += 6 + name_length + 1 + (name_length + 1) % 2
+        (size,) = struct.unpack_from(">I", resources, pos)
+        pos += 4
+        if resource_id == _PHOTOSHOP_IPTC_RESOURCE:
+            return resources[pos : pos + size]
+        pos += size + size % 2
+    return None
+
+
+def _iptc_tags(data):
+    """ return dict of tags read from IPTC IIM data """
+    datasets = {}
+    pos = 0
+    while pos + 5 <= len(data) and data[pos] == 0x1C:
+        record, dataset, length = struct.unpack_from(">BBH", data, pos + 1)
+        if length & 0x8000:
+            raise UnsupportedFileError("extended IPTC dataset")
+        datasets.setdefault((record, dataset), []).append(
+            bytes(data[pos + 5 : pos + 5 + length])
+        )
+        pos += 5 + length
+
+    # exiftool assumes Latin-1 if the character set isn't given
+    charset = datasets.get(_IPTC_CHARSET, [b""])[0]
+    encoding = "utf-8" if charset == _IPTC_UTF8 else "latin-1"
+    tags = {}
+    if _IPTC_KEYWORDS in datasets:
+        tags["IPTC:Keywords"] = [
+            value.decode(encoding, errors="replace")
+            for value in datasets[_IPTC_KEYWORDS]
+        ]
+    return tags
+
+
+def _read_segments(data):
+    """ return (exif, xmp, photoshop) segment data from JPEG data, each None if absent """
+    if data[:2] != b"\xff\xd8":
+        raise UnsupportedFileError("not a JPEG file")
+    exif = xmp = photoshop = None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise UnsupportedFileError(f"invalid JPEG marker at {pos}")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA):
+            # end of image or start of scan: the metadata segments come before
+            break
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            # markers without a length
+            pos += 2
+            continue
+        (length,) = struct.unpack_from(">H", data, pos + 2)
+        start, pos = pos + 4, pos + 2 + length
+        if marker == 0xE1:
+            header = data[start : start + len(_XMP_EXTENSION_HEADER)]
+            if header.startswith(_EXIF_HEADER) and exif is None:
+                exif = data[start + len(_EXIF_HEADER) : pos]
+            elif header.startswith(_XMP_HEADER):
+                if xmp is not None:
+                    raise UnsupportedFileError("more than one XMP segment")
+                xmp = data[start + len(_XMP_HEADER) : pos]
+            elif header.startswith(_XMP_EXTENSION_HEADER):
+                raise UnsupportedFileError("extended XMP")
+        elif marker == 0xED:
+            if data[start : start + len(_PHOTOSHOP_HEADER)] == _PHOTOSHOP_HEADER:
+                if photoshop is not None:
+                    # IPTC split across several segments
+                    raise UnsupportedFileError("more than one Photoshop segment")
+                photoshop = data[start + len(_PHOTOSHOP_HEADER) : pos]
+    return exif, xmp, photoshop
+
+
+def _uint(data, pos, size, end):
+    """ return (big-endian unsigned int of size bytes at pos, position after it) """
+    if pos + size > end:
+        raise UnsupportedFileError(f"HEIF box is truncated at {pos}")
+    return int.from_bytes(data[pos : pos + size], "big"), pos + size
+
+
+def _cstring(data, pos, end):
+    """ return (null-terminated string at pos, position after it) """
+    nul = data.find(b"\0", pos, end)
+    if nul < 0:
+        return bytes(data[pos:end]), end
+    return bytes(data[pos:nul]), nul + 1
+
+
+def _boxes(data, start, end):
+    """ generator yielding (box type, start, end of box contents) for each ISO BMFF
+        box in data[start:end]; the contents are not read """
+    pos = start
+    while pos + 8 <= end:
+        size, type_ = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            size, _ = _uint(data, pos + 8, 8, end)
+            header = 16
+        elif size == 0:
+            # last box, extends to the end
+            size = end - pos
+        if size < header or pos + size > end:
+            raise UnsupportedFileError(f"invalid HEIF box at {pos}")
+        yield type_, pos + header, pos + size
+        pos += size
+
+
+def _heif_items(data, start, end):
+    """ return dict of item id -> (item type, content type, content encoding)
+        from the contents of an iinf box """
+    version = data[start]
+    _, pos = _uint(data, start + 4, 2 if version == 0 else 4, end)
+    items = {}
+    for type_, box_start, box_end in _boxes(data, pos, end):
+        version = data[box_start]
+        if type_ != b"infe" or version < 2:
+            # item info entries before version 2 have no item type
+            continue
+        item_id, pos = _uint(data, box_start + 4, 2 if version == 2 else 4, box_end)
+        # skip item_protection_index
+        pos += 2
+        item_type = bytes(data[pos : pos + 4])
+        _, pos = _cstring(data, pos + 4, box_end)
+        content_type = encoding = b""
+        if item_type == b"mime":
+            content_type, pos = _cstring(data, pos, box_end)
+            encoding, pos = _cstring(data, pos, box_end)
+        items[item_id] = (item_type, content_type, encoding)
+    return items
+
+
+def _heif_locations(data, start, end):
+    """ return dict of item id -> (construction method, list of (offset, length))
+        from the contents of an iloc box """
+    version = data[start]
+    pos = start + 4
+    offset_size, length_size = data[pos] >> 4, data[pos] & 0xF
+    base_offset_size = data[pos + 1] >> 4
+    index_size = data[pos + 1] & 0xF if version in (1, 2) else 0
+    id_size = 2 if version < 2 else 4
+    count, pos = _uint(data, pos + 2, id_size, end)
+    locations = {}
+    for _ in range(count):
+        item_id, pos = _uint(data, pos, id_size, end)
+        method = 0
+        if version in (1, 2):
+            method, pos = _uint(data, pos, 2, end)
+            method &= 0xF
+        data_reference, pos = _uint(data, pos, 2, end)
+        if data_reference != 0:
+            # item is in another file
+            method = None
+        base_offset, pos = _uint(data, pos, base_offset_size, end)
+        extent_count, pos = _uint(data, pos, 2, end)
+        extents = []
+        for _ in range(extent_count):
+            _, pos = _uint(data, pos, index_size, end)
+            offset, pos = _uint(data, pos, offset_size, end)
+            length, pos = _uint(data, pos, length_size, end)
+            extents.append((base_offset + offset, length))
+        locations[item_id] = (method, extents)
+    return locations
+
+
+def _heif_item_data(data, location, idat):
+    """ return contents of the item at location (as returned by _heif_locations)
+        idat: (start, end) of the contents of the meta box's idat box or None """
+    method, extents = location
+    if method == 0:
+        # offsets in the file
+        base, limit = 0, len(data)
+    elif method == 1 and idat is not None:
+        # offsets in the idat box
+        base, limit = idat
+    else:
+        raise UnsupportedFileError("HEIF item stored in another item or file")
+    chunks = []
+    for offset, length in extents:
+        start = base + offset
+        if length == 0 or start + length > limit:
+            raise UnsupportedFileError("HEIF item is outside the file")
+        chunks.append(data[start : start + length])
+    return b"".join(chunks)
+
+
+def _read_heif_items(data):
+    """ return (exif, xmp) item data from HEIF data, each None if absent
+        exif is the TIFF data, without the header offset that starts the item """
+    boxes = _boxes(data, 0, len(data))
+    type_, start, end = next(boxes, (None, 0, 0))
+    if type_ != b"ftyp":
+        raise UnsupportedFileError("not a HEIF file")
+    # major brand, minor version and compatible brands
+    brands = {bytes(data[pos : pos + 4]) for pos in range(start, end - 3, 4)}
+    if not brands & _HEIF_BRANDS:
+        raise UnsupportedFileError("not a HEIF image")
+    for type_, start, end in boxes:
+        if type_ == b"meta":
+            break
+    else:
+        raise UnsupportedFileError("HEIF file has no meta box")
+
+    # meta is a full box: its boxes follow the version and flags
+    children = {}
+    for type_, box_start, box_end in _boxes(data, start + 4, end):
+        children.setdefault(type_, (box_start, box_end))
+    if b"iinf" not in children or b"iloc" not in children:
+        return None, None
+    items = _heif_items(data, *children[b"iinf"])
+    locations = _heif_locations(data, *children[b"iloc"])
+
+    found = {}
+    for item_id, (item_type, content_type, encoding) in items.items():
+        if item_type == b"Exif":
+            kind = "exif"
+        elif item_type == b"mime" and content_type == _XMP_CONTENT_TYPE:
+            if encoding:
+                raise UnsupportedFileError("compressed XMP")
+            kind = "xmp"
+        else:
+            continue
+        if kind in found:
+            raise UnsupportedFileError(f"more than one {kind} item")
+        if item_id not in locations:
+            raise UnsupportedFileError(f"no location for HEIF item {item_id}")
+        found[kind] = _heif_item_data(data, locations[item_id], children.get(b"idat"))
+
+    exif = found.get("exif")
+    if exif is not None:
+        # the item starts with the offset of the TIFF header, after "Exif\0\0"
+        (offset,) = struct.unpack_from(">I", exif)
+        exif = exif[4 + offset :]
+        if exif.startswith(_EXIF_HEADER):
+            exif = exif[len(_EXIF_HEADER) :]
+    return exif, found.get("xmp")
+
+
+def read_jpeg_tags(path, tags=None):
+    """ return dict of tag -> value for the EXIF, IPTC and XMP tags photosmeta reads
+        from JPEG or HEIF file at path, like exiftool -G -n -j (including SourceFile),
+        or None if the file can't be read natively and exiftool should be used
+        tags: if given, only these tags are returned """
+    try:
+        with open(path, "rb") as fd, mmap.mmap(
+            fd.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            if data[4:8] == b"ftyp":
+                # HEIF has no IPTC
+                exif, xmp = _read_heif_items(data)
+                photoshop = None
+            else:
+                exif, xmp, photoshop = _read_segments(data)
+            found = {}
+            if exif is not None:
+                found.update(_exif_tags(exif))
+            if photoshop is not None:
+                iptc = _iptc_data(photoshop)
+                if iptc is not None:
+                    found.update(_iptc_tags(iptc))
+            if xmp is not None:
+                found.update(read_xmp_tags(xmp))
+    except (OSError, ValueError, IndexError, struct.error, ET.ParseError):
+        # ValueError includes UnsupportedFileError and mmap of an empty file
+        return None
+
+    if tags is not None:
+        found = {tag: value for tag, value in found.items() if tag in tags}
+    return {"SourceFile": path, **found}
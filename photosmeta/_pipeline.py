@@ -0,0 +1,75 @@
+# helpers for running photosmeta's processing as a pipeline of stages
+# each stage runs in its own thread and hands items to the next stage through
+# a bounded queue so only a few batches of photos are in memory at any time
+
+import itertools
+import queue
+import threading
+
+# marks the end of a stage's output
+_DONE = object()
+
+
+class _StageError:
+    """ wraps an exception raised in a stage so it can be re-raised by the consumer """
+
+    def __init__(self, error):
+        self.error = error
+
+
+def chunked(iterable, size):
+    """ generator yielding lists of up to size items from iterable """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def stage(iterable, maxsize=2):
+    """ consume iterable in a background thread, yielding its items in order
+        at most maxsize items are buffered; the producer blocks when the buffer is full
+        exceptions raised by iterable are re-raised in the consumer
+        if the consumer stops early, the producer is stopped at its next item """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def _put(item):
+        # don't block forever if the consumer went away
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce():
+        try:
+            for item in iterable:
+                if not _put(item):
+                    break
+        except BaseException as e:
+            # includes SystemExit, e.g. from get_exiftool_path if exiftool is missing,
+            # which would otherwise end only this thread
+            _put(_StageError(e))
+        finally:
+            _put(_DONE)
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=_produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
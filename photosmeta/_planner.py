@@ -0,0 +1,236 @@
+# write planner for photosmeta
+# metadata writes for many photos are collected into plans; files that need exactly
+# the same exiftool tag assignments are then written by a single exiftool command
+# plans can be saved to a plan file (JSON lines, one photo per line) and applied later
+
+import collections
+import json
+
+from ._exiftool import ExifToolDiedError, ExifToolError, get_exiftool_session
+from ._util import file_stat
+
+# max number of files written by a single exiftool command
+_MAX_FILES_PER_WRITE = 256
+
+
+class StalePlanError(Exception):
+    """ raised when the files in a saved plan have changed since it was saved """
+
+
+class FileOp:
+    """ metadata update for a single file
+        path: path of file to update
+        exif_cmd: list of exiftool arguments (without the path) or [] if no write needed
+        xattr_tags: list of tags to write to kMDItemUserTags or None
+        xmp_tags: dict of tag -> value to write to the file's XMP sidecar or None
+        stat: [size, mtime_ns] of the file when the plan was saved, None if not saved
+        undo_tags: dict of tag -> value before the write (None if not set) to record
+                   in the undo log or None
+        linked: True once the file is exported as a hard link to the photo's file
+                (not saved in plan files) """
+
+    def __init__(
+        self,
+        path,
+        exif_cmd=None,
+        xattr_tags=None,
+        xmp_tags=None,
+        stat=None,
+        undo_tags=None,
+    ):
+        self.path = path
+        self.exif_cmd = exif_cmd or []
+        self.xattr_tags = xattr_tags
+        self.xmp_tags = xmp_tags
+        self.stat = stat
+        self.undo_tags = undo_tags
+        self.linked = False
+
+    def __repr__(self):
+        return f"FileOp({self.path!r}, {self.exif_cmd!r}, {self.xattr_tags!r})"
+
+
+class ExportOp:
+    """ export of a photo's files before their metadata is updated
+        dest: folder to export to
+        filename: name of the exported original; the edited version, if any,
+                  is exported as name_edited.ext next to it
+        overwrite: overwrite existing files instead of picking a new name
+        name: filename the photo is to be exported as, recorded in the export manifest;
+              differs from filename when an earlier export is replaced
+        copy_mode: how the files are copied, one of _copy.COPY_MODES; the exiftool
+                   arguments of the plan depend on it for hardlink """
+
+    def __init__(self, dest, filename, overwrite=False, name=None, copy_mode="auto"):
+        self.dest = dest
+        self.filename = filename
+        self.overwrite = overwrite
+        self.name = name or filename
+        self.copy_mode = copy_mode
+
+    def __repr__(self):
+        return (
+            f"ExportOp({self.dest!r}, {self.filename!r}, {self.overwrite!r}, "
+            f"{self.name!r}, {self.copy_mode!r})"
+        )
+
+
+class PhotoPlan:
+    """ all the file updates needed for one photo
+        uuid: uuid of the photo
+        filename: filename of the photo (for reporting)
+        files: list of FileOp (original and, optionally, edited version)
+        export: ExportOp or None; if set, the files are first exported and
+                the FileOp paths are those of the files to export
+        manifest: if True, the files are exports recorded in their export folder's
+                  manifest (see _export), updated once the files are written """
+
+    def __init__(self, uuid, filename, files=None, export=None, manifest=False):
+        self.uuid = uuid
+        self.filename = filename
+        self.files = files or []
+        self.export = export
+        self.manifest = manifest
+
+    @property
+    def paths(self):
+        """ paths of all files in the plan """
+        return [f.path for f in self.files]
+
+    def changed_files(self):
+        """ return paths of files that have changed since the plan was saved """
+        return [
+            f.path
+            for f in self.files
+            if f.stat is not None and file_stat(f.path) != f.stat
+        ]
+
+    def to_json(self):
+        """ return plan as a line of JSON for a plan file
+            the size and mtime of each file is saved so changes can be detected """
+        data = {
+            "uuid": self.uuid,
+            "filename": self.filename,
+            "files": [
+                {
+                    "path": f.path,
+                    "exif_cmd": f.exif_cmd,
+                    "xattr_tags": f.xattr_tags,
+                    "xmp_tags": f.xmp_tags,
+                    "stat": file_stat(f.path),
+                    "undo_tags": f.undo_tags,
+                }
+                for f in self.files
+            ],
+            "manifest": self.manifest,
+        }
+        if self.export is not None:
+            data["export"] = {
+                "dest": self.export.dest,
+                "filename": self.export.filename,
+                "overwrite": self.export.overwrite,
+                "name": self.export.name,
+                "copy_mode": self.export.copy_mode,
+            }
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, line):
+        """ create PhotoPlan from a line of JSON written by to_json """
+        data = json.loads(line)
+        export = data.get("export")
+        return cls(
+            data["uuid"],
+            data["filename"],
+            [
+                FileOp(
+                    f["path"],
+                    f["exif_cmd"],
+                    f["xattr_tags"],
+                    f.get("xmp_tags"),
+                    f["stat"],
+                    f.get("undo_tags"),
+                )
+                for f in data["files"]
+            ],
+            ExportOp(
+                export["dest"],
+                export["filename"],
+                export["overwrite"],
+                export.get("name"),
+                # plans saved before copy modes copied files
+                export.get("copy_mode", "copy"),
+            )
+            if export
+            else None,
+            data.get("manifest", False),
+        )
+
+    def __repr__(self):
+        return (
+            f"PhotoPlan({self.uuid!r}, {self.filename!r}, {self.files!r}, "
+            f"{self.export!r}, {self.manifest!r})"
+        )
+
+
+def read_plan_file(path):
+    """ generator yielding PhotoPlan for each line of plan file at path """
+    with open(path, encoding="utf-8") as fd:
+        for line in fd:
+            if line.strip():
+                yield PhotoPlan.from_json(line)
+
+
+def group_writes(plans, max_files=_MAX_FILES_PER_WRITE):
+    """ group the exiftool writes in plans by identical exiftool arguments
+        plans: iterable of PhotoPlan
+        returns list of (exif_cmd, [paths]); no group has more than max_files paths """
+    groups = collections.OrderedDict()
+    for plan in plans:
+        for fileop in plan.files:
+            if fileop.exif_cmd:
+                groups.setdefault(tuple(fileop.exif_cmd), []).append(fileop.path)
+
+    return [
+        (list(exif_cmd), paths[i : i + max_files])
+        for exif_cmd, paths in groups.items()
+        for i in range(0, len(paths), max_files)
+    ]
+
+
+def write_group(exif_cmd, paths, session=None):
+    """ write exif_cmd to every file in paths with a single exiftool command
+        returns (exiftool output, dict of path -> ExifToolError for files that failed)
+        a file that crashes exiftool fails with ExifToolDiedError, the others are still
+        written """
+    session = session or get_exiftool_session()
+    try:
+        return session.execute(*exif_cmd, *paths), {}
+    except ExifToolError as e:
+        if len(paths) == 1:
+            return "", {paths[0]: e}
+        error = e
+
+    # exiftool still writes the other files when one fails;
+    # error lines end with the name of the file that failed
+    # if exiftool died there are none, each file is written on its own
+    if not isinstance(error, ExifToolDiedError):
+        failures = {}
+        for line in error.stderr.splitlines():
+            if not line.startswith("Error"):
+                continue
+            path = next((p for p in paths if line.endswith(p)), None)
+            if path is None:
+                break
+            failures[path] = ExifToolError([*exif_cmd, path], line)
+        else:
+            return "", failures
+
+    # couldn't tell which file failed, write each file individually
+    failures = {}
+    for path in paths:
+        try:
+            session.execute(*exif_cmd, path)
+        except ExifToolError as e:
+            failures[path] = e
+    return "", failures
@@ -0,0 +1,71 @@
+# compact, picklable record of the PhotoInfo properties photosmeta uses
+
+import sys
+
+
+def _intern_all(values):
+    """ return tuple of interned str from list of str (or None) """
+    return tuple(sys.intern(v) for v in values or [])
+
+
+class PhotoRecord:
+    """ the data photosmeta needs from an osxphotos.PhotoInfo, extracted once
+        PhotoInfo computes many of its properties lazily each time they're accessed
+        and holds a reference to the whole PhotosDB; a PhotoRecord is plain data so it
+        is cheap to keep, pickle, and send to worker processes
+        keywords, persons and albums are tuples of interned strings as the same
+        names repeat across many photos """
+
+    __slots__ = (
+        "uuid",
+        "filename",
+        "original_filename",
+        "path",
+        "ismissing",
+        "keywords",
+        "persons",
+        "albums",
+        "title",
+        "description",
+        "location",
+        "date",
+        "date_modified",
+        "hasadjustments",
+        "path_edited",
+    )
+
+    def __init__(self, **kwargs):
+        for attr in self.__slots__:
+            setattr(self, attr, kwargs.get(attr))
+
+    @classmethod
+    def from_photoinfo(cls, photo):
+        """ create a PhotoRecord from an osxphotos.PhotoInfo object """
+        hasadjustments = bool(photo.hasadjustments)
+        return cls(
+            uuid=photo.uuid,
+            filename=photo.filename,
+            original_filename=photo.original_filename,
+            path=photo.path,
+            ismissing=bool(photo.ismissing),
+            keywords=_intern_all(photo.keywords),
+            persons=_intern_all(photo.persons),
+            albums=_intern_all(photo.albums),
+            title=photo.title,
+            description=photo.description,
+            location=tuple(photo.location),
+            date=photo.date,
+            date_modified=photo.date_modified,
+            hasadjustments=hasadjustments,
+            path_edited=photo.path_edited if hasadjustments else None,
+        )
+
+    def __getstate__(self):
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+    def __setstate__(self, state):
+        for attr, value in zip(self.__slots__, state):
+            setattr(self, attr, value)
+
+    def __repr__(self):
+        return f"PhotoRecord(uuid={self.uuid!r}, filename={self.filename!r})"
@@ -0,0 +1,75 @@
+# select the photos to process from a Photos library
+
+from ._pipeline import chunked
+
+MATCH_ANY = "any"
+MATCH_ALL = "all"
+
+# number of PhotoInfo objects created at a time to find the paths of the photos
+_SELECT_BATCH_SIZE = 1000
+
+
+def select_photos(
+    photosdb,
+    all_photos=False,
+    albums=None,
+    uuids=None,
+    keywords=None,
+    persons=None,
+    match=MATCH_ANY,
+):
+    """ return list of uuids of the photos matching the selection criteria
+        photosdb: osxphotos.PhotosDB
+        all_photos: if True, select every photo (other criteria are ignored)
+        albums, uuids, keywords, persons: lists of values to match or None
+        match: MATCH_ANY: photo matches any of the criteria (OR)
+               MATCH_ALL: photo matches every album, keyword and person given
+                          and any of the uuids given (AND)
+        each photo is returned once, sorted by path so files are visited in
+        directory order; PhotoInfo objects are only created for a batch of photos
+        at a time and only uuids and paths are kept """
+
+    if all_photos:
+        selected = _all_uuids(photosdb)
+    else:
+        # evaluate each criterion as a set of UUIDs
+        # for MATCH_ALL, each album/keyword/person value is its own criterion
+        criteria = []
+        for option, values in (
+            ("albums", albums),
+            ("keywords", keywords),
+            ("persons", persons),
+        ):
+            if not values:
+                continue
+            groups = [[value] for value in values] if match == MATCH_ALL else [values]
+            for group in groups:
+                criteria.append({p.uuid for p in photosdb.photos(**{option: group})})
+        if uuids:
+            criteria.append({p.uuid for p in photosdb.photos(uuid=uuids)})
+
+        if not criteria:
+            return []
+        if match == MATCH_ALL:
+            selected = set.intersection(*criteria)
+        else:
+            selected = set.union(*criteria)
+
+    # dedupe (in case the library returns a photo more than once) and sort by path
+    keys = {}
+    for chunk in chunked(selected, _SELECT_BATCH_SIZE):
+        for p in photosdb.photos(uuid=chunk):
+            keys[p.uuid] = (p.path is None, p.path or "", p.uuid)
+    return [key[2] for key in sorted(keys.values())]
+
+
+def _all_uuids(photosdb):
+    """ return list of the uuids of every photo in photosdb (may include photos
+        photosdb.photos() leaves out, e.g. in the trash; photos(uuid=) filters them) """
+    # osxphotos.PhotosDB keeps the details of every photo in _dbphotos; listing it
+    # avoids photos() creating a PhotoInfo object for every photo at once
+    dbphotos = getattr(photosdb, "_dbphotos", None)
+    if dbphotos is not None:
+        return list(dbphotos)
+    # LibrarySnapshot.photos() returns the records it already holds
+    return [p.uuid for p in photosdb.photos()]
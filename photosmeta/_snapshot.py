@@ -0,0 +1,160 @@
+# on-disk snapshot of the photos in a Photos library
+# loading a library with osxphotos.PhotosDB parses the whole Photos database which
+# can take minutes for large libraries; the snapshot holds the PhotoRecord for every
+# photo plus keyword/person/album counts and is reused until the library changes
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+from ._pipeline import chunked
+from ._record import PhotoRecord
+from ._select import _SELECT_BATCH_SIZE, _all_uuids
+
+# bump if the format of the snapshot (or PhotoRecord) changes
+_SNAPSHOT_VERSION = 1
+
+
+def cache_dir():
+    """ return path of the folder snapshots are stored in """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "photosmeta")
+
+
+def library_db_file(library_path):
+    """ return path to the database file of Photos library at library_path
+        library_path may be the .photoslibrary folder or a database file in it;
+        on Photos 5 and later the library is in Photos.sqlite and photos.db is a stub
+        that doesn't change, so Photos.sqlite is returned whenever it exists """
+    if os.path.isdir(library_path):
+        names = ["Photos.sqlite", "photos.db"]
+        folder = os.path.join(library_path, "database")
+    else:
+        names = ["Photos.sqlite"]
+        folder = os.path.dirname(library_path)
+    for name in names:
+        db_file = os.path.join(folder, name)
+        if os.path.exists(db_file):
+            return db_file
+    return library_path
+
+
+def library_key(library_path):
+    """ return key identifying the current state of the library database:
+        path, size and mtime of the database and of its write-ahead log """
+    db_file = os.path.abspath(library_db_file(library_path))
+    key = [_SNAPSHOT_VERSION, db_file]
+    for path in [db_file, f"{db_file}-wal"]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            key.append(None)
+        else:
+            key.append((st.st_size, st.st_mtime_ns))
+    return key
+
+
+def _snapshot_path(library_path):
+    """ return path of the snapshot file for library_path """
+    db_file = os.path.abspath(library_db_file(library_path))
+    name = hashlib.sha1(db_file.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), f"{name}.pickle")
+
+
+class LibrarySnapshot:
+    """ the parts of osxphotos.PhotosDB photosmeta uses, backed by a list of PhotoRecord
+        photos() returns PhotoRecord objects instead of PhotoInfo """
+
+    def __init__(self, library_path, records, keywords, persons, albums):
+        self.library_path = library_path
+        self._records = records
+        self._by_uuid = {record.uuid: record for record in records}
+        self.keywords_as_dict = keywords
+        self.persons_as_dict = persons
+        self.albums_as_dict = albums
+
+    @classmethod
+    def from_photosdb(cls, photosdb):
+        """ create a LibrarySnapshot from an osxphotos.PhotosDB
+            the PhotoInfo objects are created a chunk of photos at a time and dropped
+            once their PhotoRecord is made, so they're never all in memory at once """
+        records = [
+            PhotoRecord.from_photoinfo(photo)
+            for chunk in chunked(_all_uuids(photosdb), _SELECT_BATCH_SIZE)
+            for photo in photosdb.photos(uuid=chunk)
+        ]
+        return cls(
+            photosdb.library_path,
+            records,
+            dict(photosdb.keywords_as_dict),
+            dict(photosdb.persons_as_dict),
+            dict(photosdb.albums_as_dict),
+        )
+
+    def photos(self, keywords=None, uuid=None, persons=None, albums=None):
+        """ return list of PhotoRecord matching all the given criteria,
+            like osxphotos.PhotosDB.photos; each criterion matches any of its values """
+        if uuid:
+            records = [self._by_uuid[u] for u in uuid if u in self._by_uuid]
+        else:
+            records = self._records
+        for attr, values in [
+            ("keywords", keywords),
+            ("persons", persons),
+            ("albums", albums),
+        ]:
+            if values:
+                values = set(values)
+                records = [r for r in records if values.intersection(getattr(r, attr))]
+        return list(records)
+
+    def __getstate__(self):
+        return (
+            self.library_path,
+            self._records,
+            self.keywords_as_dict,
+            self.persons_as_dict,
+            self.albums_as_dict,
+        )
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+def load_snapshot(library_path):
+    """ return LibrarySnapshot for library_path or None if there is no snapshot
+        or the library has changed since the snapshot was saved """
+    path = _snapshot_path(library_path)
+    try:
+        with open(path, "rb") as fd:
+            key, snapshot = pickle.load(fd)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.debug(f"could not load snapshot {path}: {e}")
+        return None
+    if key != library_key(library_path):
+        logging.debug(f"snapshot {path} is out of date")
+        return None
+    return snapshot
+
+
+def save_snapshot(library_path, snapshot, key):
+    """ save snapshot of library_path to the cache folder
+        key: library_key(library_path) from before the library was loaded,
+             so changes made while loading invalidate the snapshot """
+    os.makedirs(cache_dir(), exist_ok=True)
+    path = _snapshot_path(library_path)
+    # write to temp file then rename so a partial snapshot is never loaded
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir(), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            pickle.dump(
+                (key, snapshot), tmp, protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,93 @@
+# incremental sync state for photosmeta
+# records, per photo UUID, a fingerprint of the metadata written to the photo
+# and the size/mtime of each file written so later runs can skip unchanged photos
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# commit to disk after this many updates
+_COMMIT_INTERVAL = 100
+
+
+def metadata_fingerprint(photo, **options):
+    """ return fingerprint (hex digest) of the metadata photosmeta would write for photo
+        photo: PhotoRecord (or osxphotos.PhotoInfo) object
+        options: any options that change what is written, e.g. albums_as_keywords """
+    date_modified = photo.date_modified.isoformat() if photo.date_modified else None
+    data = [
+        sorted(photo.keywords or []),
+        sorted(photo.persons or []),
+        sorted(photo.albums or []),
+        photo.title,
+        photo.description,
+        list(photo.location),
+        photo.date.isoformat(),
+        date_modified,
+        sorted(options.items()),
+    ]
+    return hashlib.sha1(json.dumps(data).encode("utf-8")).hexdigest()
+
+
+def _file_stat(path):
+    """ return [path, size, mtime_ns] for path or None if path doesn't exist """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [path, st.st_size, st.st_mtime_ns]
+
+
+class SyncState:
+    """ SQLite store of photo UUID -> metadata fingerprint and file stats
+        safe to use from multiple threads """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS photos "
+            "(uuid TEXT PRIMARY KEY, fingerprint TEXT, files TEXT)"
+        )
+        self._conn.commit()
+
+    def is_current(self, uuid, fingerprint):
+        """ return True if uuid was last written with fingerprint and
+            none of the files written have changed since """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, files FROM photos WHERE uuid = ?", (uuid,)
+            ).fetchone()
+        if row is None or row[0] != fingerprint:
+            return False
+        files = json.loads(row[1])
+        return bool(files) and all(_file_stat(f[0]) == f for f in files)
+
+    def update(self, uuid, fingerprint, paths):
+        """ record that paths were written for uuid with fingerprint """
+        files = [stat for stat in map(_file_stat, paths) if stat is not None]
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO photos (uuid, fingerprint, files) VALUES (?, ?, ?)",
+                (uuid, fingerprint, json.dumps(files)),
+            )
+            self._pending += 1
+            if self._pending >= _COMMIT_INTERVAL:
+                self._conn.commit()
+                self._pending = 0
+
+    def close(self):
+        """ commit pending updates and close the database """
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
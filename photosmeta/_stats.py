@@ -0,0 +1,239 @@
+# run statistics for photosmeta
+
+import bisect
+import collections
+import contextlib
+import resource
+import sys
+import threading
+import time
+
+# upper bounds, in seconds, of the buckets of the latency histograms
+_HISTOGRAM_BOUNDS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+    60.0,
+)
+
+# returned by RunStats.timer when timing is off so a disabled timer costs one call
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class _Timer:
+    """ context manager adding the time spent in the with block to a RunStats timer """
+
+    __slots__ = ("_stats", "_name", "_start")
+
+    def __init__(self, stats, name):
+        self._stats = stats
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stats.add_time(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _BusyTimer(_Timer):
+    """ context manager adding the time spent in the with block to a stage's busy time """
+
+    __slots__ = ()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stats.add_busy(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _TimerStats:
+    """ count, total and max time and histogram of the times recorded for a timer """
+
+    __slots__ = ("count", "total", "max", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(_HISTOGRAM_BOUNDS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.histogram[bisect.bisect_left(_HISTOGRAM_BOUNDS, seconds)] += 1
+
+    def as_dict(self):
+        labels = [f"<={bound}" for bound in _HISTOGRAM_BOUNDS]
+        labels.append(f">{_HISTOGRAM_BOUNDS[-1]}")
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count else 0.0,
+            "max_seconds": self.max,
+            "histogram": {
+                label: count for label, count in zip(labels, self.histogram) if count
+            },
+        }
+
+
+class RunStats:
+    """ thread-safe named counters collected during a run
+        and, if timing is enabled, named timers with latency histograms;
+        the busy time of the workers of each pipeline stage is always recorded
+        so the utilisation of the stages can be reported """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.timers = {}
+        self.timing = False
+        # stage -> seconds its workers were busy, number of workers
+        self.busy_seconds = collections.Counter()
+        self.workers = {}
+        # seconds the pipeline stages were running
+        self.elapsed = 0.0
+        # work done on each volume with --by-volume, see Volumes.report
+        self.volumes = []
+
+    def incr(self, name, count=1):
+        """ add count to counter name """
+        with self._lock:
+            self.counters[name] += count
+
+    def timer(self, name):
+        """ return context manager that records the time spent in it under timer name
+            does nothing unless timing is enabled """
+        if not self.timing:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def add_time(self, name, seconds):
+        """ record seconds spent in timer name """
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = _TimerStats()
+            timer.add(seconds)
+
+    def busy(self, stage):
+        """ return context manager that records the time spent in it as busy time
+            of one of the workers of pipeline stage """
+        return _BusyTimer(self, stage)
+
+    def add_busy(self, stage, seconds):
+        """ record seconds a worker of pipeline stage was busy """
+        with self._lock:
+            self.busy_seconds[stage] += seconds
+
+    def set_workers(self, stage, workers):
+        """ set the number of workers of pipeline stage """
+        with self._lock:
+            self.workers[stage] = workers
+
+    def add_elapsed(self, seconds):
+        """ record seconds the pipeline stages were running """
+        with self._lock:
+            self.elapsed += seconds
+
+    def set_volumes(self, volumes):
+        """ set the report of the work done on each volume """
+        with self._lock:
+            self.volumes = volumes
+
+    def utilisation(self):
+        """ return dict of stage -> {workers, busy_seconds, utilisation} where
+            utilisation is the fraction of the time the stages were running that
+            the stage's workers were busy, for stages with workers set """
+        with self._lock:
+            return {
+                stage: {
+                    "workers": workers,
+                    "busy_seconds": self.busy_seconds[stage],
+                    "utilisation": self.busy_seconds[stage] / (workers * self.elapsed)
+                    if self.elapsed
+                    else 0.0,
+                }
+                for stage, workers in self.workers.items()
+            }
+
+    def report(self):
+        """ return counters, timers, stage utilisation and the work done on each
+            volume as a dict suitable for JSON """
+        stages = self.utilisation()
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "timers": {
+                    name: timer.as_dict() for name, timer in sorted(self.timers.items())
+                },
+                "stages": stages,
+                "volumes": self.volumes,
+            }
+
+    def __getitem__(self, name):
+        return self.counters[name]
+
+
+# statistics for the current run
+stats = RunStats()
+
+
+def peak_rss_mb():
+    """ return peak resident set size of this process in MB """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS but kilobytes on Linux
+    if sys.platform != "darwin":
+        rss *= 1024
+    return rss / (1024 * 1024)
+
+
+class ThreadProfiler:
+    """ cProfile profiler for the main thread and every thread started while it runs;
+        the results of all threads are merged when dumped """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profilers = []
+
+    def _profile_thread(self, frame=None, event=None, arg=None):
+        """ start a profiler for the calling thread
+            installed with threading.setprofile so it's called on the first profile event
+            of each new thread; enabling the profiler replaces it for that thread """
+        # imported here so runs without --cprofile don't load the profiler
+        import cProfile
+
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profilers.append(profiler)
+        profiler.enable()
+
+    def start(self):
+        """ start profiling """
+        # from python 3.12 cProfile uses sys.monitoring which sees every thread
+        # and allows only one active profiler
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._profile_thread)
+        self._profile_thread()
+
+    def dump(self, path):
+        """ stop profiling and write the merged stats to path in pstats format """
+        import pstats
+
+        threading.setprofile(None)
+        with self._lock:
+            profilers = list(self._profilers)
+        for profiler in profilers:
+            profiler.disable()
+        pstats.Stats(*profilers).dump_stats(path)
@@ -0,0 +1,100 @@
+# metadata undo log for photosmeta
+# instead of exiftool's full filename.ext_original backup copy of each file,
+# records the previous value of each tag photosmeta changes in a file in an
+# append-only log of JSON lines; --rollback writes the previous values back
+# entries are flushed to disk before the files they describe are written
+
+import json
+import os
+import threading
+
+from ._util import ends_with_newline
+
+# bump if the format of the undo log changes
+_UNDO_VERSION = 1
+
+
+class UndoLogError(Exception):
+    """ raised when an undo log can't be read """
+
+
+def _check_header(path, line):
+    """ raise UndoLogError if line is not the first line of an undo log """
+    try:
+        header = json.loads(line)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("undo") != _UNDO_VERSION:
+        raise UndoLogError(f"{path} is not a photosmeta undo log")
+
+
+class UndoLog:
+    """ append-only log of the previous tag values of files before they're written
+        safe to use from multiple threads """
+
+    def __init__(self, path):
+        """ open undo log at path, appending to it if it exists """
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = []
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            with open(path, encoding="utf-8") as fd:
+                _check_header(path, fd.readline())
+        self._fd = open(path, "a", encoding="utf-8")
+        if not ends_with_newline(path):
+            # don't append to a partial last line
+            self._fd.write("\n")
+        if new:
+            self._pending.append(json.dumps({"undo": _UNDO_VERSION}))
+            self.flush()
+
+    def record(self, path, previous):
+        """ record the previous values of tags in file path
+            previous: dict of tag -> value read before the write (None if not set) """
+        line = json.dumps({"path": path, "tags": previous}, ensure_ascii=False)
+        with self._lock:
+            self._pending.append(line)
+
+    def flush(self):
+        """ write recorded entries to disk; call before writing the files """
+        with self._lock:
+            if not self._pending:
+                return
+            self._fd.write("\n".join(self._pending) + "\n")
+            self._pending = []
+            self._fd.flush()
+            os.fsync(self._fd.fileno())
+
+    def close(self):
+        """ flush recorded entries and close the log """
+        self.flush()
+        self._fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_undo_log(path):
+    """ return dict of file path -> dict of tag -> value to restore from undo log at path
+        if a file was written more than once, the value from before the first write
+        is restored
+        raises UndoLogError if path is not an undo log """
+    restore = {}
+    with open(path, encoding="utf-8") as fd:
+        for lineno, line in enumerate(fd):
+            if lineno == 0:
+                _check_header(path, line)
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # last line may be partial if the process died while writing it
+                continue
+            previous = restore.setdefault(entry["path"], {})
+            for tag, value in entry["tags"].items():
+                previous.setdefault(tag, value)
+    return restore
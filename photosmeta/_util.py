@@ -1,11 +1,10 @@
 # util functions for photosmeta
 
+import os
 import os.path
 import pathlib
 import subprocess
 
-import osxmetadata
-
 
 def check_file_exists(filename):
     """ return true if a file exists on disk and is not a directory, """
@@ -15,19 +14,100 @@ def check_file_exists(filename):
     return os.path.exists(filename) and not os.path.isdir(filename)
 
 
+def file_stat(path):
+    """ return [size, mtime_ns] of file at path or None if it doesn't exist """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def ends_with_newline(path):
+    """ return True if file at path ends with a newline (or is empty) """
+    with open(path, "rb") as fd:
+        if fd.seek(0, os.SEEK_END) == 0:
+            return True
+        fd.seek(-1, os.SEEK_END)
+        return fd.read(1) == b"\n"
+
+
+def _dd_to_dms(dd):
+    """ convert lat or lon in decimal degrees (dd) to degrees, minutes, seconds """
+    """ return tuple of int(deg), int(min), float(sec) """
+    dd = float(dd)
+    negative = dd < 0
+    dd = abs(dd)
+    min_, sec_ = divmod(dd * 3600, 60)
+    deg_, min_ = divmod(min_, 60)
+    if negative:
+        if deg_ > 0:
+            deg_ = deg_ * -1
+        elif min_ > 0:
+            min_ = min_ * -1
+        else:
+            sec_ = sec_ * -1
+
+    return int(deg_), int(min_), sec_
+
+
+def dd_to_dms_str(lat, lon):
+    """ convert latitude, longitude in degrees to degrees, minutes, seconds as string """
+    """ returns: string tuple in format ("51 deg 30' 12.86\" N", "0 deg 7' 54.50\" W"), """
+    """ the format used by exiftool's json output """
+    """ same as osxphotos.utils.dd_to_dms_str, copied so osxphotos isn't imported to plan """
+    lat_deg, lat_min, lat_sec = _dd_to_dms(lat)
+    lon_deg, lon_min, lon_sec = _dd_to_dms(lon)
+
+    lat_hemisphere = "S" if any([lat_deg < 0, lat_min < 0, lat_sec < 0]) else "N"
+    lon_hemisphere = "W" if any([lon_deg < 0, lon_min < 0, lon_sec < 0]) else "E"
+
+    lat_str = (
+        f"{abs(lat_deg)} deg {abs(lat_min)}' {abs(lat_sec):.2f}\" {lat_hemisphere}"
+    )
+    lon_str = (
+        f"{abs(lon_deg)} deg {abs(lon_min)}' {abs(lon_sec):.2f}\" {lon_hemisphere}"
+    )
+    return lat_str, lon_str
+
+
 def build_list(lst):
-    """ input: array of elements that may be a string or list """
+    """ input: array of elements that may be a string, list or tuple """
     """ returns: appends all input items to a list and returns the list """
     tmplst = []
     for x in lst:
         if x is not None:
-            if isinstance(x, list):
-                tmplst = tmplst + x
+            if isinstance(x, (list, tuple)):
+                tmplst = tmplst + list(x)
             else:
                 tmplst.append(x)
     return tmplst
 
 
+def claim_path(dest, filename, overwrite=False):
+    """ return path in folder dest for a file named filename, as str """
+    """ if overwrite = False (default), the path is 'filename (1).ext', """
+    """     'filename (2).ext', and so on if dest file already exists """
+    """ the name is claimed atomically by creating an empty file so concurrent """
+    """ copies never pick the same name; the caller removes the file if its copy """
+    """ fails so the name isn't left taken by an empty file """
+
+    dest_path = pathlib.Path(dest) / filename
+    if not overwrite:
+        stem, suffix = dest_path.stem, dest_path.suffix
+        count = 1
+        while True:
+            try:
+                os.close(
+                    os.open(dest_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                )
+                break
+            except FileExistsError:
+                dest_path = dest_path.parent / f"{stem} ({count}){suffix}"
+                count += 1
+    return str(dest_path)
+
+
 # TODO: remove this, I don't think it's needed now
 def copyfile_with_osx_metadata(src, dest, overwrite_dest=False, findercomments=False):
     """ copy file from src (source) to dest (destination) """
@@ -74,6 +154,8 @@ def copyfile_with_osx_metadata(src, dest, overwrite_dest=False, findercomments=F
     subprocess.run(["/usr/bin/ditto", src, dest], check=True, stderr=subprocess.PIPE)
 
     if findercomments:
+        import osxmetadata
+
         md_src = osxmetadata.OSXMetaData(src)
         md_dest = osxmetadata.OSXMetaData(dest)
         md_dest.findercomment = md_src.findercomment
@@ -0,0 +1,225 @@
+# storage locality for photosmeta
+# with --by-volume the selected photos are grouped by the volume (device) their files
+# are on and put in on-disk order: by inode on hard disks, where seeks are expensive,
+# by path on other volumes; the volumes are then interleaved so every batch has work
+# for all of them and they're processed at the same time; each volume limits how many
+# of its files are worked on at once, so SSDs run --jobs wide while hard disks run
+# --hdd-jobs streams, and the throughput of each volume is reported
+
+import contextlib
+import os
+import plistlib
+import subprocess
+import sys
+import threading
+import time
+
+
+def _linux_rotational(device):
+    """ return True if block device is a rotational disk, False if it isn't,
+        None if unknown (e.g. network or virtual filesystems) """
+    path = f"/sys/dev/block/{os.major(device)}:{os.minor(device)}"
+    # a partition has no queue of its own, its disk is the folder above it
+    for queue in [path, os.path.join(os.path.realpath(path), "..")]:
+        try:
+            with open(os.path.join(queue, "queue", "rotational")) as fd:
+                return fd.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def _macos_rotational(mount_point):
+    """ return True if the volume mounted at mount_point is on a rotational disk,
+        False if it isn't, None if unknown """
+    try:
+        output = subprocess.run(
+            ["diskutil", "info", "-plist", mount_point],
+            capture_output=True,
+            check=True,
+        ).stdout
+        solid_state = plistlib.loads(output).get("SolidState")
+    except (OSError, subprocess.CalledProcessError, plistlib.InvalidFileException):
+        return None
+    return None if solid_state is None else not solid_state
+
+
+def _mount_point(path, device):
+    """ return the mount point of device, the topmost folder above path on it """
+    path = os.path.abspath(path)
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path or os.stat(parent).st_dev != device:
+            return path
+        path = parent
+
+
+def _inode(path):
+    """ return inode of file at path, 0 if it can't be read """
+    try:
+        return os.stat(path).st_ino
+    except OSError:
+        return 0
+
+
+class Volume:
+    """ a volume files are processed on: its disk type, the number of its files that
+        can be worked on at once and the work done on it in the run """
+
+    def __init__(self, device, mount_point, rotational, workers):
+        self.device = device
+        self.mount_point = mount_point
+        # True for hard disks, None if unknown
+        self.rotational = rotational
+        self.workers = workers
+        self.semaphore = threading.BoundedSemaphore(workers)
+        # photos processed, seconds workers were busy, first and last time worked on
+        self.done = 0
+        self.busy = 0.0
+        self.start = None
+        self.end = None
+
+    @property
+    def name(self):
+        return f"{os.major(self.device)}:{os.minor(self.device)}"
+
+    @property
+    def kind(self):
+        return {True: "hdd", False: "ssd", None: "unknown"}[self.rotational]
+
+
+class Volumes:
+    """ the volumes of the files processed in a run, found from the folders the files
+        are in; volumes of unknown type are treated like SSDs
+        safe to use from multiple threads """
+
+    def __init__(self, jobs, hdd_jobs):
+        """ jobs: number of files worked on at once on SSDs
+            hdd_jobs: number of files worked on at once on hard disks """
+        self._lock = threading.Lock()
+        self._jobs = max(1, jobs)
+        self._hdd_jobs = max(1, hdd_jobs)
+        # st_dev -> Volume
+        self._by_device = {}
+        # folder -> Volume
+        self._by_folder = {}
+
+    def _new_volume(self, device, folder):
+        mount_point = _mount_point(folder, device)
+        if sys.platform == "darwin":
+            rotational = _macos_rotational(mount_point)
+        else:
+            rotational = _linux_rotational(device)
+        workers = self._hdd_jobs if rotational else self._jobs
+        return Volume(device, mount_point, rotational, workers)
+
+    def volume(self, path):
+        """ return Volume file path is on, or will be on if it doesn't exist yet
+            raises OSError if none of the folders above path can be read """
+        folder = os.path.dirname(os.path.abspath(path))
+        with self._lock:
+            volume = self._by_folder.get(folder)
+            if volume is not None:
+                return volume
+            existing = folder
+            while True:
+                try:
+                    device = os.stat(existing).st_dev
+                    break
+                except FileNotFoundError:
+                    parent = os.path.dirname(existing)
+                    if parent == existing:
+                        raise
+                    existing = parent
+            volume = self._by_device.get(device)
+            if volume is None:
+                volume = self._by_device[device] = self._new_volume(device, existing)
+            self._by_folder[folder] = volume
+            return volume
+
+    def schedule(self, photos):
+        """ return the uuids of photos, an iterable of (uuid, path of photo's file),
+            ordered so the volumes are worked on at the same time: each volume's
+            photos are sorted by inode on hard disks and by path otherwise, then
+            the volumes take turns, each adding as many photos as it has workers,
+            in the order the volumes first appear in photos;
+            photos without a file come last """
+        groups = {}
+        no_file = []
+        for uuid, path in photos:
+            try:
+                volume = self.volume(path) if path else None
+            except OSError:
+                volume = None
+            if volume is None:
+                no_file.append(uuid)
+            else:
+                groups.setdefault(volume, []).append((uuid, path))
+        # (turn, volume order, uuids) for each run of photos a volume adds
+        turns = []
+        for order, (volume, group) in enumerate(groups.items()):
+            if volume.rotational:
+                group.sort(key=lambda photo: _inode(photo[1]))
+            else:
+                group.sort(key=lambda photo: photo[1])
+            uuids = [uuid for uuid, _ in group]
+            for turn, start in enumerate(range(0, len(uuids), volume.workers)):
+                turns.append((turn, order, uuids[start : start + volume.workers]))
+        turns.sort(key=lambda run: run[:2])
+        return [uuid for _, _, uuids in turns for uuid in uuids] + no_file
+
+    @contextlib.contextmanager
+    def limit(self, *paths):
+        """ context manager holding one of the workers of the volume of each of paths
+            (None paths are ignored) for the with block; waits until the volumes have
+            a worker free """
+        volumes = {self.volume(path) for path in paths if path}
+        volumes = sorted(volumes, key=lambda volume: volume.device)
+        # always taken in the same order so two blocks can't wait on each other
+        for volume in volumes:
+            volume.semaphore.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                for volume in volumes:
+                    volume.busy += end - start
+                    if volume.start is None or start < volume.start:
+                        volume.start = start
+                    if volume.end is None or end > volume.end:
+                        volume.end = end
+            for volume in reversed(volumes):
+                volume.semaphore.release()
+
+    def record_done(self, path):
+        """ record that the photo whose file is path was processed """
+        volume = self.volume(path)
+        with self._lock:
+            volume.done += 1
+
+    def report(self):
+        """ return list of dict with the work done on each volume: photos processed,
+            seconds from the first to the last work on it, photos per second and
+            the utilisation of its workers """
+        with self._lock:
+            volumes = list(self._by_device.values())
+            report = []
+            for volume in volumes:
+                seconds = volume.end - volume.start if volume.start is not None else 0.0
+                report.append(
+                    {
+                        "volume": volume.name,
+                        "mount_point": volume.mount_point,
+                        "kind": volume.kind,
+                        "workers": volume.workers,
+                        "photos": volume.done,
+                        "seconds": seconds,
+                        "photos_per_second": volume.done / seconds if seconds else 0.0,
+                        "utilisation": volume.busy / (volume.workers * seconds)
+                        if seconds
+                        else 0.0,
+                    }
+                )
+            return report
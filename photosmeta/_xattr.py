@@ -0,0 +1,24 @@
+# write Photos keywords/persons to a file's Finder tags (kMDItemUserTags)
+
+from osxmetadata import OSXMetaData, Tag
+
+
+def write_user_tags(path, tags):
+    """ merge tags into the kMDItemUserTags extended attribute of file at path
+        existing user tags (and their colors) are kept;
+        the attribute is read once and, only if a tag is missing, written once
+        path: path to file
+        tags: list of tag names
+        returns True if the attribute was written, False if it already had every tag """
+    meta = OSXMetaData(path)
+    current = list(meta.tags)
+    names = {tag.name for tag in current}
+    new_tags = []
+    for name in tags:
+        if name not in names:
+            names.add(name)
+            new_tags.append(Tag(name))
+    if not new_tags:
+        return False
+    meta.tags = current + new_tags
+    return True
@@ -0,0 +1,256 @@
+# native XMP sidecar writer for photosmeta
+# serializes the tags photosmeta writes (see _diff.WRITE_TAGS) to an XMP sidecar
+# file next to the image without running exiftool; an existing sidecar is merged:
+# list properties (keywords, persons) are combined, other properties are replaced
+# and properties photosmeta doesn't write are left untouched
+
+import os
+import xml.etree.ElementTree as ET
+
+from ._diff import _gps_value
+
+NS = {
+    "x": "adobe:ns:meta/",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "digiKam": "http://www.digikam.org/ns/1.0/",
+    "Iptc4xmpExt": "http://iptc.org/std/Iptc4xmpExt/2008-02-29/",
+    "exif": "http://ns.adobe.com/exif/1.0/",
+    "photoshop": "http://ns.adobe.com/photoshop/1.0/",
+    "xmp": "http://ns.adobe.com/xap/1.0/",
+}
+
+for _prefix, _uri in NS.items():
+    ET.register_namespace(_prefix, _uri)
+
+_XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+# XMP property types
+_BAG = "Bag"
+_SEQ = "Seq"
+_ALT = "Alt"
+_TEXT = "Text"
+
+# XMP property -> type; list types are merged with an existing sidecar
+_PROPERTIES = {
+    "dc:subject": _BAG,
+    "digiKam:TagsList": _SEQ,
+    "Iptc4xmpExt:PersonInImage": _BAG,
+    "dc:title": _ALT,
+    "dc:description": _ALT,
+    "exif:GPSLatitude": _TEXT,
+    "exif:GPSLongitude": _TEXT,
+    "exif:DateTimeOriginal": _TEXT,
+    "photoshop:DateCreated": _TEXT,
+    "xmp:ModifyDate": _TEXT,
+}
+
+# exiftool tag name (with -G) of the XMP properties photosmeta reads
+_TAG_NAMES = {
+    "dc:subject": "XMP:Subject",
+    "digiKam:TagsList": "XMP:TagsList",
+    "Iptc4xmpExt:PersonInImage": "XMP:PersonInImage",
+    "dc:title": "XMP:Title",
+    "dc:description": "XMP:Description",
+}
+
+_XPACKET_BEGIN = '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+_XPACKET_END = '\n<?xpacket end="w"?>\n'
+
+
+def _qname(name):
+    """ return ElementTree {uri}local name for prefix:local name """
+    prefix, local = name.split(":")
+    return f"{{{NS[prefix]}}}{local}"
+
+
+def sidecar_path(path):
+    """ return path of the XMP sidecar for image at path: image.jpg -> image.xmp """
+    return f"{os.path.splitext(path)[0]}.xmp"
+
+
+def _xmp_gps(value, ref):
+    """ return XMP GPS coordinate "DDD,MM.mmmmmmK" from a GPS value
+        (DMS string or decimal degrees) and its reference (North, South, East, West) """
+    value = _gps_value(value)
+    degrees = int(value)
+    minutes = (value - degrees) * 60
+    return f"{degrees},{minutes:.6f}{ref[0].upper()}"
+
+
+def _xmp_date(value, offset=None):
+    """ return XMP date "YYYY-MM-DDTHH:MM:SS[+HH:MM]" from EXIF date "YYYY:MM:DD HH:MM:SS" """
+    date, _, time = value.partition(" ")
+    return f"{date.replace(':', '-')}T{time}{offset or ''}"
+
+
+def xmp_properties(tags):
+    """ return dict of XMP property -> value (str or list of str) for the tags
+        photosmeta writes
+        tags: dict of tag -> value as built by plan_photo (e.g. XMP:Subject, EXIF:GPSLatitude) """
+    props = {}
+
+    def _list(tag):
+        value = tags[tag]
+        return [str(v) for v in value] if isinstance(value, (list, tuple)) else [value]
+
+    if "XMP:Subject" in tags:
+        props["dc:subject"] = _list("XMP:Subject")
+    if "XMP:TagsList" in tags:
+        props["digiKam:TagsList"] = _list("XMP:TagsList")
+    if "XMP:PersonInImage" in tags:
+        props["Iptc4xmpExt:PersonInImage"] = _list("XMP:PersonInImage")
+    if "XMP:Title" in tags:
+        props["dc:title"] = tags["XMP:Title"]
+    description = tags.get("XMP:Description", tags.get("EXIF:ImageDescription"))
+    if description:
+        props["dc:description"] = description
+    for tag, prop in [
+        ("EXIF:GPSLatitude", "exif:GPSLatitude"),
+        ("EXIF:GPSLongitude", "exif:GPSLongitude"),
+    ]:
+        if tag in tags and f"{tag}Ref" in tags:
+            props[prop] = _xmp_gps(tags[tag], tags[f"{tag}Ref"])
+    if "EXIF:DateTimeOriginal" in tags:
+        date = _xmp_date(
+            tags["EXIF:DateTimeOriginal"], tags.get("EXIF:OffsetTimeOriginal")
+        )
+        props["exif:DateTimeOriginal"] = date
+        props["photoshop:DateCreated"] = date
+    if "EXIF:ModifyDate" in tags:
+        props["xmp:ModifyDate"] = _xmp_date(tags["EXIF:ModifyDate"])
+    return props
+
+
+def _empty_packet():
+    """ return root element of an XMP packet with one empty rdf:Description """
+    root = ET.Element(_qname("x:xmpmeta"))
+    rdf = ET.SubElement(root, _qname("rdf:RDF"))
+    ET.SubElement(rdf, _qname("rdf:Description"), {_qname("rdf:about"): ""})
+    return root
+
+
+def _read_property(descriptions, name):
+    """ return value of property name (str, list of str or None) found in
+        any of descriptions, as an attribute or an element """
+    qname = _qname(name)
+    for description in descriptions:
+        if qname in description.attrib:
+            return description.attrib[qname]
+        element = description.find(qname)
+        if element is None:
+            continue
+        items = list(element.iter(_qname("rdf:li")))
+        if _PROPERTIES[name] in (_BAG, _SEQ):
+            return [li.text or "" for li in items]
+        if _PROPERTIES[name] == _ALT:
+            # the x-default value, or the first if there isn't one
+            for li in items:
+                if li.get(_XML_LANG) == "x-default":
+                    return li.text or ""
+            return items[0].text or "" if items else None
+        return element.text
+    return None
+
+
+def _remove_property(descriptions, name):
+    """ remove property name from descriptions """
+    qname = _qname(name)
+    for description in descriptions:
+        description.attrib.pop(qname, None)
+        for element in description.findall(qname):
+            description.remove(element)
+
+
+def _add_property(description, name, value):
+    """ add property name with value to description """
+    kind = _PROPERTIES[name]
+    element = ET.SubElement(description, _qname(name))
+    if kind == _TEXT:
+        element.text = value
+        return
+    container = ET.SubElement(element, _qname(f"rdf:{kind}"))
+    for item in [value] if kind == _ALT else value:
+        li = ET.SubElement(container, _qname("rdf:li"))
+        if kind == _ALT:
+            li.set(_XML_LANG, "x-default")
+        li.text = item
+
+
+def read_xmp_tags(data):
+    """ return dict of exiftool tag name (e.g. XMP:Subject) -> value for the XMP
+        properties photosmeta reads found in XMP packet data (bytes);
+        list properties are returned as lists
+        raises xml.etree.ElementTree.ParseError if data is not valid XML """
+    root = ET.fromstring(data)
+    descriptions = root.findall(f".//{_qname('rdf:Description')}")
+    tags = {}
+    for name, tag in _TAG_NAMES.items():
+        value = _read_property(descriptions, name)
+        if value is not None:
+            tags[tag] = value
+    return tags
+
+
+def _parse(path):
+    """ return root element of XML file at path
+        the file's namespace prefixes are registered so they're kept when it's written """
+    root = None
+    for event, item in ET.iterparse(path, events=("start-ns", "start")):
+        if event == "start-ns":
+            prefix, uri = item
+            try:
+                ET.register_namespace(prefix, uri)
+            except ValueError:
+                # prefix reserved by ElementTree (ns0, ns1, ...)
+                pass
+        elif root is None:
+            root = item
+    return root
+
+
+def write_sidecar(path, tags):
+    """ write tags to the XMP sidecar for the image at path, merging with an
+        existing sidecar
+        tags: dict of tag -> value as built by plan_photo
+        returns True if the sidecar was written, False if it was already up to date
+        raises xml.etree.ElementTree.ParseError if the existing sidecar is not valid XML """
+    xmp_path = sidecar_path(path)
+    try:
+        root = _parse(xmp_path)
+    except FileNotFoundError:
+        root = _empty_packet()
+    descriptions = root.findall(f".//{_qname('rdf:Description')}")
+    if not descriptions:
+        rdf = root.find(_qname("rdf:RDF"))
+        if rdf is None:
+            rdf = ET.SubElement(root, _qname("rdf:RDF"))
+        descriptions = [
+            ET.SubElement(rdf, _qname("rdf:Description"), {_qname("rdf:about"): ""})
+        ]
+
+    changed = False
+    for name, value in xmp_properties(tags).items():
+        current = _read_property(descriptions, name)
+        if isinstance(value, list):
+            # merge list values, keeping existing values first
+            current = current if isinstance(current, list) else []
+            value = current + [v for v in value if v not in current]
+        if value == current:
+            continue
+        _remove_property(descriptions, name)
+        _add_property(descriptions[0], name, value)
+        changed = True
+
+    if not changed:
+        return False
+
+    if hasattr(ET, "indent"):
+        # python >= 3.9
+        ET.indent(root, space=" ")
+    data = _XPACKET_BEGIN + ET.tostring(root, encoding="unicode") + _XPACKET_END
+    tmp_path = f"{xmp_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fd:
+        fd.write(data)
+    os.replace(tmp_path, xmp_path)
+    return True
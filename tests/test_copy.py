@@ -0,0 +1,110 @@
+# tests for the export copy backends: copies replace the destination with a new
+# file, so a destination hard linked to the photo's file never changes the photo
+
+import errno
+import hashlib
+import os
+
+import pytest
+
+from photosmeta._copy import HARDLINK, STREAM, break_link, copy_data
+
+DATA = b"photo data" * 1000
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / "IMG_0001.jpg"
+    path.write_bytes(DATA)
+    os.utime(path, (1_500_000_000, 1_500_000_000))
+    return str(path)
+
+
+def _setxattr(path, name, value):
+    """ set extended attribute of path, skip the test if that isn't possible """
+    if hasattr(os, "setxattr"):
+        setxattr = os.setxattr
+    else:
+        # macOS
+        setxattr = pytest.importorskip("xattr").setxattr
+    try:
+        setxattr(path, name, value)
+    except OSError as e:
+        if e.errno in (errno.ENOTSUP, errno.EOPNOTSUPP):
+            pytest.skip("filesystem doesn't support extended attributes")
+        raise
+
+
+def _getxattr(path, name):
+    if hasattr(os, "getxattr"):
+        return os.getxattr(path, name)
+    return pytest.importorskip("xattr").getxattr(path, name)
+
+
+def _read(path):
+    with open(path, "rb") as fd:
+        return fd.read()
+
+
+@pytest.mark.parametrize("mode", ["auto", "copy", "stream"])
+def test_copy_data(src, tmp_path, mode):
+    dest = str(tmp_path / "export.jpg")
+    digest = hashlib.sha256() if mode == "stream" else None
+    method = copy_data(src, dest, "copy" if mode == "stream" else mode, digest)
+    assert _read(dest) == DATA
+    assert os.stat(dest).st_mtime == os.stat(src).st_mtime
+    if digest is not None:
+        assert method == STREAM
+        assert digest.hexdigest() == hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.mark.parametrize("mode", ["auto", "copy", "stream"])
+def test_copy_data_over_hard_link(src, tmp_path, mode):
+    # e.g. --export-update --copy-mode copy over an earlier hardlink export
+    dest = str(tmp_path / "export.jpg")
+    os.link(src, dest)
+    with open(src, "ab") as fd:
+        fd.write(b"edited")
+    digest = hashlib.sha256() if mode == "stream" else None
+    copy_data(src, dest, "copy" if mode == "stream" else mode, digest)
+    assert _read(src) == DATA + b"edited"
+    assert _read(dest) == DATA + b"edited"
+    assert not os.path.samefile(src, dest)
+
+
+@pytest.mark.parametrize("mode", ["auto", "copy", "stream"])
+def test_copy_data_keeps_xattrs(src, tmp_path, mode):
+    # e.g. Finder tags, which --xattrtag merges with
+    _setxattr(src, "user.photosmeta.test", b"Beach")
+    dest = str(tmp_path / "export.jpg")
+    digest = hashlib.sha256() if mode == "stream" else None
+    copy_data(src, dest, "copy" if mode == "stream" else mode, digest)
+    assert _getxattr(dest, "user.photosmeta.test") == b"Beach"
+
+
+def test_copy_data_hardlink(src, tmp_path):
+    dest = tmp_path / "export.jpg"
+    dest.write_bytes(b"earlier export")
+    assert copy_data(src, str(dest), HARDLINK) == HARDLINK
+    assert os.path.samefile(src, dest)
+
+
+def test_copy_data_failure_keeps_dest(tmp_path):
+    dest = tmp_path / "export.jpg"
+    dest.write_bytes(b"earlier export")
+    with pytest.raises(FileNotFoundError):
+        copy_data(str(tmp_path / "missing.jpg"), str(dest), "copy")
+    assert dest.read_bytes() == b"earlier export"
+    assert os.listdir(tmp_path) == ["export.jpg"]
+
+
+def test_break_link(src, tmp_path):
+    link = str(tmp_path / "export.jpg")
+    os.link(src, link)
+    break_link(link)
+    assert not os.path.samefile(src, link)
+    assert os.stat(src).st_nlink == 1
+    assert _read(link) == DATA
+    with open(link, "ab") as fd:
+        fd.write(b"tags")
+    assert _read(src) == DATA
@@ -0,0 +1,61 @@
+# tests for exporting a photo's files: a failed copy doesn't leave the export's name
+# taken by an empty file
+
+import errno
+import os
+import stat
+
+import pytest
+
+from photosmeta import _copy
+from photosmeta.__main__ import export_photo
+from photosmeta._copy import CopyModeError
+from photosmeta._planner import ExportOp, FileOp, PhotoPlan
+from photosmeta._util import claim_path
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / "library" / "IMG_0001.jpg"
+    path.parent.mkdir()
+    path.write_bytes(b"photo data")
+    return str(path)
+
+
+def _plan(photo, dest, copy_mode):
+    return PhotoPlan(
+        "uuid",
+        "IMG_0001.jpg",
+        files=[FileOp(photo)],
+        export=ExportOp(dest, "IMG_0001.jpg", copy_mode=copy_mode),
+    )
+
+
+def test_claim_path(tmp_path):
+    assert claim_path(tmp_path, "IMG_0001.jpg") == str(tmp_path / "IMG_0001.jpg")
+    assert claim_path(tmp_path, "IMG_0001.jpg") == str(tmp_path / "IMG_0001 (1).jpg")
+    mode = stat.S_IMODE(os.stat(tmp_path / "IMG_0001.jpg").st_mode)
+    assert not mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def test_export_photo(photo, tmp_path):
+    dest = tmp_path / "export"
+    path = export_photo(_plan(photo, str(dest), "copy"), verbose=False)
+    assert path == str(dest / "IMG_0001.jpg")
+    assert os.listdir(dest) == ["IMG_0001.jpg"]
+
+
+def test_export_photo_failed_copy(photo, tmp_path, monkeypatch):
+    # e.g. --copy-mode hardlink to another filesystem
+    def _link(src, dst):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    dest = tmp_path / "export"
+    with monkeypatch.context() as patch:
+        patch.setattr(_copy.os, "link", _link)
+        with pytest.raises(CopyModeError):
+            export_photo(_plan(photo, str(dest), "hardlink"), verbose=False)
+    assert os.listdir(dest) == []
+    # a retry gets the photo's name, not "IMG_0001 (1).jpg"
+    path = export_photo(_plan(photo, str(dest), "copy"), verbose=False)
+    assert path == str(dest / "IMG_0001.jpg")
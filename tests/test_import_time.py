@@ -0,0 +1,54 @@
+# regression tests for the start up cost of photosmeta: the heavy dependencies
+# must only be imported on the code paths that need them
+
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# cProfile and pstats are only needed with --cprofile
+HEAVY_MODULES = {"osxphotos", "osxmetadata", "tqdm", "cProfile", "pstats"}
+
+# seconds importing photosmeta.__main__ may take; PHOTOSMETA_IMPORT_BUDGET overrides
+IMPORT_BUDGET = float(os.environ.get("PHOTOSMETA_IMPORT_BUDGET", "0.3"))
+
+
+def _importtime(*args):
+    """ run python -X importtime with args, return dict of module -> cumulative seconds """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=REPO_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative) / 1_000_000
+    return modules
+
+
+def _heavy(modules):
+    return sorted({name.split(".")[0] for name in modules} & HEAVY_MODULES)
+
+
+def test_version_does_not_import_heavy_modules():
+    assert _heavy(_importtime("-m", "photosmeta", "--version")) == []
+
+
+def test_import_does_not_import_heavy_modules():
+    assert _heavy(_importtime("-c", "import photosmeta.__main__")) == []
+
+
+def test_import_time_budget():
+    # best of three so a busy machine doesn't fail the test
+    seconds = min(
+        _importtime("-c", "import photosmeta.__main__")["photosmeta.__main__"]
+        for _ in range(3)
+    )
+    assert seconds < IMPORT_BUDGET, f"import took {seconds:.3f}s"
@@ -0,0 +1,159 @@
+# tests for the native tag reader: the tags of JPEG and HEIF files built here are
+# read as exiftool -G -n -j would return them, files it doesn't handle return None
+
+import struct
+
+import pytest
+
+from photosmeta._jpeg import read_jpeg_tags
+
+DESCRIPTION = "A day at the beach"
+DATE = "2020:01:02 03:04:05"
+
+XMP = b"""<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:Iptc4xmpExt="http://iptc.org/std/Iptc4xmpExt/2008-02-29/">
+   <dc:subject><rdf:Bag><rdf:li>Beach</rdf:li><rdf:li>Family</rdf:li></rdf:Bag></dc:subject>
+   <Iptc4xmpExt:PersonInImage><rdf:Bag><rdf:li>Jane Doe</rdf:li></rdf:Bag></Iptc4xmpExt:PersonInImage>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>"""
+
+TAGS = {
+    "EXIF:ImageDescription": DESCRIPTION,
+    "EXIF:DateTimeOriginal": DATE,
+    "XMP:Subject": ["Beach", "Family"],
+    "XMP:PersonInImage": ["Jane Doe"],
+}
+
+
+def _tiff():
+    """ return little-endian TIFF data with ImageDescription in IFD0 and
+        DateTimeOriginal in the EXIF IFD """
+    description = DESCRIPTION.encode() + b"\0"
+    date = DATE.encode() + b"\0"
+    # header, IFD0 with 2 entries at 8, EXIF IFD with 1 entry at 38, values at 56
+    return (
+        b"II*\0"
+        + struct.pack("<I", 8)
+        + struct.pack("<H", 2)
+        + struct.pack("<HHII", 0x010E, 2, len(description), 56)
+        + struct.pack("<HHII", 0x8769, 4, 1, 38)
+        + struct.pack("<I", 0)
+        + struct.pack("<H", 1)
+        + struct.pack("<HHII", 0x9003, 2, len(date), 56 + len(description))
+        + struct.pack("<I", 0)
+        + description
+        + date
+    )
+
+
+def _jpeg():
+    def app1(data):
+        return b"\xff\xe1" + struct.pack(">H", len(data) + 2) + data
+
+    return (
+        b"\xff\xd8"
+        + app1(b"Exif\0\0" + _tiff())
+        + app1(b"http://ns.adobe.com/xap/1.0/\0" + XMP)
+        + b"\xff\xda\0\x02"
+        + b"\xff\xd9"
+    )
+
+
+def _box(type_, payload):
+    return struct.pack(">I4s", 8 + len(payload), type_) + payload
+
+
+def _full_box(type_, version, payload):
+    return _box(type_, bytes([version, 0, 0, 0]) + payload)
+
+
+def _infe(item_id, item_type, content_type=None):
+    payload = struct.pack(">HH4s", item_id, 0, item_type) + b"\0"
+    if content_type is not None:
+        payload += content_type + b"\0"
+    return _full_box(b"infe", 2, payload)
+
+
+def _heif(method=0):
+    """ return HEIF data with an image, an Exif and an XMP item
+        method: iloc construction method of the items, 0 for items in the mdat box,
+        1 for items in the meta box's idat box """
+    items = [
+        (1, b"hvc1", None, b"\0" * 16),
+        (2, b"Exif", None, struct.pack(">I", 6) + b"Exif\0\0" + _tiff()),
+        (3, b"mime", b"application/rdf+xml", XMP),
+    ]
+    contents = b"".join(data for *_, data in items)
+    # offsets of the items from the start of contents
+    relative, offset = [], 0
+    for *_, data in items:
+        relative.append(offset)
+        offset += len(data)
+
+    ftyp = _box(b"ftyp", b"heic" + b"\0\0\0\0" + b"mif1heic")
+    hdlr = _full_box(b"hdlr", 0, b"\0" * 4 + b"pict" + b"\0" * 13)
+    iinf = _full_box(
+        b"iinf",
+        0,
+        struct.pack(">H", len(items))
+        + b"".join(
+            _infe(item_id, type_, content) for item_id, type_, content, _ in items
+        ),
+    )
+
+    def meta(offsets):
+        # iloc version 1: 4 byte offsets and lengths, no base offset
+        iloc = bytes([0x44, 0x00]) + struct.pack(">H", len(items))
+        for (item_id, *_, data), offset in zip(items, offsets):
+            iloc += struct.pack(">HHHHII", item_id, method, 0, 1, offset, len(data))
+        boxes = hdlr + _full_box(b"iloc", 1, iloc) + iinf
+        if method == 1:
+            boxes += _box(b"idat", contents)
+        return _full_box(b"meta", 0, boxes)
+
+    if method == 1:
+        return ftyp + meta(relative)
+    start = len(ftyp) + len(meta(relative)) + 8
+    return ftyp + meta([start + r for r in relative]) + _box(b"mdat", contents)
+
+
+def _write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_jpeg(tmp_path):
+    path = _write(tmp_path, "IMG_0001.jpg", _jpeg())
+    assert read_jpeg_tags(path) == {"SourceFile": path, **TAGS}
+
+
+@pytest.mark.parametrize("method", [0, 1])
+def test_heif(tmp_path, method):
+    path = _write(tmp_path, "IMG_0001.heic", _heif(method))
+    assert read_jpeg_tags(path) == {"SourceFile": path, **TAGS}
+
+
+def test_heif_selected_tags(tmp_path):
+    path = _write(tmp_path, "IMG_0001.heic", _heif())
+    assert read_jpeg_tags(path, ["XMP:Subject", "IPTC:Keywords"]) == {
+        "SourceFile": path,
+        "XMP:Subject": ["Beach", "Family"],
+    }
+
+
+def test_heif_item_in_other_item(tmp_path):
+    # construction method 2 (item offsets) is left to exiftool
+    path = _write(tmp_path, "IMG_0001.heic", _heif(method=2))
+    assert read_jpeg_tags(path) is None
+
+
+@pytest.mark.parametrize(
+    "data", [b"", b"not an image", _heif()[:100], _box(b"ftyp", b"qt  \0\0\0\0")]
+)
+def test_unsupported(tmp_path, data):
+    assert read_jpeg_tags(_write(tmp_path, "IMG_0001.heic", data)) is None
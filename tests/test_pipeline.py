@@ -0,0 +1,50 @@
+# tests for the pipeline stages: items are handed on in order and anything raised
+# by a stage's producer is raised again in the consumer
+
+import pytest
+
+from photosmeta._pipeline import chunked, stage
+
+
+def _raise_after(items, error):
+    yield from items
+    raise error
+
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_stage():
+    assert list(stage(iter(range(10)), maxsize=1)) == list(range(10))
+
+
+def test_stage_exception():
+    items = []
+    with pytest.raises(ValueError, match="bad photo"):
+        for item in stage(_raise_after([1, 2], ValueError("bad photo"))):
+            items.append(item)
+    assert items == [1, 2]
+
+
+def test_stage_system_exit():
+    # e.g. sys.exit() from get_exiftool_path in the read stage
+    items = []
+    with pytest.raises(SystemExit, match="Could not find exiftool"):
+        for item in stage(_raise_after([1], SystemExit("Could not find exiftool"))):
+            items.append(item)
+    assert items == [1]
+
+
+def test_stage_consumer_stops_early():
+    closed = []
+
+    def _items():
+        try:
+            yield from range(100)
+        finally:
+            closed.append(True)
+
+    for item in stage(_items()):
+        break
+    assert closed == [True]
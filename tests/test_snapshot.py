@@ -0,0 +1,88 @@
+# tests for the library snapshot: it's built from the library a chunk of photos at
+# a time and identifies the library by the database file that changes
+
+import datetime
+import types
+
+from photosmeta._select import _SELECT_BATCH_SIZE
+from photosmeta._snapshot import LibrarySnapshot, library_db_file, library_key
+
+
+def _photoinfo(uuid):
+    return types.SimpleNamespace(
+        uuid=uuid,
+        filename=f"{uuid}.jpg",
+        original_filename=f"{uuid}.jpg",
+        path=f"/library/originals/{uuid}.jpg",
+        ismissing=False,
+        keywords=["Beach"],
+        persons=[],
+        albums=[],
+        title=None,
+        description=None,
+        location=(None, None),
+        date=datetime.datetime(2020, 1, 2),
+        date_modified=None,
+        hasadjustments=False,
+        path_edited=None,
+    )
+
+
+class PhotosDB:
+    """ osxphotos.PhotosDB creating a PhotoInfo for each photo photos() returns """
+
+    def __init__(self, count):
+        self.library_path = "/library"
+        self._dbphotos = {f"uuid{n:05d}": {} for n in range(count)}
+        self.keywords_as_dict = {"Beach": count}
+        self.persons_as_dict = {}
+        self.albums_as_dict = {}
+        # number of PhotoInfo created by each call of photos()
+        self.calls = []
+
+    def photos(self, uuid=None):
+        uuids = uuid if uuid else list(self._dbphotos)
+        self.calls.append(len(uuids))
+        return [_photoinfo(u) for u in uuids if u in self._dbphotos]
+
+
+def test_from_photosdb():
+    photosdb = PhotosDB(2 * _SELECT_BATCH_SIZE + 1)
+    snapshot = LibrarySnapshot.from_photosdb(photosdb)
+    assert [p.uuid for p in snapshot.photos()] == list(photosdb._dbphotos)
+    assert snapshot.keywords_as_dict == {"Beach": 2 * _SELECT_BATCH_SIZE + 1}
+    # never a PhotoInfo for every photo at once
+    assert photosdb.calls == [_SELECT_BATCH_SIZE, _SELECT_BATCH_SIZE, 1]
+
+
+def _library(tmp_path, names):
+    library = tmp_path / "Photos Library.photoslibrary"
+    (library / "database").mkdir(parents=True)
+    for name in names:
+        (library / "database" / name).write_bytes(b"")
+    return library
+
+
+def test_library_db_file(tmp_path):
+    library = _library(tmp_path, ["photos.db", "Photos.sqlite"])
+    sqlite = str(library / "database" / "Photos.sqlite")
+    assert library_db_file(str(library)) == sqlite
+    # photos.db of Photos 5 and later is a stub, the library is in Photos.sqlite
+    assert library_db_file(str(library / "database" / "photos.db")) == sqlite
+    assert library_db_file(sqlite) == sqlite
+
+
+def test_library_db_file_photos_4(tmp_path):
+    library = _library(tmp_path, ["photos.db"])
+    photos_db = str(library / "database" / "photos.db")
+    assert library_db_file(str(library)) == photos_db
+    assert library_db_file(photos_db) == photos_db
+
+
+def test_library_key_follows_photos_sqlite(tmp_path):
+    library = _library(tmp_path, ["photos.db", "Photos.sqlite"])
+    photos_db = str(library / "database" / "photos.db")
+    key = library_key(photos_db)
+    assert key == library_key(str(library))
+    (library / "database" / "Photos.sqlite-wal").write_bytes(b"changes")
+    assert library_key(photos_db) != key
@@ -0,0 +1,42 @@
+# tests for --by-volume scheduling: each volume's photos are in on-disk order and the
+# volumes take turns so they're worked on at the same time
+
+import pytest
+
+from photosmeta._volumes import Volume, Volumes
+
+
+@pytest.fixture
+def volumes(monkeypatch):
+    """ Volumes with an SSD (/ssd, 3 workers) and a hard disk (/hdd, 1 worker) """
+    volumes = Volumes(jobs=3, hdd_jobs=1)
+    by_name = {
+        "ssd": Volume(1, "/ssd", False, 3),
+        "hdd": Volume(2, "/hdd", True, 1),
+    }
+    monkeypatch.setattr(volumes, "volume", lambda path: by_name[path.split("/")[1]])
+    # hard disk photos are sorted by inode, here the number in the name
+    monkeypatch.setattr(
+        "photosmeta._volumes._inode", lambda path: int(path.rsplit("/", 1)[1])
+    )
+    return volumes
+
+
+def test_schedule_interleaves_volumes(volumes):
+    photos = [(f"ssd{n}", f"/ssd/{n:02d}") for n in [5, 1, 4, 2, 6, 3]]
+    photos += [(f"hdd{n}", f"/hdd/{n}") for n in [30, 10, 20]]
+    photos.insert(2, ("nofile", None))
+    assert volumes.schedule(photos) == [
+        # each turn, the SSD adds 3 photos and the hard disk 1
+        *["ssd1", "ssd2", "ssd3"],
+        "hdd10",
+        *["ssd4", "ssd5", "ssd6"],
+        "hdd20",
+        "hdd30",
+        "nofile",
+    ]
+
+
+def test_schedule_one_volume(volumes):
+    photos = [(f"hdd{n}", f"/hdd/{n}") for n in [3, 1, 2]]
+    assert volumes.schedule(photos) == ["hdd1", "hdd2", "hdd3"]
@@ -0,0 +1,128 @@
+# tests for the native XMP sidecar writer: sidecars are written, merged with an
+# existing sidecar and read back with read_xmp_tags and, if installed, exiftool
+
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from photosmeta._xmp import read_xmp_tags, sidecar_path, write_sidecar
+
+TAGS = {
+    "XMP:Subject": ["Beach", "Family"],
+    "XMP:TagsList": ["Beach", "Family"],
+    "XMP:PersonInImage": ["Jane Doe", "John Doe"],
+    "XMP:Title": "Day at the beach",
+    "XMP:Description": "Sand & sea <3",
+    "EXIF:GPSLatitude": 37.775,
+    "EXIF:GPSLatitudeRef": "North",
+    "EXIF:GPSLongitude": 122.4183,
+    "EXIF:GPSLongitudeRef": "West",
+    "EXIF:DateTimeOriginal": "2020:01:02 03:04:05",
+    "EXIF:OffsetTimeOriginal": "+01:00",
+}
+
+# sidecar written by another program, with a property photosmeta doesn't write
+EXISTING = """<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:xmp="http://ns.adobe.com/xap/1.0/"
+    xmp:Rating="4">
+   <dc:subject>
+    <rdf:Bag>
+     <rdf:li>Holiday</rdf:li>
+     <rdf:li>Beach</rdf:li>
+    </rdf:Bag>
+   </dc:subject>
+   <dc:title>
+    <rdf:Alt>
+     <rdf:li xml:lang="x-default">Old title</rdf:li>
+    </rdf:Alt>
+   </dc:title>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>
+"""
+
+
+def _read(path):
+    with open(sidecar_path(path), "rb") as fd:
+        return read_xmp_tags(fd.read())
+
+
+def _exiftool(path):
+    """ return tags of the sidecar for path as read by exiftool -j -G -n """
+    output = subprocess.run(
+        ["exiftool", "-j", "-G", "-n", sidecar_path(path)],
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    return json.loads(output)[0]
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "IMG_0001.jpg"
+    path.write_bytes(b"")
+    return str(path)
+
+
+def test_sidecar_path():
+    assert sidecar_path("/photos/IMG_0001.jpg") == "/photos/IMG_0001.xmp"
+
+
+def test_write_sidecar_round_trip(image):
+    assert write_sidecar(image, TAGS)
+    assert _read(image) == {
+        "XMP:Subject": ["Beach", "Family"],
+        "XMP:TagsList": ["Beach", "Family"],
+        "XMP:PersonInImage": ["Jane Doe", "John Doe"],
+        "XMP:Title": "Day at the beach",
+        "XMP:Description": "Sand & sea <3",
+    }
+
+
+def test_write_sidecar_unchanged(image):
+    assert write_sidecar(image, TAGS)
+    with open(sidecar_path(image), "rb") as fd:
+        data = fd.read()
+    assert not write_sidecar(image, TAGS)
+    with open(sidecar_path(image), "rb") as fd:
+        assert fd.read() == data
+
+
+def test_write_sidecar_merges_existing(image):
+    with open(sidecar_path(image), "w", encoding="utf-8") as fd:
+        fd.write(EXISTING)
+    assert write_sidecar(image, TAGS)
+    tags = _read(image)
+    # list properties are combined, existing values first
+    assert tags["XMP:Subject"] == ["Holiday", "Beach", "Family"]
+    # other properties are replaced
+    assert tags["XMP:Title"] == "Day at the beach"
+    with open(sidecar_path(image), encoding="utf-8") as fd:
+        data = fd.read()
+    # properties photosmeta doesn't write are kept, with their prefix
+    assert 'xmp:Rating="4"' in data
+    assert "Old title" not in data
+
+
+@pytest.mark.skipif(shutil.which("exiftool") is None, reason="exiftool not installed")
+def test_write_sidecar_read_by_exiftool(image):
+    with open(sidecar_path(image), "w", encoding="utf-8") as fd:
+        fd.write(EXISTING)
+    write_sidecar(image, TAGS)
+    tags = _exiftool(image)
+    assert tags["XMP:Subject"] == ["Holiday", "Beach", "Family"]
+    assert tags["XMP:TagsList"] == ["Beach", "Family"]
+    assert tags["XMP:PersonInImage"] == ["Jane Doe", "John Doe"]
+    assert tags["XMP:Title"] == "Day at the beach"
+    assert tags["XMP:Description"] == "Sand & sea <3"
+    assert tags["XMP:Rating"] == 4
+    assert tags["XMP:GPSLatitude"] == pytest.approx(37.775, abs=1e-6)
+    assert tags["XMP:GPSLongitude"] == pytest.approx(-122.4183, abs=1e-6)
+    assert tags["XMP:DateTimeOriginal"] == "2020:01:02 03:04:05+01:00"